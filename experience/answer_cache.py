@@ -0,0 +1,166 @@
+import copy
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, List
+from configuration import answer_cache_ttl, answer_cache_size, answer_cache_disk_size, answer_cache_file
+from script_registry import registry
+
+CACHE_MODES = ('use', 'refresh', 'bypass')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS answers (
+    key TEXT PRIMARY KEY,
+    created REAL NOT NULL,
+    used REAL NOT NULL,
+    messages TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS answers_used ON answers(used);
+"""
+
+def normalize_query(query: str) -> str:
+    """统一全角/半角字符并合并空白，使只在格式上不同的问题命中同一缓存。"""
+    return ' '.join(unicodedata.normalize('NFKC', query).split())
+
+class AnswerCache:
+    """
+    chat_many 前的回答缓存，键为规范化后的问题 + 站点 URL + 提取脚本版本。
+    内存层是按条数限制的 LRU，磁盘层是 SQLite（同样按条数淘汰最久未用的条目），
+    两层共用 TTL。ttl 为 0 时缓存关闭。
+
+    每次调用可指定 mode：use 先查缓存，refresh 忽略缓存重新查询并更新缓存，
+    bypass 既不读也不写缓存。
+    """
+    def __init__(self, ttl: float = answer_cache_ttl, size: int = answer_cache_size,
+                 disk_size: int = answer_cache_disk_size, path: str = answer_cache_file) -> None:
+        self.ttl = ttl
+        self.size = size
+        self.disk_size = disk_size
+        self.path = path
+        self._memory: "OrderedDict[str, tuple[float, list]]" = OrderedDict()
+        self._conn = None
+        self._lock = threading.Lock()
+        self.metrics = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0, 'expired': 0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0
+
+    def _disk(self):
+        if self._conn is None and self.path and self.disk_size > 0:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.executescript(SCHEMA)
+        return self._conn
+
+    @staticmethod
+    def key(query: str, site: str, code: str = '') -> str:
+        extractor = registry.extractor_key(code) if code else ''
+        return hashlib.sha1('\0'.join((normalize_query(query), site, extractor)).encode('utf-8')).hexdigest()
+
+    def _remember(self, key: str, created: float, messages: list):
+        self._memory[key] = (created, messages)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.size:
+            self._memory.popitem(last=False)
+            self.metrics['evictions'] += 1
+
+    def get(self, key: str) -> List[Dict] | None:
+        """取缓存的消息列表，未命中或已过期时返回 None。"""
+        if not self.enabled:
+            return None
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if entry[0] + self.ttl > now:
+                    self._memory.move_to_end(key)
+                    self.metrics['memory_hits'] += 1
+                    return copy.deepcopy(entry[1])
+                del self._memory[key]
+                self.metrics['expired'] += 1
+            conn = self._disk()
+            if conn is not None:
+                try:
+                    row = conn.execute('SELECT created, messages FROM answers WHERE key = ?', (key,)).fetchone()
+                    if row is not None and row[0] + self.ttl > now:
+                        with conn:
+                            conn.execute('UPDATE answers SET used = ? WHERE key = ?', (now, key))
+                        messages = json.loads(row[1])
+                        self._remember(key, row[0], messages)
+                        self.metrics['disk_hits'] += 1
+                        return copy.deepcopy(messages)
+                    if row is not None:
+                        self.metrics['expired'] += 1
+                except sqlite3.Error:
+                    pass
+            self.metrics['misses'] += 1
+            return None
+
+    def set(self, key: str, messages: List[Dict]):
+        if not self.enabled:
+            return
+        now = time.time()
+        messages = copy.deepcopy(messages)
+        with self._lock:
+            self._remember(key, now, messages)
+            self.metrics['stores'] += 1
+            conn = self._disk()
+            if conn is None:
+                return
+            try:
+                with conn:
+                    conn.execute('INSERT OR REPLACE INTO answers (key, created, used, messages) VALUES (?, ?, ?, ?)',
+                                 (key, now, now, json.dumps(messages, ensure_ascii=False, separators=(',', ':'))))
+                    # 过期的和超出容量的最久未用条目一并删除
+                    conn.execute('DELETE FROM answers WHERE created <= ?', (now - self.ttl,))
+                    removed = conn.execute('DELETE FROM answers WHERE key IN (SELECT key FROM answers ORDER BY used DESC LIMIT -1 OFFSET ?)',
+                                           (self.disk_size,)).rowcount
+                    self.metrics['evictions'] += max(0, removed)
+            except sqlite3.Error:
+                pass
+
+    def lookup_sites(self, query: str, sites: List[Dict], mode: str = 'use') -> Dict[int, List[Dict]]:
+        """按站点配置列表查缓存，返回 {站点下标: 消息列表}；mode 不是 use 时不读缓存。"""
+        if mode not in CACHE_MODES:
+            raise ValueError(f"未知的缓存模式: {mode}，可选: {', '.join(CACHE_MODES)}")
+        if mode != 'use' or not self.enabled:
+            return {}
+        hits = {}
+        for index, data in enumerate(sites):
+            messages = self.get(self.key(query, data['url'], data.get('code', '')))
+            if messages is not None:
+                hits[index] = messages
+        return hits
+
+    def store_sites(self, query: str, sites: List[Dict], results: List, mode: str = 'use'):
+        """把站点的新结果写入缓存，出错的站点和 bypass 模式不写入。"""
+        if mode == 'bypass' or not self.enabled:
+            return
+        for data, result in zip(sites, results):
+            if not isinstance(result, Exception):
+                self.set(self.key(query, data['url'], data.get('code', '')), result)
+
+    def stats(self) -> Dict:
+        """命中/未命中等计数和命中率。"""
+        hits = self.metrics['memory_hits'] + self.metrics['disk_hits']
+        total = hits + self.metrics['misses']
+        return {**self.metrics, 'hits': hits, 'hit_rate': hits / total if total else 0.0, 'memory_entries': len(self._memory)}
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            conn = self._disk()
+            if conn is not None:
+                with conn:
+                    conn.execute('DELETE FROM answers')
+
+answer_cache = AnswerCache()
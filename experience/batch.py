@@ -0,0 +1,122 @@
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import time
+from typing import Dict, List
+from main import run_site, load_sites
+from sessions import SessionManager, get_session_manager, close_sessions
+from browser_pool import close_browser_pool
+from request_routing import router
+from configuration import site_deadline
+
+def query_id(record: Dict) -> str:
+    """问题的稳定标识：优先使用输入中的 id，否则取问题文本的哈希。"""
+    if record.get('id') is not None:
+        return str(record['id'])
+    return hashlib.sha1(record['query'].encode('utf-8')).hexdigest()[:16]
+
+def read_queries(path: str) -> List[Dict]:
+    """读取 JSONL 问题文件，每行是 {"id": ..., "query": ...} 或一个 JSON 字符串。"""
+    records = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            if isinstance(record, str):
+                record = {'query': record}
+            record['id'] = query_id(record)
+            records.append(record)
+    return records
+
+def read_checkpoint(path: str) -> set:
+    """从已有结果文件中读取已完成的 (问题 id, 站点) 对。"""
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # 进程崩溃时最后一行可能没写完整
+                continue
+            if record.get('status') == 'ok':
+                done.add((record['id'], record['site']))
+    return done
+
+async def run_batch(input_path: str, output_path: str, timing: str = None, concurrency: int = 8,
+                    new_chat: bool = True, max_retries: int = 1, sessions: SessionManager = None,
+                    site_deadline: float = site_deadline) -> int:
+    """
+    批量执行问题，结果逐条追加写入 output_path（JSONL），已完成的 (问题, 站点) 对在重跑时跳过。
+    每个 (问题, 站点) 最多等待 site_deadline 秒，超时的部分回答以 partial 状态写入，重跑时会重新查询；
+    熔断中的站点记为 skipped。
+
+    每个站点按顺序处理全部问题，站点之间互不等待：站点 A 可以在站点 B
+    回答第 1 个问题时开始第 2 个问题。浏览器和标签页在整个批次中保持预热。
+
+    Returns:
+        int: 本次新完成的 (问题, 站点) 数
+    """
+    records = read_queries(input_path)
+    sites = load_sites()
+    router.configure_sites(sites)
+    done = read_checkpoint(output_path)
+    sessions = sessions or get_session_manager()
+    semaphore = asyncio.Semaphore(concurrency)
+    completed = [0]
+    with open(output_path, 'a', encoding='utf-8') as out:
+        def write(record):
+            out.write(json.dumps(record, ensure_ascii=False) + '\n')
+            out.flush()
+
+        async def process_site(data):
+            url = data['url']
+            for record in records:
+                if (record['id'], url) in done:
+                    continue
+                for attempt in range(max_retries + 1):
+                    start = time.monotonic()
+                    try:
+                        async with semaphore:
+                            result = await run_site(record['query'], data, sessions, new_chat, timing,
+                                                    site_deadline=site_deadline)
+                    except Exception as e:
+                        if attempt < max_retries:
+                            continue
+                        write({'id': record['id'], 'query': record['query'], 'site': url, 'status': 'error',
+                               'error': str(e), 'elapsed': time.monotonic() - start})
+                    else:
+                        if result.status == 'complete':
+                            write({'id': record['id'], 'query': record['query'], 'site': url, 'status': 'ok',
+                                   'messages': result.messages, 'elapsed': time.monotonic() - start})
+                            completed[0] += 1
+                        else:
+                            write({'id': record['id'], 'query': record['query'], 'site': url, 'status': result.status,
+                                   'error': result.error, 'messages': result.messages, 'elapsed': time.monotonic() - start})
+                    break
+
+        await asyncio.gather(*(process_site(data) for data in sites))
+    return completed[0]
+
+async def main(args):
+    try:
+        return await run_batch(args.input, args.output, args.timing, args.concurrency, not args.continue_chat)
+    finally:
+        await close_sessions()
+        await close_browser_pool()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="从 JSONL 文件批量发送问题，结果增量写入 JSONL 并支持断点续跑")
+    parser.add_argument('input', help='问题文件，每行 {"id": ..., "query": ...}')
+    parser.add_argument('output', help='结果文件，同时作为断点记录')
+    parser.add_argument('--timing', choices=['stealth', 'balanced', 'fast'], default=None, help='节奏配置')
+    parser.add_argument('--concurrency', type=int, default=8, help='同时进行的 (问题, 站点) 数')
+    parser.add_argument('--continue-chat', action='store_true', help='在同一对话中连续提问，而不是每个问题开启新对话')
+    args = parser.parse_args()
+    count = asyncio.run(main(args))
+    print(f"本次完成 {count} 条")
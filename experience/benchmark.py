@@ -0,0 +1,466 @@
+import argparse
+import asyncio
+import json
+import statistics
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List
+from urllib.parse import urlsplit, parse_qs, urlencode
+from scheduler import ResourceMonitor
+from tracing import percentile
+
+FAKE_CHAT_HTML = """<!DOCTYPE html>
+<html>
+<head><meta charset="utf-8"><title>PolyQuery fake chat</title>
+<style>
+  body { font-family: sans-serif; margin: 0; padding: 16px; }
+  .msg { margin: 8px 0; padding: 8px; border-radius: 6px; white-space: pre-wrap; }
+  .msg[data-role="user"] { background: #e8f0fe; }
+  .msg[data-role="assistant"] { background: #f1f3f4; }
+  #composer { position: fixed; bottom: 0; left: 0; right: 0; padding: 16px; background: #fff; }
+  textarea, [contenteditable] { width: 100%; min-height: 48px; border: 1px solid #ccc; }
+</style>
+</head>
+<body>
+<div id="assets"></div>
+<div id="messages"></div>
+<div id="composer"></div>
+<script>
+const params = new URLSearchParams(location.search);
+const inputType = params.get('input') || 'textarea';
+const speed = Number(params.get('speed') || 200);
+const chatter = Number(params.get('chatter') || 0);
+const replyLength = Number(params.get('length') || 400);
+const assets = Number(params.get('assets') || 0);
+const delay = Number(params.get('delay') || 0);
+const nodes = Number(params.get('nodes') || 0);
+const churn = Number(params.get('churn') || 0);
+const messages = document.getElementById('messages');
+const composer = document.getElementById('composer');
+
+function addMessage(role, text) {
+  const div = document.createElement('div');
+  div.className = 'msg';
+  div.dataset.role = role;
+  div.textContent = text;
+  messages.appendChild(div);
+  return div;
+}
+
+async function reply(question) {
+  const answer = addMessage('assistant', '');
+  const stop = document.createElement('button');
+  stop.className = 'stop-generating';
+  stop.textContent = 'Stop';
+  composer.appendChild(stop);
+  const res = await fetch('/stream?' + new URLSearchParams({ q: question, speed, length: replyLength }));
+  const reader = res.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+  while (true) {
+    const { done, value } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+    const events = buffer.split('\\n\\n');
+    buffer = events.pop();
+    for (const event of events) {
+      if (event.startsWith('data: ')) answer.textContent += JSON.parse(event.slice(6));
+    }
+  }
+  stop.remove();
+}
+
+function send(text) {
+  text = text.trim();
+  if (!text) return;
+  addMessage('user', text);
+  reply(text);
+}
+
+function bindEnter(el, read, clear) {
+  el.addEventListener('keydown', e => {
+    if (e.key === 'Enter' && !e.shiftKey) {
+      e.preventDefault();
+      const text = read();
+      clear();
+      send(text);
+    }
+  });
+}
+
+function buildComposer() {
+  if (inputType === 'contenteditable') {
+    const div = document.createElement('div');
+    div.contentEditable = 'true';
+    composer.appendChild(div);
+    bindEnter(div, () => div.innerText, () => { div.innerHTML = ''; });
+  } else if (inputType === 'shadow') {
+    const host = document.createElement('chat-input');
+    const root = host.attachShadow({ mode: 'open' });
+    const textarea = document.createElement('textarea');
+    root.appendChild(textarea);
+    composer.appendChild(host);
+    bindEnter(textarea, () => textarea.value, () => { textarea.value = ''; });
+  } else {
+    const textarea = document.createElement('textarea');
+    composer.appendChild(textarea);
+    bindEnter(textarea, () => textarea.value, () => { textarea.value = ''; });
+  }
+  window.__composerReadyAt = performance.now();
+}
+
+// 模拟大型 SPA：大量节点、持续的 DOM 变化，输入框延迟出现
+if (nodes > 0) {
+  const filler = document.createElement('div');
+  filler.style.display = 'none';
+  for (let i = 0; i < nodes; i++) filler.appendChild(document.createElement('span'));
+  document.body.appendChild(filler);
+}
+if (churn > 0) {
+  const ticker = document.createElement('span');
+  document.body.appendChild(ticker);
+  setInterval(() => { ticker.textContent = String(Date.now()); }, churn);
+}
+if (delay > 0) {
+  setTimeout(buildComposer, delay);
+} else {
+  buildComposer();
+}
+
+// 模拟站点上的图片、字体和统计上报，用于衡量请求拦截的效果
+for (let i = 0; i < assets; i++) {
+  const img = document.createElement('img');
+  img.src = '/asset/' + i + '.png';
+  document.getElementById('assets').appendChild(img);
+}
+if (assets > 0) {
+  new FontFace('Fake', 'url(/asset/font.woff2)').load().catch(() => {});
+  navigator.sendBeacon('/collect', 'pageview');
+}
+
+if (chatter > 0) {
+  setInterval(() => fetch('/chatter').catch(() => {}), chatter);
+}
+</script>
+</body>
+</html>
+"""
+
+FAKE_CHAT_EXTRACTOR = """(function() {
+  return Array.from(document.querySelectorAll('.msg')).map(m => ({ role: m.dataset.role, content: m.textContent }));
+})();"""
+
+ASSET_BYTES = 50_000
+
+# 旧版 pq.waitFor：每帧 querySelectorAll('*') 并探测所有 shadowRoot，用于对比
+RAF_SCAN_WAIT_JS = """(sel) => new Promise((resolve, reject) => {
+  const t0 = Date.now();
+  const find = () => {
+    let el = document.querySelector(sel);
+    if (el) return el;
+    for (const n of document.querySelectorAll('*')) {
+      if (n.shadowRoot) {
+        el = n.shadowRoot.querySelector(sel);
+        if (el) return el;
+      }
+    }
+    return null;
+  };
+  const loop = () => {
+    if (find()) return resolve(performance.now() - window.__composerReadyAt);
+    if (Date.now() - t0 > 30000) return reject(new Error('timeout: ' + sel));
+    requestAnimationFrame(loop);
+  };
+  loop();
+})"""
+
+OBSERVER_WAIT_JS = """async (sel) => {
+  await window.__pq.waitFor(sel, 30000);
+  return performance.now() - window.__composerReadyAt;
+}"""
+
+INPUT_SELECTORS = {'textarea': 'textarea', 'contenteditable': 'div[contenteditable="true"]', 'shadow': 'textarea'}
+
+class FakeChatHandler(BaseHTTPRequestHandler):
+    """本地假聊天站点：/site/<n> 返回页面，/stream 以 SSE 流式返回回答，/chatter 模拟后台请求。"""
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status: int, body: bytes, content_type: str):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        self._send(204, b'', 'text/plain')
+
+    def do_GET(self):
+        parts = urlsplit(self.path)
+        params = parse_qs(parts.query)
+        if parts.path.startswith('/site/'):
+            self._send(200, FAKE_CHAT_HTML.encode('utf-8'), 'text/html; charset=utf-8')
+        elif parts.path.startswith('/asset/'):
+            self._send(200, b'\0' * ASSET_BYTES, 'font/woff2' if parts.path.endswith('.woff2') else 'image/png')
+        elif parts.path == '/chatter':
+            self._send(200, b'{"ok": true}', 'application/json')
+        elif parts.path == '/stream':
+            self._stream(params)
+        else:
+            self._send(404, b'not found', 'text/plain')
+
+    def _stream(self, params):
+        question = params.get('q', [''])[0]
+        speed = max(1.0, float(params.get('speed', ['200'])[0]))
+        length = int(params.get('length', ['400'])[0])
+        text = (f"回答：{question}。" + "这是一段用于基准测试的模拟回答。" * length)[:length]
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        chunk = 8
+        for i in range(0, len(text), chunk):
+            self.wfile.write(f"data: {json.dumps(text[i:i + chunk], ensure_ascii=False)}\n\n".encode('utf-8'))
+            self.wfile.flush()
+            time.sleep(chunk / speed)
+        self.close_connection = True
+
+class FakeChatServer:
+    """在后台线程中运行的本地假聊天站点服务器。"""
+    def __init__(self, host: str = '127.0.0.1', port: int = 0) -> None:
+        self.server = ThreadingHTTPServer((host, port), FakeChatHandler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def __enter__(self) -> "FakeChatServer":
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+def fake_sites(base_url: str, count: int, input_types: List[str], speed: float, chatter_ms: int, length: int,
+               assets: int = 0, routing: str = 'default') -> List[Dict]:
+    """生成与 crawl_conversation.json 结构相同的假站点配置。"""
+    sites = []
+    for i in range(count):
+        input_type = input_types[i % len(input_types)]
+        query = urlencode({'input': input_type, 'speed': speed, 'chatter': chatter_ms, 'length': length, 'assets': assets})
+        sites.append({
+            'url': f"{base_url}/site/{i}?{query}",
+            'selector': INPUT_SELECTORS[input_type],
+            'code': FAKE_CHAT_EXTRACTOR,
+            'completion': {'stop_selector': '.stop-generating'},
+            'routing': {'profile': routing},
+        })
+    return sites
+
+async def run_benchmark(sites: int = 5, queries: int = 5, input_types: List[str] = None, speed: float = 200,
+                        chatter_ms: int = 500, length: int = 400, timing: str = 'fast', headless: str = None,
+                        assets: int = 10, routing: str = 'default') -> Dict:
+    """
+    用本地假站点驱动真实的 stream_chat_many 流水线（与 chat_many 共用会话、调度和 chat），
+    统计每个问题的端到端耗时、首个 token 时间、首个完整回答时间以及浏览器 RSS / CPU。
+
+    headless 为 headed / new / old 时使用独立的浏览器池，None 时使用 BROWSER_HEADLESS 配置。
+    routing 为假站点使用的拦截配置，每个问题记录各规则拦截的请求数和估算字节数。
+    """
+    from main import stream_chat_many
+    from sessions import SessionManager
+    from browser_pool import BrowserPool
+    from request_routing import router
+    from result_store import ResultStore
+    input_types = input_types or ['textarea', 'contenteditable', 'shadow']
+    monitor = ResourceMonitor()
+    samples = []
+    with FakeChatServer() as server:
+        site_configs = fake_sites(server.base_url, sites, input_types, speed, chatter_ms, length, assets, routing)
+        pool = BrowserPool(headless=headless)
+        sessions = SessionManager(pool)
+        # 基准问题不写入结果库
+        store = ResultStore(':memory:')
+        try:
+            for i in range(queries):
+                monitor.sample()
+                # 假站点同源，按 origin 统计即为全部站点
+                routing_before = router.snapshot(server.base_url)
+                start = time.monotonic()
+                first_token = first_answer = None
+                errors = 0
+                async for event in stream_chat_many(f"基准问题 {i}", timing=timing, sessions=sessions, sites=site_configs, store=store):
+                    now = time.monotonic() - start
+                    if event.kind == 'delta' and first_token is None:
+                        first_token = now
+                    elif event.kind == 'final' and first_answer is None:
+                        first_answer = now
+                    elif event.kind == 'error':
+                        errors += 1
+                cpu, rss = monitor.sample()
+                samples.append({'e2e': time.monotonic() - start, 'first_token': first_token,
+                                'first_answer': first_answer, 'cpu': cpu, 'rss_mb': rss, 'errors': errors,
+                                'tab_cpu': cpu / sites, 'tab_rss_mb': rss / sites,
+                                'blocked': router.saved_since(server.base_url, routing_before)})
+        finally:
+            await sessions.close()
+            await pool.close()
+    report = summarize(samples)
+    report['headless'] = headless
+    return report
+
+async def run_waiter_benchmark(tabs: int = 8, nodes: int = 5000, delay_ms: int = 3000, churn_ms: int = 100,
+                               headless: str = None) -> Dict:
+    """
+    对比旧的逐帧全文档扫描和 MutationObserver 等待器：tabs 个标签页同时等待一个
+    delay_ms 后才出现在 shadow DOM 中的输入框，统计等待期间浏览器 CPU 和输入框出现到等待结束的延迟。
+    """
+    from browser_pool import BrowserPool
+    from script_registry import registry
+    monitor = ResourceMonitor()
+    report = {}
+    query = urlencode({'input': 'shadow', 'delay': delay_ms, 'nodes': nodes, 'churn': churn_ms})
+    with FakeChatServer() as server:
+        pool = BrowserPool(headless=headless)
+        try:
+            for name, wait_js in (('raf_scan', RAF_SCAN_WAIT_JS), ('observer', OBSERVER_WAIT_JS)):
+                pages = [await pool.acquire() for _ in range(tabs)]
+                try:
+                    if name == 'observer':
+                        # init script 在页面脚本之前执行，shadow root 创建时即被跟踪
+                        await asyncio.gather(*(registry.install(page) for page in pages))
+                    await asyncio.gather(*(page.goto(f"{server.base_url}/site/{i}?{query}", wait_until='domcontentloaded')
+                                           for i, page in enumerate(pages)))
+                    monitor.sample()
+                    start = time.monotonic()
+                    latencies = await asyncio.gather(*(page.evaluate(wait_js, INPUT_SELECTORS['shadow']) for page in pages))
+                    elapsed = time.monotonic() - start
+                    cpu, rss = monitor.sample()
+                finally:
+                    for page in pages:
+                        await pool.release(page)
+                report[name] = {'cpu': cpu, 'rss_mb': rss, 'wait_s': elapsed,
+                                'latency_ms': {'p50': percentile(latencies, 50), 'p95': percentile(latencies, 95)}}
+        finally:
+            await pool.close()
+    return report
+
+def print_waiter_report(report: Dict):
+    for name, stats in report.items():
+        print(f"{name:<10} 浏览器 CPU={stats['cpu']:.1f}%  RSS={stats['rss_mb']:.0f}MB  等待={stats['wait_s']:.2f}s  "
+              f"出现后延迟 p50={stats['latency_ms']['p50']:.1f}ms p95={stats['latency_ms']['p95']:.1f}ms")
+
+# 页面脚本常用的自动化检测项，每项为 true 表示检测不到
+STEALTH_CHECKS_JS = """() => {
+  const toString = Function.prototype.toString;
+  const isNative = (fn, name) => toString.call(fn) === `function ${name}() { [native code] }`;
+  const attachShadow = Element.prototype.attachShadow;
+  const descriptor = Object.getOwnPropertyDescriptor(Element.prototype, 'attachShadow');
+  return {
+    webdriver: !navigator.webdriver,
+    chrome: !!window.chrome,
+    toString_native: isNative(toString, 'toString') && !Object.prototype.hasOwnProperty.call(toString, 'prototype'),
+    attachShadow_toString: isNative(attachShadow, 'attachShadow') && String(attachShadow) === toString.call(attachShadow),
+    attachShadow_shape: attachShadow.name === 'attachShadow' && attachShadow.length === 1 &&
+      !('prototype' in attachShadow) && Object.getOwnPropertyNames(attachShadow).sort().join() === 'length,name',
+    attachShadow_descriptor: descriptor.writable && descriptor.enumerable && descriptor.configurable,
+    globals_hidden: !Object.keys(window).some(key => key.startsWith('__pq') || key.startsWith('cdc_')),
+  };
+}"""
+
+async def run_stealth_check(headless: str = None) -> Dict[str, bool]:
+    """
+    在安装了隐藏自动化特征脚本和页面脚本包（含 shadow root 等待器）的假站点页面上运行 STEALTH_CHECKS_JS。
+    """
+    from browser_pool import BrowserPool
+    from script_registry import registry
+    with FakeChatServer() as server:
+        pool = BrowserPool(size=1, headless=headless)
+        try:
+            async with pool.lease() as page:
+                await registry.install(page)
+                await page.goto(f"{server.base_url}/site/0?{urlencode({'input': 'shadow'})}", wait_until='domcontentloaded')
+                return await page.evaluate(STEALTH_CHECKS_JS)
+        finally:
+            await pool.close()
+
+def summarize(samples: List[Dict]) -> Dict:
+    report = {'queries': len(samples), 'errors': sum(s['errors'] for s in samples)}
+    blocked = {}
+    for sample in samples:
+        for name, counter in sample.get('blocked', {}).items():
+            total = blocked.setdefault(name, {'requests': 0, 'estimated_bytes': 0})
+            total['requests'] += counter['requests']
+            total['estimated_bytes'] += counter['estimated_bytes']
+    # 每个问题平均拦截的请求数和估算字节数
+    report['blocked'] = {name: {key: value / len(samples) for key, value in total.items()} for name, total in blocked.items()}
+    for key in ('e2e', 'first_token', 'first_answer', 'cpu', 'rss_mb', 'tab_cpu', 'tab_rss_mb'):
+        values = [s[key] for s in samples if s[key] is not None]
+        report[key] = {'p50': percentile(values, 50), 'p95': percentile(values, 95),
+                       'mean': statistics.fmean(values) if values else float('nan')}
+    report['samples'] = samples
+    return report
+
+def print_report(report: Dict):
+    print(f"queries={report['queries']} errors={report['errors']}")
+    for key, label in (('e2e', '端到端(s)'), ('first_token', '首个 token(s)'), ('first_answer', '首个回答(s)'),
+                       ('cpu', '浏览器 CPU(%)'), ('rss_mb', '浏览器 RSS(MB)'),
+                       ('tab_cpu', '每标签页 CPU(%)'), ('tab_rss_mb', '每标签页 RSS(MB)')):
+        stats = report[key]
+        print(f"{label:<16} p50={stats['p50']:.2f}  p95={stats['p95']:.2f}  mean={stats['mean']:.2f}")
+    for name, saved in report.get('blocked', {}).items():
+        print(f"拦截规则 {name:<10} 每个问题 {saved['requests']:.1f} 个请求, 估算节省 {saved['estimated_bytes'] / 1024:.1f} KB")
+    if report.get('blocked'):
+        print("（节省的字节数按资源类型的典型大小估算，不是实际下载量）")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="用本地假聊天站点对 chat 流水线做基准测试")
+    parser.add_argument('--sites', type=int, default=5, help='假站点数量')
+    parser.add_argument('--queries', type=int, default=5, help='问题数量')
+    parser.add_argument('--input', nargs='+', default=['textarea', 'contenteditable', 'shadow'],
+                        choices=['textarea', 'contenteditable', 'shadow'], help='输入框类型，按站点轮换')
+    parser.add_argument('--speed', type=float, default=200, help='模拟回答速度（字符/秒）')
+    parser.add_argument('--chatter', type=int, default=500, help='后台请求间隔（毫秒），0 表示关闭')
+    parser.add_argument('--length', type=int, default=400, help='模拟回答长度（字符）')
+    parser.add_argument('--timing', choices=['stealth', 'balanced', 'fast'], default='fast', help='节奏配置')
+    parser.add_argument('--headless', choices=['headed', 'new', 'old'], default=None, help='浏览器模式，默认使用 BROWSER_HEADLESS 配置')
+    parser.add_argument('--compare-headless', action='store_true', help='依次以有头和新无头模式运行并对比')
+    parser.add_argument('--assets', type=int, default=10, help='每个假站点页面上的图片数量')
+    parser.add_argument('--routing', choices=['none', 'analytics', 'media', 'default'], default='default', help='假站点的请求拦截配置')
+    parser.add_argument('--waiter', action='store_true', help='对比逐帧扫描和 MutationObserver 等待输入框时的 CPU 占用')
+    parser.add_argument('--nodes', type=int, default=5000, help='--waiter 模式下页面上的节点数')
+    parser.add_argument('--delay', type=int, default=3000, help='--waiter 模式下输入框出现前的延迟（毫秒）')
+    parser.add_argument('--stealth', action='store_true', help='检查页面上能否检测到自动化特征和被替换的原生方法')
+    parser.add_argument('--output', default='', help='把完整报告写入 JSON 文件')
+    args = parser.parse_args()
+    if args.stealth:
+        report = asyncio.run(run_stealth_check(args.headless))
+        for name, passed in report.items():
+            print(f"{name:<24} {'ok' if passed else '可被检测'}")
+    elif args.waiter:
+        report = asyncio.run(run_waiter_benchmark(args.sites, args.nodes, args.delay, 100, args.headless))
+        print_waiter_report(report)
+    else:
+        modes = ['headed', 'new'] if args.compare_headless else [args.headless]
+        reports = []
+        for mode in modes:
+            report = asyncio.run(run_benchmark(args.sites, args.queries, args.input, args.speed, args.chatter, args.length,
+                                               args.timing, mode, args.assets, args.routing))
+            if mode:
+                print(f"[{mode}]")
+            print_report(report)
+            reports.append(report)
+        report = reports[0] if len(reports) == 1 else {r['headless']: r for r in reports}
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=4)
+    if args.stealth and not all(report.values()):
+        raise SystemExit(1)
@@ -0,0 +1,489 @@
+import asyncio
+import atexit
+import random
+import weakref
+from contextlib import asynccontextmanager
+from configuration import browser_path, browser_headless, browser_pool_size, browser_max_uses, browser_max_memory_mb
+from storage_state import StorageStateManager, storage_states
+from scheduler import BROWSER_PROCESS_NAMES, load_psutil
+from tracing import tracer
+
+# List of User-Agents for simulating real browsers
+USER_AGENTS = [
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/131.0.0.0 Safari/537.36",
+    "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/131.0.0.0 Safari/537.36",
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/130.0.0.0 Safari/537.36",
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:133.0) Gecko/20100101 Firefox/133.0",
+    "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/18.1.1 Safari/605.1.15",
+    "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/131.0.0.0 Safari/537.36",
+]
+
+# List of languages and timezones for randomization
+LANGUAGES = ['en-US', 'zh-CN', 'ja-JP', 'ko-KR', 'de-DE', 'fr-FR']
+TIMEZONES = ['America/New_York', 'Europe/London', 'Asia/Shanghai', 'Asia/Tokyo', 'Europe/Berlin', 'America/Los_Angeles']
+
+def get_random_user_agent():
+    """Return a random User-Agent from the static list."""
+    return random.choice(USER_AGENTS)
+
+def get_random_locale():
+    """Return a random locale."""
+    return random.choice(LANGUAGES)
+
+def get_random_timezone():
+    """Return a random timezone."""
+    return random.choice(TIMEZONES)
+
+HIDE_AUTOMATION_JS = """
+    (() => {
+        // init script 与 hide_automation_features 可能在同一文档中各执行一次
+        const mark = Symbol.for('pq.stealth');
+        if (window[mark]) return;
+        Object.defineProperty(window, mark, { value: true });
+
+        // Hide webdriver property
+        Object.defineProperty(navigator, 'webdriver', {
+            get: () => undefined,
+        });
+
+        // Mock plugins
+        Object.defineProperty(navigator, 'plugins', {
+            get: () => [
+                {name: 'Chrome PDF Plugin', description: 'Portable Document Format', filename: 'internal-pdf-viewer'},
+                {name: 'Chrome PDF Viewer', description: '', filename: 'mhjfbmdgcfjbbpaeojofohoefgiehjai'},
+                {name: 'Native Client', description: '', filename: 'internal-nacl-plugin'},
+            ],
+        });
+
+        // Mock languages
+        Object.defineProperty(navigator, 'languages', {
+            get: () => ['zh-CN', 'zh', 'en'],
+        });
+
+        // Mock permissions
+        const originalQuery = window.navigator.permissions.query;
+        window.navigator.permissions.query = (parameters) => (
+            parameters.name === 'notifications' ?
+                Promise.resolve({ state: Notification.permission }) :
+                originalQuery(parameters)
+        );
+
+        // Headless Chromium has no window.chrome
+        if (!window.chrome) {
+            window.chrome = { runtime: {} };
+        }
+
+        // Remove automation indicators
+        delete window.cdc_adoQpoasnfa76pfcZLmcfl_Array;
+        delete window.cdc_adoQpoasnfa76pfcZLmcfl_Promise;
+        delete window.cdc_adoQpoasnfa76pfcZLmcfl_Symbol;
+        delete window.cdc_adoQpoasnfa76pfcZLmcfl_JSON;
+        delete window.cdc_adoQpoasnfa76pfcZLmcfl_Object;
+        delete window.cdc_adoQpoasnfa76pfcZLmcfl_Proxy;
+    })();
+    """
+
+BROWSER_ARGS = [
+    '--disable-blink-features=AutomationControlled',
+    '--disable-extensions',
+    '--no-first-run',
+    '--disable-default-apps',
+    '--disable-infobars',
+    '--disable-web-security',
+    '--disable-features=VizDisplayCompositor',
+    '--disable-ipc-flooding-protection',
+    '--disable-background-timer-throttling',
+    '--disable-renderer-backgrounding',
+    '--disable-backgrounding-occluded-windows',
+    '--disable-dev-shm-usage',
+    '--no-sandbox',
+    '--disable-gpu',
+    '--disable-software-rasterizer',
+    '--disable-background-networking',
+    '--disable-component-extensions-with-background-pages',
+    '--disable-features=TranslateUI,BlinkGenPropertyTrees'
+]
+
+def resolve_headless_mode(headless: "bool | str | None" = None) -> str:
+    """
+    把 headless 参数统一为 headed / new / old，None 时使用 BROWSER_HEADLESS 配置。
+    new 为 Chromium 的新无头模式（与有头模式同一套渲染实现），old 为旧的 headless shell。
+    """
+    if headless is None:
+        headless = browser_headless
+    if headless is True:
+        return 'new'
+    if headless is False:
+        return 'headed'
+    value = str(headless).strip().lower()
+    if value in ('', '0', 'false', 'no', 'headed'):
+        return 'headed'
+    if value == 'old':
+        return 'old'
+    return 'new'
+
+async def launch_browser(playwright_instance, headless: "bool | str | None" = None):
+    """
+    使用统一的启动参数启动 Chromium。有头模式把窗口移到屏幕外，无头模式不需要显示器。
+    """
+    mode = resolve_headless_mode(headless)
+    args = list(BROWSER_ARGS)
+    if mode == 'headed':
+        args.append('--window-position=-32000,-32000')
+    elif mode == 'new':
+        # 由 Chromium 自身进入新无头模式，不依赖 Playwright 版本对 headless 的默认实现
+        args.append('--headless=new')
+    with tracer.span('browser_launch', mode=mode):
+        return await playwright_instance.chromium.launch(
+            headless=(mode == 'old'),
+            executable_path=browser_path,
+            args=args
+        )
+
+async def new_browser_context(browser, storage_state: "dict | str | None" = None):
+    """
+    在已启动的浏览器上创建带随机指纹的上下文，storage_state 为空时使用 storage_states 中所有站点的状态。
+    隐藏自动化特征的脚本作为 init script 注入，有头和无头模式下对每个页面一致生效。
+    重资源请求的拦截由 chat 按站点安装在页面上（见 request_routing.RequestRouter.install）。
+    """
+    with tracer.span('context_create'):
+        context = await browser.new_context(
+            user_agent=get_random_user_agent(),
+            viewport={'width': random.randint(1200, 1920), 'height': random.randint(800, 1080)},
+            locale=get_random_locale(),
+            timezone_id=get_random_timezone(),
+            ignore_https_errors=True,
+            permissions=['geolocation'],
+            geolocation={'latitude': random.uniform(-90, 90), 'longitude': random.uniform(-180, 180)},
+            storage_state=storage_state if storage_state is not None else storage_states.merged()
+        )
+        await context.add_init_script(HIDE_AUTOMATION_JS)
+    return context
+
+async def create_browser_context(headless: "bool | str | None" = None, storage_state: "dict | str | None" = None):
+    """
+    创建浏览器上下文，统一管理浏览器启动和配置。
+
+    Args:
+        headless: 是否无头模式（True/False 或 headed/new/old），None 时使用 BROWSER_HEADLESS 配置
+        storage_state: 存储状态（dict 或文件路径），为空时使用 storage_states 中所有站点的状态
+
+    Returns:
+        tuple: (playwright_instance, browser, context)
+    """
+    from patchright.async_api import async_playwright
+    playwright_instance = await async_playwright().start()
+    browser = await launch_browser(playwright_instance, headless=headless)
+    context = await new_browser_context(browser, storage_state)
+    return playwright_instance, browser, context
+
+def _new_processes(psutil, before: set) -> list:
+    """当前进程子进程树中 before 之后新出现的、没有新进程作为父进程的进程（即新进程树的根）。"""
+    if psutil is None:
+        return []
+    try:
+        new = [p for p in psutil.Process().children(recursive=True) if p.pid not in before]
+        pids = {p.pid for p in new}
+        return [p for p in new if p.ppid() not in pids]
+    except psutil.Error:
+        return []
+
+def _child_pids(psutil) -> set:
+    if psutil is None:
+        return set()
+    try:
+        return {p.pid for p in psutil.Process().children(recursive=True)}
+    except psutil.Error:
+        return set()
+
+def _browser_process(psutil, before: set):
+    for process in _new_processes(psutil, before):
+        try:
+            if any(name in process.name().lower() for name in BROWSER_PROCESS_NAMES):
+                return process
+        except psutil.Error:
+            continue
+    return None
+
+def _tree_rss_mb(psutil, process) -> float:
+    """进程及其全部子进程（渲染、GPU 等）的 RSS 之和，MB。"""
+    rss = 0
+    try:
+        for p in [process] + process.children(recursive=True):
+            try:
+                rss += p.memory_info().rss
+            except psutil.Error:
+                continue
+    except psutil.Error:
+        return 0.0
+    return rss / (1024 * 1024)
+
+def _kill_tree(psutil, process):
+    try:
+        processes = process.children(recursive=True) + [process]
+    except psutil.Error:
+        return
+    for p in processes:
+        try:
+            p.kill()
+        except psutil.Error:
+            pass
+
+class _BrowserSlot:
+    """池中的一个预热浏览器及其上下文，process 为浏览器主进程（psutil 不可用时为 None）。"""
+    def __init__(self, browser, context, process=None) -> None:
+        self.browser = browser
+        self.context = context
+        self.process = process
+        self.uses = 0
+        self.active = 0
+        self.retiring = False
+
+# 尚未关闭的浏览器池，进程退出时结束它们的驱动和浏览器进程
+_live_pools: "weakref.WeakSet[BrowserPool]" = weakref.WeakSet()
+
+class BrowserPool:
+    """
+    长期存活的浏览器池：持有一个 Playwright 驱动和 N 个预热的浏览器/上下文，
+    以租约方式分发页面，并在使用次数或浏览器进程树的 RSS 超过阈值后回收浏览器
+    （按内存回收需要 psutil）。
+    """
+    def __init__(self, size: int = browser_pool_size, max_uses: int = browser_max_uses,
+                 max_memory_mb: int = browser_max_memory_mb, headless: bool | str | None = None,
+                 states: StorageStateManager = storage_states) -> None:
+        self.size = max(1, size)
+        self.max_uses = max_uses
+        self.max_memory_mb = max_memory_mb
+        self.headless = headless
+        self.states = states
+        self.playwright_instance = None
+        self._driver_process = None
+        self._slots: list[_BrowserSlot] = []
+        self._owners = {}
+        self._lock = asyncio.Lock()
+        self._closed = False
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    async def start(self) -> "BrowserPool":
+        """启动驱动并预热全部浏览器。"""
+        async with self._lock:
+            await self._ensure_driver()
+            while len(self._slots) < self.size:
+                self._slots.append(await self._launch_slot())
+        return self
+
+    async def _ensure_driver(self):
+        if self._closed:
+            raise RuntimeError("BrowserPool 已关闭")
+        if self.playwright_instance is None:
+            # 驱动在第一次使用时才导入，导入本模块不加载 patchright
+            from patchright.async_api import async_playwright
+            psutil = load_psutil()
+            before = _child_pids(psutil)
+            self.playwright_instance = await async_playwright().start()
+            self._driver_process = next(iter(_new_processes(psutil, before)), None)
+            _live_pools.add(self)
+
+    async def _launch_slot(self) -> _BrowserSlot:
+        # 调用方持有 self._lock，启动前后的子进程差集即为这个浏览器的进程
+        psutil = load_psutil()
+        before = _child_pids(psutil)
+        browser = await launch_browser(self.playwright_instance, headless=self.headless)
+        process = _browser_process(psutil, before)
+        context = await new_browser_context(browser, self.states.merged())
+        return _BrowserSlot(browser, context, process)
+
+    async def _pick_slot(self) -> _BrowserSlot:
+        async with self._lock:
+            await self._ensure_driver()
+            available = [slot for slot in self._slots if not slot.retiring]
+            if len(self._slots) < self.size or not available:
+                slot = await self._launch_slot()
+                self._slots.append(slot)
+                return slot
+            return min(available, key=lambda slot: slot.active)
+
+    async def acquire(self):
+        """从负载最低的浏览器上打开一个新页面，调用方用完后须调用 release。"""
+        slot = await self._pick_slot()
+        slot.active += 1
+        try:
+            page = await slot.context.new_page()
+        except Exception:
+            slot.active -= 1
+            slot.retiring = True
+            await self._recycle_if_idle(slot)
+            raise
+        self._owners[page] = slot
+        return page
+
+    def _count_use(self, slot: _BrowserSlot):
+        slot.uses += 1
+        if self.max_uses and slot.uses >= self.max_uses:
+            slot.retiring = True
+        if self.max_memory_mb and not slot.retiring and self.browser_memory_mb(slot) >= self.max_memory_mb:
+            slot.retiring = True
+
+    def record_use(self, page):
+        """
+        长期借出的页面（如常驻标签页）每完成一次使用调用一次，计入所在浏览器的使用次数并检查内存，
+        达到回收阈值后 is_retiring 返回 True，调用方应归还页面并重新借出。
+        """
+        slot = self._owners.get(page)
+        if slot is not None:
+            self._count_use(slot)
+
+    def is_retiring(self, page) -> bool:
+        """页面所在的浏览器是否已达到回收阈值。"""
+        slot = self._owners.get(page)
+        return slot is not None and slot.retiring
+
+    async def release(self, page, count_use: bool = True):
+        """
+        关闭页面并归还租约，达到回收阈值的浏览器在空闲后关闭。
+        已通过 record_use 计数的页面传入 count_use=False，避免重复计数。
+        """
+        slot = self._owners.pop(page, None)
+        if slot is None:
+            return
+        if count_use:
+            self._count_use(slot)
+        try:
+            if not page.is_closed():
+                await page.close()
+        except Exception:
+            slot.retiring = True
+        slot.active -= 1
+        await self._recycle_if_idle(slot)
+
+    @asynccontextmanager
+    async def lease(self):
+        """以租约方式借出页面：async with pool.lease() as page: ..."""
+        page = await self.acquire()
+        try:
+            yield page
+        finally:
+            await self.release(page)
+
+    @staticmethod
+    def browser_memory_mb(slot: _BrowserSlot) -> float:
+        """浏览器进程树的 RSS（MB），psutil 不可用或没有找到浏览器进程时为 0。"""
+        psutil = load_psutil()
+        if psutil is None or slot.process is None:
+            return 0.0
+        return _tree_rss_mb(psutil, slot.process)
+
+    async def _recycle_if_idle(self, slot: _BrowserSlot):
+        if not slot.retiring or slot.active > 0:
+            return
+        async with self._lock:
+            if slot in self._slots:
+                self._slots.remove(slot)
+        await self._close_slot(slot)
+
+    async def _close_slot(self, slot: _BrowserSlot):
+        try:
+            await slot.context.close()
+        except Exception:
+            pass
+        try:
+            await slot.browser.close()
+        except Exception:
+            pass
+
+    async def reload_storage_state(self):
+        """登录后把存储状态中的 cookies 同步到所有预热上下文。"""
+        cookies = self.states.merged()['cookies']
+        if not cookies:
+            return
+        for slot in list(self._slots):
+            await slot.context.add_cookies(cookies)
+
+    async def close(self):
+        """关闭所有浏览器并停止驱动。"""
+        async with self._lock:
+            self._closed = True
+            slots, self._slots = self._slots, []
+            self._owners.clear()
+        for slot in slots:
+            await self._close_slot(slot)
+        if self.playwright_instance is not None:
+            await self.playwright_instance.stop()
+            self.playwright_instance = None
+        _live_pools.discard(self)
+
+    def terminate(self):
+        """
+        同步结束驱动和浏览器进程，用于无法再 await close 的场合
+        （创建池的事件循环已经结束、解释器退出）。
+        """
+        self._closed = True
+        slots, self._slots = self._slots, []
+        self._owners.clear()
+        self.playwright_instance = None
+        _live_pools.discard(self)
+        psutil = load_psutil()
+        if psutil is None:
+            return
+        for slot in slots:
+            if slot.process is not None:
+                _kill_tree(psutil, slot.process)
+        if self._driver_process is not None:
+            _kill_tree(psutil, self._driver_process)
+
+@atexit.register
+def _terminate_pools():
+    for pool in list(_live_pools):
+        pool.terminate()
+
+_pool: BrowserPool | None = None
+_pool_loop = None
+
+def current_browser_pool() -> BrowserPool | None:
+    """当前事件循环已有的共享浏览器池，没有时返回 None（不会创建）。"""
+    if _pool is not None and _pool_loop is asyncio.get_running_loop() and not _pool.closed:
+        return _pool
+    return None
+
+def get_browser_pool() -> BrowserPool:
+    """
+    返回当前事件循环共享的浏览器池，事件循环变化时（如多次 asyncio.run）重新创建。
+    上一个事件循环的池如果没有通过 close_browser_pool 关闭，在这里结束它的进程。
+    """
+    global _pool, _pool_loop
+    loop = asyncio.get_running_loop()
+    if _pool is None or _pool_loop is not loop or _pool.closed:
+        if _pool is not None and _pool_loop is not loop and not _pool.closed:
+            _pool.terminate()
+        _pool = BrowserPool()
+        _pool_loop = loop
+    return _pool
+
+@asynccontextmanager
+async def scoped_browser_pool(size: int = 1):
+    """
+    独立调用的辅助函数使用的浏览器池：当前事件循环已有共享池时直接使用，
+    否则创建一个临时池，退出时关闭。
+    """
+    pool = current_browser_pool()
+    if pool is not None:
+        yield pool
+        return
+    pool = BrowserPool(size=size)
+    try:
+        yield pool
+    finally:
+        await pool.close()
+
+async def close_browser_pool():
+    """关闭共享浏览器池。"""
+    global _pool, _pool_loop
+    if _pool is not None and _pool_loop is asyncio.get_running_loop():
+        await _pool.close()
+    elif _pool is not None:
+        _pool.terminate()
+    _pool = None
+    _pool_loop = None
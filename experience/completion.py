@@ -0,0 +1,299 @@
+import asyncio
+import time
+import weakref
+from typing import Callable
+from script_registry import registry
+
+SIGNAL_BINDING = '__pqSignal'
+
+# 每个页面只能 expose_binding 一次，这里按页面维护回调列表并统一分发
+_page_listeners: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+
+async def on_page_signal(page, callback: Callable) -> Callable:
+    """
+    订阅页面脚本通过 window.__pqSignal(kind, payload) 发出的信号，返回取消订阅函数。
+    """
+    listeners = _page_listeners.get(page)
+    if listeners is None:
+        listeners = []
+        _page_listeners[page] = listeners
+        def dispatch(source, kind, payload=None):
+            for listener in list(listeners):
+                listener(kind, payload)
+        await page.expose_binding(SIGNAL_BINDING, dispatch)
+    listeners.append(callback)
+    def unsubscribe():
+        if callback in listeners:
+            listeners.remove(callback)
+    return unsubscribe
+
+class CompletionDetector:
+    """
+    回复完成检测器：发送问题前 arm，发送后 wait 直到检测到回复结束，最后 disarm。
+    """
+    async def arm(self, page):
+        self.page = page
+
+    async def wait(self):
+        """阻塞直到检测到完成信号。"""
+        raise NotImplementedError
+
+    async def disarm(self):
+        pass
+
+    def busy(self) -> bool:
+        """确知回复仍在进行时返回 True，用于压制其他检测器的过早完成信号。"""
+        return False
+
+    def progressing(self) -> bool:
+        """最近仍观察到回复在进行时返回 True，到达自适应超时时据此决定是否继续等待。"""
+        return self.busy()
+
+class NetworkQuietDetector(CompletionDetector):
+    """原有策略：连续 quiet 秒没有任何网络响应即认为完成。"""
+    def __init__(self, quiet: float = 5.0) -> None:
+        self.quiet = quiet
+        self.last_response_time = time.monotonic()
+
+    async def arm(self, page):
+        await super().arm(page)
+        self.last_response_time = time.monotonic()
+        page.on('response', self._on_response)
+
+    def _on_response(self, response):
+        self.last_response_time = time.monotonic()
+
+    def progressing(self) -> bool:
+        return time.monotonic() - self.last_response_time < self.quiet
+
+    async def wait(self):
+        while time.monotonic() - self.last_response_time < self.quiet:
+            await asyncio.sleep(0.2)
+
+    async def disarm(self):
+        self.page.remove_listener('response', self._on_response)
+
+class DomQuiescenceDetector(CompletionDetector):
+    """
+    通过 MutationObserver 监听 DOM 变化，回复开始后连续 quiet_ms 毫秒没有变化即认为完成。
+    发送后的第一次变化通常是用户自己的消息气泡，模型思考期间 DOM 也保持安静，
+    因此默认沿用原有的 5 秒静默；配置了只包含回复的 root_selector 时可以调短。
+    """
+    def __init__(self, quiet_ms: int = 5000, root_selector: str = '', throttle_ms: int = 100) -> None:
+        self.quiet = quiet_ms / 1000
+        self.root_selector = root_selector
+        self.throttle_ms = throttle_ms
+        self.mutations = 0
+        self.baseline = 0
+        self.last_mutation_time = time.monotonic()
+        self._unsubscribe = None
+
+    async def arm(self, page):
+        await super().arm(page)
+        self._unsubscribe = await on_page_signal(page, self._on_signal)
+        await registry.call(page, 'observeMutations', SIGNAL_BINDING, self.root_selector, self.throttle_ms)
+
+    def _on_signal(self, kind, payload):
+        if kind == 'mutation':
+            self.mutations += 1
+            self.last_mutation_time = time.monotonic()
+
+    def progressing(self) -> bool:
+        return self.mutations > self.baseline and time.monotonic() - self.last_mutation_time < self.quiet
+
+    async def wait(self):
+        # 只统计发送之后的变化，填写输入框引起的变化不算回复开始
+        self.baseline = baseline = self.mutations
+        while self.mutations == baseline or time.monotonic() - self.last_mutation_time < self.quiet:
+            await asyncio.sleep(0.1)
+
+    async def disarm(self):
+        if self._unsubscribe:
+            self._unsubscribe()
+        try:
+            await registry.call(self.page, 'disconnectMutations')
+        except Exception:
+            pass
+
+class StopButtonDetector(CompletionDetector):
+    """
+    等待站点的“停止生成”按钮出现后再消失。按钮始终未出现时不给出完成信号。
+    """
+    def __init__(self, selector: str, appear_timeout: float = 30.0) -> None:
+        self.selector = selector
+        self.appear_timeout = appear_timeout
+
+    async def wait(self):
+        try:
+            await self.page.wait_for_selector(self.selector, state='visible', timeout=self.appear_timeout * 1000)
+        except Exception:
+            # 按钮一直没有出现，交给其他检测器判断
+            await asyncio.Future()
+        await self.page.wait_for_selector(self.selector, state='hidden', timeout=0)
+
+class StreamEndDetector(CompletionDetector):
+    """
+    跟踪 SSE / 流式 fetch 响应，所有流结束并经过 grace 秒后认为完成。
+    """
+    STREAM_CONTENT_TYPES = ('text/event-stream', 'application/x-ndjson', 'application/stream+json')
+
+    def __init__(self, grace: float = 0.5) -> None:
+        self.grace = grace
+        self.open_streams = set()
+        self.seen_stream = False
+        self.last_end_time = time.monotonic()
+
+    async def arm(self, page):
+        await super().arm(page)
+        page.on('response', self._on_response)
+        page.on('requestfinished', self._on_request_end)
+        page.on('requestfailed', self._on_request_end)
+
+    def _on_response(self, response):
+        content_type = response.headers.get('content-type', '')
+        if any(t in content_type for t in self.STREAM_CONTENT_TYPES):
+            self.open_streams.add(response.request)
+            self.seen_stream = True
+
+    def _on_request_end(self, request):
+        if request in self.open_streams:
+            self.open_streams.discard(request)
+            self.last_end_time = time.monotonic()
+
+    def busy(self) -> bool:
+        return bool(self.open_streams)
+
+    async def wait(self):
+        while not self.seen_stream or self.open_streams or time.monotonic() - self.last_end_time < self.grace:
+            await asyncio.sleep(0.1)
+
+    async def disarm(self):
+        self.page.remove_listener('response', self._on_response)
+        self.page.remove_listener('requestfinished', self._on_request_end)
+        self.page.remove_listener('requestfailed', self._on_request_end)
+
+class AdaptiveTimeout:
+    """
+    按站点统计回复耗时（指数滑动平均），据此给出软超时；maximum 为没有调用方截止时间时的硬上限。
+    """
+    def __init__(self, initial: float = 120.0, minimum: float = 15.0, maximum: float = 600.0,
+                 factor: float = 3.0, alpha: float = 0.3) -> None:
+        self.initial = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self.factor = factor
+        self.alpha = alpha
+        self._ewma: dict[str, float] = {}
+
+    def timeout_for(self, site: str) -> float:
+        if site not in self._ewma:
+            return self.initial
+        return min(self.maximum, max(self.minimum, self._ewma[site] * self.factor))
+
+    def record(self, site: str, elapsed: float):
+        previous = self._ewma.get(site)
+        self._ewma[site] = elapsed if previous is None else self.alpha * elapsed + (1 - self.alpha) * previous
+
+adaptive_timeouts = AdaptiveTimeout()
+
+class SiteCompletion(CompletionDetector):
+    """
+    组合多个检测器，任意一个正常给出完成信号即返回。
+    到达站点的自适应超时时重新检查各检测器，仍观察到回复在进行就每 recheck 秒再检查一次，
+    直到回复结束或到达硬上限；站点配置了 timeout 时以它为硬上限。
+    """
+    def __init__(self, site: str, detectors: list[CompletionDetector], timeout: float | None = None,
+                 timeouts: AdaptiveTimeout = adaptive_timeouts, recheck: float = 5.0) -> None:
+        self.site = site
+        self.detectors = detectors
+        self.timeout = timeout
+        self.timeouts = timeouts
+        self.recheck = recheck
+        self.timed_out = False
+
+    async def arm(self, page):
+        await super().arm(page)
+        for detector in self.detectors:
+            await detector.arm(page)
+
+    async def wait(self, until: float | None = None):
+        """until 为调用方的截止时间（time.monotonic()），早于硬上限时以它为准，到达后 timed_out 为 True。"""
+        start = time.monotonic()
+        if self.timeout:
+            soft = hard = start + self.timeout
+        else:
+            soft = start + self.timeouts.timeout_for(self.site)
+            hard = start + max(self.timeouts.maximum, self.timeouts.timeout_for(self.site))
+        if until is not None:
+            hard = min(hard, until)
+        tasks = {asyncio.ensure_future(detector.wait()): detector for detector in self.detectors}
+        errors = []
+        try:
+            while True:
+                if not tasks:
+                    # 所有检测器都出错，没有可信的完成信号
+                    raise errors[0]
+                done, _ = await asyncio.wait(tasks, timeout=max(0, min(soft, hard) - time.monotonic()),
+                                             return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    if time.monotonic() >= hard or not any(detector.progressing() for detector in tasks.values()):
+                        self.timed_out = True
+                        return
+                    # 超过自适应超时但回复仍在进行，稍后再检查
+                    soft = time.monotonic() + self.recheck
+                    continue
+                finished = []
+                for task in done:
+                    detector = tasks.pop(task)
+                    if task.exception() is not None:
+                        # 出错的检测器不算完成，也不再参与判断
+                        errors.append(task.exception())
+                    else:
+                        finished.append(detector)
+                if finished and not any(detector.busy() for detector in self.detectors):
+                    break
+                if finished:
+                    # 仍有流未结束，稍后重新启动已给出信号的检测器
+                    await asyncio.sleep(0.2)
+                for detector in finished:
+                    tasks[asyncio.ensure_future(detector.wait())] = detector
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        self.timeouts.record(self.site, time.monotonic() - start)
+
+    async def disarm(self):
+        for detector in self.detectors:
+            try:
+                await detector.disarm()
+            except Exception:
+                pass
+
+def build_detector(site: str, options: dict | None = None) -> SiteCompletion:
+    """
+    根据 crawl_conversation.json 中站点的 completion 配置构造检测器。
+
+    Args:
+        site: 站点 URL
+        options: 可选配置，支持 strategies（dom/stop_button/stream/network）、
+            stop_selector、quiet_ms、root_selector、timeout
+
+    Returns:
+        SiteCompletion: 组合检测器
+    """
+    options = options or {}
+    strategies = options.get('strategies') or ['dom', 'stop_button', 'stream']
+    detectors = []
+    for strategy in strategies:
+        if strategy == 'dom':
+            detectors.append(DomQuiescenceDetector(options.get('quiet_ms', 5000), options.get('root_selector', '')))
+        elif strategy == 'stop_button' and options.get('stop_selector'):
+            detectors.append(StopButtonDetector(options['stop_selector']))
+        elif strategy == 'stream':
+            detectors.append(StreamEndDetector())
+        elif strategy == 'network':
+            detectors.append(NetworkQuietDetector(options.get('quiet', 5.0)))
+    if not detectors:
+        detectors.append(NetworkQuietDetector(options.get('quiet', 5.0)))
+    return SiteCompletion(site, detectors, options.get('timeout'))
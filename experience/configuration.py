@@ -1,14 +1,129 @@
-from dotenv import load_dotenv
 import os, json
-from typing import Any
+import functools
+from dataclasses import dataclass
+
+@dataclass(frozen=True)
+class Settings:
+    """
+    进程内只解析一次的不可变配置，由 get_settings() 从环境变量（含 .env）构建并缓存。
+    各模块沿用 `from configuration import xxx` 读取的模块级名称都取自这里。
+    """
+    llm_api_key: str | None
+    llm_base_url: str | None
+    llm_model: str | None
+    browser_path: str | None
+    browser_headless: str
+    browser_pool_size: int
+    browser_max_uses: int
+    browser_max_memory_mb: int
+    timing_profile: str
+    screenshot_mode: str
+    screenshot_sample_every: int
+    screenshot_format: str
+    screenshot_quality: int
+    screenshot_dir: str
+    screenshot_max_files: int
+    screenshot_max_mb: int
+    scheduler_max_concurrency: int
+    scheduler_cpu_target: float
+    scheduler_memory_limit_mb: float
+    login_cache_ttl: float
+    routing_profile: str
+    trace_export: str
+    trace_file: str
+    result_store_file: str
+    answer_cache_ttl: float
+    answer_cache_size: int
+    answer_cache_disk_size: int
+    answer_cache_file: str
+    storage_state_dir: str
+    storage_state_debounce: float
+    storage_state_refresh: float
+    login_timeout: float
+    daemon_host: str
+    daemon_port: int
+    daemon_socket: str
+    daemon_workers: int
+    daemon_queue_size: int
+    daemon_client_limit: int
+    import_budget_ms: float
+    query_deadline: float
+    site_deadline: float
+    deadline_grace: float
+    breaker_threshold: int
+    breaker_cooldown: float
+    analysis_cache_ttl: float
+    analysis_cache_size: int
+    input_strategy_file: str
+
+    @classmethod
+    def from_env(cls) -> "Settings":
+        return cls(
+            llm_api_key=os.getenv("LLM_API_KEY"),
+            llm_base_url=os.getenv("LLM_BASE_URL"),
+            llm_model=os.getenv("LLM_MODEL"),
+            browser_path=os.getenv("BROWSER_PATH"),
+            browser_headless=os.getenv("BROWSER_HEADLESS", "0"),
+            browser_pool_size=int(os.getenv("BROWSER_POOL_SIZE", "2")),
+            browser_max_uses=int(os.getenv("BROWSER_MAX_USES", "50")),
+            browser_max_memory_mb=int(os.getenv("BROWSER_MAX_MEMORY_MB", "2048")),
+            timing_profile=os.getenv("TIMING_PROFILE", "balanced"),
+            screenshot_mode=os.getenv("SCREENSHOT_MODE", "error"),
+            screenshot_sample_every=int(os.getenv("SCREENSHOT_SAMPLE_EVERY", "10")),
+            screenshot_format=os.getenv("SCREENSHOT_FORMAT", "jpeg"),
+            screenshot_quality=int(os.getenv("SCREENSHOT_QUALITY", "70")),
+            screenshot_dir=os.getenv("SCREENSHOT_DIR", "screenshots"),
+            screenshot_max_files=int(os.getenv("SCREENSHOT_MAX_FILES", "200")),
+            screenshot_max_mb=int(os.getenv("SCREENSHOT_MAX_MB", "200")),
+            scheduler_max_concurrency=int(os.getenv("SCHEDULER_MAX_CONCURRENCY", "16")),
+            scheduler_cpu_target=float(os.getenv("SCHEDULER_CPU_TARGET", "85")),
+            scheduler_memory_limit_mb=float(os.getenv("SCHEDULER_MEMORY_LIMIT_MB", "0")),
+            login_cache_ttl=float(os.getenv("LOGIN_CACHE_TTL", "3600")),
+            routing_profile=os.getenv("ROUTING_PROFILE", "default"),
+            trace_export=os.getenv("TRACE_EXPORT", "jsonl"),
+            trace_file=os.getenv("TRACE_FILE", "traces/spans.jsonl"),
+            result_store_file=os.getenv("RESULT_STORE", "experience/results.db"),
+            answer_cache_ttl=float(os.getenv("ANSWER_CACHE_TTL", "0")),
+            answer_cache_size=int(os.getenv("ANSWER_CACHE_SIZE", "1000")),
+            answer_cache_disk_size=int(os.getenv("ANSWER_CACHE_DISK_SIZE", "100000")),
+            answer_cache_file=os.getenv("ANSWER_CACHE_FILE", "experience/answer_cache.db"),
+            storage_state_dir=os.getenv("STORAGE_STATE_DIR", "experience/storage_states"),
+            storage_state_debounce=float(os.getenv("STORAGE_STATE_DEBOUNCE", "2")),
+            storage_state_refresh=float(os.getenv("STORAGE_STATE_REFRESH", "60")),
+            login_timeout=float(os.getenv("LOGIN_TIMEOUT", "300")),
+            daemon_host=os.getenv("DAEMON_HOST", "127.0.0.1"),
+            daemon_port=int(os.getenv("DAEMON_PORT", "8765")),
+            daemon_socket=os.getenv("DAEMON_SOCKET", ""),
+            daemon_workers=int(os.getenv("DAEMON_WORKERS", "4")),
+            daemon_queue_size=int(os.getenv("DAEMON_QUEUE_SIZE", "32")),
+            daemon_client_limit=int(os.getenv("DAEMON_CLIENT_LIMIT", "2")),
+            import_budget_ms=float(os.getenv("IMPORT_BUDGET_MS", "250")),
+            query_deadline=float(os.getenv("QUERY_DEADLINE", "0")),
+            site_deadline=float(os.getenv("SITE_DEADLINE", "300")),
+            deadline_grace=float(os.getenv("DEADLINE_GRACE", "5")),
+            breaker_threshold=int(os.getenv("BREAKER_THRESHOLD", "3")),
+            breaker_cooldown=float(os.getenv("BREAKER_COOLDOWN", "300")),
+            analysis_cache_ttl=float(os.getenv("ANALYSIS_CACHE_TTL", "0")),
+            analysis_cache_size=int(os.getenv("ANALYSIS_CACHE_SIZE", "32")),
+            input_strategy_file=os.getenv("INPUT_STRATEGY_FILE", "experience/input_strategies.json"),
+        )
+
+@functools.lru_cache(maxsize=None)
+def get_settings() -> Settings:
+    """读取 .env（先找到的优先，不覆盖已有环境变量）并解析配置，整个进程只执行一次。"""
+    from dotenv import load_dotenv
+    load_dotenv()
+    load_dotenv("experience/.env")
+    return Settings.from_env()
+
+settings = get_settings()
 
 class LLMConfiguration:
-    def __init__(self) -> None:
-        """Initialize configuration with environment variables."""
-        load_dotenv()
-        self.api_key = os.getenv("LLM_API_KEY")
-        self.base_url = os.getenv("LLM_BASE_URL")
-        self.model = os.getenv("LLM_MODEL")
+    def __init__(self, settings: Settings = settings) -> None:
+        """Initialize configuration from the parsed settings."""
+        self.api_key = settings.llm_api_key
+        self.base_url = settings.llm_base_url
+        self.model = settings.llm_model
     @property
     def llm_api_key(self) -> str:
         if not self.api_key:
@@ -25,28 +140,8 @@ class LLMConfiguration:
             raise ValueError("LLM_MODEL not found in environment variables")
         return self.model
 
-class CodeLLMConfiguration:
-    def __init__(self) -> None:
-        """Initialize configuration with environment variables."""
-        load_dotenv()
-        self.api_key = os.getenv("LLM_API_KEY")
-        self.base_url = os.getenv("LLM_BASE_URL")
-        self.model = os.getenv("LLM_MODEL")
-    @property
-    def llm_api_key(self) -> str:
-        if not self.api_key:
-            raise ValueError("LLM_API_KEY not found in environment variables")
-        return self.api_key
-    @property
-    def llm_base_url(self) -> str:
-        if not self.base_url:
-            raise ValueError("LLM_BASE_URL not found in environment variables")
-        return self.base_url
-    @property
-    def llm_model(self) -> str:
-        if not self.model:
-            raise ValueError("LLM_MODEL not found in environment variables")
-        return self.model
+class CodeLLMConfiguration(LLMConfiguration):
+    pass
 
 # class AgentConfiguration:
 #     def __init__(self, config_path: str) -> None:
@@ -59,5 +154,47 @@ llm_config = LLMConfiguration()
 code_llm_config = CodeLLMConfiguration()
 cookie_file = "experience/cookies.json"
 conversation_file = "experience/crawl_conversation.json"
-load_dotenv("experience/.env")
-browser_path = os.getenv("BROWSER_PATH")
\ No newline at end of file
+browser_path = settings.browser_path
+browser_headless = settings.browser_headless
+browser_pool_size = settings.browser_pool_size
+browser_max_uses = settings.browser_max_uses
+browser_max_memory_mb = settings.browser_max_memory_mb
+timing_profile = settings.timing_profile
+screenshot_mode = settings.screenshot_mode
+screenshot_sample_every = settings.screenshot_sample_every
+screenshot_format = settings.screenshot_format
+screenshot_quality = settings.screenshot_quality
+screenshot_dir = settings.screenshot_dir
+screenshot_max_files = settings.screenshot_max_files
+screenshot_max_mb = settings.screenshot_max_mb
+scheduler_max_concurrency = settings.scheduler_max_concurrency
+scheduler_cpu_target = settings.scheduler_cpu_target
+scheduler_memory_limit_mb = settings.scheduler_memory_limit_mb
+login_cache_ttl = settings.login_cache_ttl
+routing_profile = settings.routing_profile
+trace_export = settings.trace_export
+trace_file = settings.trace_file
+result_store_file = settings.result_store_file
+answer_cache_ttl = settings.answer_cache_ttl
+answer_cache_size = settings.answer_cache_size
+answer_cache_disk_size = settings.answer_cache_disk_size
+answer_cache_file = settings.answer_cache_file
+storage_state_dir = settings.storage_state_dir
+storage_state_debounce = settings.storage_state_debounce
+storage_state_refresh = settings.storage_state_refresh
+login_timeout = settings.login_timeout
+daemon_host = settings.daemon_host
+daemon_port = settings.daemon_port
+daemon_socket = settings.daemon_socket
+daemon_workers = settings.daemon_workers
+daemon_queue_size = settings.daemon_queue_size
+daemon_client_limit = settings.daemon_client_limit
+import_budget_ms = settings.import_budget_ms
+query_deadline = settings.query_deadline
+site_deadline = settings.site_deadline
+deadline_grace = settings.deadline_grace
+breaker_threshold = settings.breaker_threshold
+breaker_cooldown = settings.breaker_cooldown
+analysis_cache_ttl = settings.analysis_cache_ttl
+analysis_cache_size = settings.analysis_cache_size
+input_strategy_file = settings.input_strategy_file
@@ -0,0 +1,287 @@
+import argparse
+import asyncio
+import dataclasses
+import json
+import time
+from typing import Dict, List
+from urllib.parse import urlsplit
+from configuration import (daemon_host, daemon_port, daemon_socket, daemon_workers, daemon_queue_size,
+                           daemon_client_limit)
+from main import chat_many, stream_chat_many, load_sites
+from sessions import get_session_manager, close_sessions
+from browser_pool import get_browser_pool, close_browser_pool
+from answer_cache import answer_cache, CACHE_MODES
+from deadlines import circuit_breaker
+from timing import PROFILES
+from tracing import percentile
+
+STATUS_TEXT = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+               413: 'Payload Too Large', 429: 'Too Many Requests', 500: 'Internal Server Error', 503: 'Service Unavailable'}
+
+MAX_BODY = 1024 * 1024
+
+class HTTPError(Exception):
+    def __init__(self, status: int, message: str) -> None:
+        super().__init__(message)
+        self.status = status
+
+class QueryDaemon:
+    """
+    常驻查询服务：启动时预热浏览器池，之后通过本地 HTTP（TCP 或 Unix socket）接收问题，
+    复用同一个引擎执行 chat_many，免去每次运行的导入、驱动启动和浏览器启动开销。
+
+    POST /query     {"query": ..., "timing": ..., "new_chat": false, "cache": "use", "sites": [url, ...], "stream": false,
+                     "deadline": 秒, "site_deadline": 秒}
+    GET  /health    存活检查
+    GET  /metrics   队列、并发、延迟和缓存统计
+
+    同时执行的问题数为 workers，超出的请求在准入队列中等待，队列满时返回 503；
+    每个客户端（X-Client-Id 头，缺省为对端地址）排队和执行中的请求数不超过 client_limit，
+    超出返回 429。客户端断开连接时取消其正在执行的问题。
+    """
+    def __init__(self, workers: int = daemon_workers, queue_size: int = daemon_queue_size,
+                 client_limit: int = daemon_client_limit) -> None:
+        self.workers = max(1, workers)
+        self.queue_size = queue_size
+        self.client_limit = client_limit
+        self._slots = asyncio.Semaphore(self.workers)
+        self._waiting = 0
+        self._active = 0
+        self._clients: dict[str, int] = {}
+        self._latencies: list[float] = []
+        self.started = time.time()
+        self.metrics = {'requests': 0, 'completed': 0, 'failed': 0, 'cancelled': 0, 'rejected_queue': 0,
+                        'rejected_client': 0}
+
+    async def start(self):
+        """预热浏览器池和会话管理器。"""
+        await get_browser_pool().start()
+        get_session_manager()
+
+    async def close(self):
+        await close_sessions()
+        await close_browser_pool()
+
+    def _admit(self, client: str):
+        if self.client_limit and self._clients.get(client, 0) >= self.client_limit:
+            self.metrics['rejected_client'] += 1
+            raise HTTPError(429, f"客户端 {client} 的并发请求数已达上限 {self.client_limit}")
+        if self._slots.locked() and self._waiting >= self.queue_size:
+            self.metrics['rejected_queue'] += 1
+            raise HTTPError(503, "准入队列已满")
+        self._clients[client] = self._clients.get(client, 0) + 1
+
+    def _leave(self, client: str):
+        self._clients[client] -= 1
+        if not self._clients[client]:
+            del self._clients[client]
+
+    async def _run(self, client: str, job):
+        """按准入规则排队执行 job()，无论成功、失败还是取消都释放客户端配额。"""
+        self._admit(client)
+        try:
+            self._waiting += 1
+            try:
+                await self._slots.acquire()
+            finally:
+                self._waiting -= 1
+            self._active += 1
+            start = time.monotonic()
+            try:
+                result = await job()
+            except asyncio.CancelledError:
+                self.metrics['cancelled'] += 1
+                raise
+            except Exception:
+                self.metrics['failed'] += 1
+                raise
+            finally:
+                self._active -= 1
+                self._slots.release()
+            self.metrics['completed'] += 1
+            self._latencies.append(time.monotonic() - start)
+            del self._latencies[:-1000]
+            return result
+        finally:
+            self._leave(client)
+
+    @staticmethod
+    def _sites(names: List[str] | None) -> List[Dict] | None:
+        if names is not None and (not isinstance(names, list) or not all(isinstance(name, str) for name in names)):
+            raise HTTPError(400, "sites 应为站点 URL 列表")
+        if not names:
+            return None
+        sites = [data for data in load_sites() if data['url'] in names]
+        if not sites:
+            raise HTTPError(400, "sites 中没有已配置的站点")
+        return sites
+
+    def health(self) -> Dict:
+        return {'status': 'ok', 'uptime': time.time() - self.started, 'active': self._active, 'waiting': self._waiting}
+
+    def snapshot(self) -> Dict:
+        return {**self.metrics, 'active': self._active, 'waiting': self._waiting, 'workers': self.workers,
+                'queue_size': self.queue_size, 'clients': dict(self._clients),
+                'latency_s': {'p50': percentile(self._latencies, 50), 'p95': percentile(self._latencies, 95)},
+                'answer_cache': answer_cache.stats(), 'circuit_breaker': circuit_breaker.snapshot()}
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            try:
+                method, path, headers, body = await read_request(reader)
+                peer = writer.get_extra_info('peername')
+                # TCP 连接按对端地址区分客户端，Unix socket 没有对端地址
+                client = headers.get('x-client-id') or (peer[0] if isinstance(peer, tuple) else 'local')
+                await self._dispatch(method, path, headers, body, client, reader, writer)
+            except HTTPError as e:
+                await write_json(writer, e.status, {'error': str(e)})
+            except (ConnectionError, asyncio.IncompleteReadError):
+                pass
+            except Exception as e:
+                await write_json(writer, 500, {'error': str(e)})
+        finally:
+            try:
+                writer.close()
+                await writer.wait_closed()
+            except Exception:
+                pass
+
+    async def _dispatch(self, method, path, headers, body, client, reader, writer):
+        if path == '/health':
+            await write_json(writer, 200, self.health())
+            return
+        if path == '/metrics':
+            await write_json(writer, 200, self.snapshot())
+            return
+        if path != '/query':
+            raise HTTPError(404, f"未知路径: {path}")
+        if method != 'POST':
+            raise HTTPError(405, "/query 只接受 POST")
+        try:
+            request = json.loads(body or b'{}')
+            query = request['query']
+        except (json.JSONDecodeError, KeyError, TypeError):
+            raise HTTPError(400, "请求体应为包含 query 的 JSON")
+        self.metrics['requests'] += 1
+        timing = request.get('timing')
+        if timing is not None and (not isinstance(timing, str) or timing not in PROFILES):
+            raise HTTPError(400, f"未知的节奏配置: {timing}，可选: {', '.join(PROFILES)}")
+        cache = request.get('cache', 'use')
+        if not isinstance(cache, str) or cache not in CACHE_MODES:
+            raise HTTPError(400, f"未知的缓存模式: {cache}，可选: {', '.join(CACHE_MODES)}")
+        options = {'timing': timing, 'new_chat': bool(request.get('new_chat', False)),
+                   'cache': cache, 'sites': self._sites(request.get('sites'))}
+        for name in ('deadline', 'site_deadline'):
+            if request.get(name) is not None:
+                try:
+                    options[name] = float(request[name])
+                except (TypeError, ValueError):
+                    raise HTTPError(400, f"{name} 应为秒数")
+        if request.get('stream'):
+            await self._stream(query, options, client, reader, writer)
+            return
+        task = asyncio.ensure_future(self._run(client, lambda: chat_many(query, **options)))
+        results = await cancel_on_disconnect(task, reader)
+        if results is not None:
+            await write_json(writer, 200, {'query': query, 'results': results})
+
+    async def _stream(self, query, options, client, reader, writer):
+        """以 NDJSON 逐行返回 ChatEvent，首行之前就可能因准入失败返回错误。"""
+        def write_line(payload):
+            writer.write((json.dumps(payload, ensure_ascii=False) + '\n').encode('utf-8'))
+
+        async def job():
+            await write_head(writer, 200, 'application/x-ndjson')
+            try:
+                async for event in stream_chat_many(query, **options):
+                    write_line(dataclasses.asdict(event))
+                    await writer.drain()
+            except (ConnectionError, asyncio.CancelledError):
+                raise
+            except Exception as e:
+                # 响应头已发出，错误以事件行的形式返回
+                write_line({'site': '', 'kind': 'error', 'text': str(e)})
+                await writer.drain()
+        await cancel_on_disconnect(asyncio.ensure_future(self._run(client, job)), reader)
+
+async def cancel_on_disconnect(task: asyncio.Future, reader: asyncio.StreamReader):
+    """等待 task，客户端先断开连接时取消它并返回 None。"""
+    disconnected = asyncio.ensure_future(reader.read(1))
+    try:
+        done, _ = await asyncio.wait({task, disconnected}, return_when=asyncio.FIRST_COMPLETED)
+        if task in done:
+            return task.result()
+        if disconnected.done() and not disconnected.exception() and disconnected.result():
+            # 请求体之后客户端又发来数据（不支持 pipelining），继续等待结果
+            return await task
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        return None
+    finally:
+        disconnected.cancel()
+
+async def read_request(reader: asyncio.StreamReader):
+    request_line = (await reader.readline()).decode('latin-1').strip()
+    if not request_line:
+        raise ConnectionError("空请求")
+    try:
+        method, target, _ = request_line.split(' ', 2)
+    except ValueError:
+        raise HTTPError(400, "无效的请求行")
+    headers = {}
+    while True:
+        line = (await reader.readline()).decode('latin-1').strip()
+        if not line:
+            break
+        name, _, value = line.partition(':')
+        headers[name.strip().lower()] = value.strip()
+    length = int(headers.get('content-length') or 0)
+    if length > MAX_BODY:
+        raise HTTPError(413, "请求体过大")
+    body = await reader.readexactly(length) if length else b''
+    return method.upper(), urlsplit(target).path, headers, body
+
+async def write_head(writer: asyncio.StreamWriter, status: int, content_type: str, length: int | None = None):
+    lines = [f"HTTP/1.1 {status} {STATUS_TEXT.get(status, 'Error')}", f"Content-Type: {content_type}", "Connection: close"]
+    if length is not None:
+        lines.append(f"Content-Length: {length}")
+    if status in (429, 503):
+        lines.append("Retry-After: 1")
+    writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1'))
+    await writer.drain()
+
+async def write_json(writer: asyncio.StreamWriter, status: int, payload):
+    body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+    await write_head(writer, status, 'application/json; charset=utf-8', len(body))
+    writer.write(body)
+    await writer.drain()
+
+async def serve(host: str = daemon_host, port: int = daemon_port, socket_path: str = daemon_socket, **kwargs):
+    daemon = QueryDaemon(**kwargs)
+    await daemon.start()
+    if socket_path:
+        server = await asyncio.start_unix_server(daemon.handle, path=socket_path)
+        print(f"查询服务已启动: unix:{socket_path}")
+    else:
+        server = await asyncio.start_server(daemon.handle, host, port)
+        print(f"查询服务已启动: http://{host}:{port}")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        await daemon.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="常驻的本地查询服务")
+    parser.add_argument('--host', default=daemon_host)
+    parser.add_argument('--port', type=int, default=daemon_port)
+    parser.add_argument('--socket', default=daemon_socket, help='Unix socket 路径，设置后不监听 TCP')
+    parser.add_argument('--workers', type=int, default=daemon_workers, help='同时执行的问题数')
+    parser.add_argument('--queue-size', type=int, default=daemon_queue_size, help='准入队列长度')
+    parser.add_argument('--client-limit', type=int, default=daemon_client_limit, help='每个客户端的并发请求上限，0 表示不限')
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args.host, args.port, args.socket, workers=args.workers, queue_size=args.queue_size,
+                          client_limit=args.client_limit))
+    except KeyboardInterrupt:
+        pass
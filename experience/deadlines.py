@@ -0,0 +1,116 @@
+import asyncio
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List
+from configuration import breaker_threshold, breaker_cooldown
+
+SITE_STATUSES = ('complete', 'partial', 'timed_out', 'failed', 'skipped')
+
+@dataclass
+class SiteResult:
+    """
+    chat_many_detailed 中一个站点的结果。
+
+    status: complete 回答已完成；partial 截止时间到达时回答仍在生成，messages 是此时已有的内容；
+    timed_out 截止前没有拿到回答；failed 重试后仍出错；skipped 站点熔断中，没有发送问题
+    """
+    site: str
+    status: str
+    messages: List[Dict[str, str]] = field(default_factory=list)
+    error: str = ''
+    elapsed: float = 0.0
+    cached: bool = False
+
+    @property
+    def answered(self) -> bool:
+        return self.status in ('complete', 'partial')
+
+class Deadline:
+    """以 time.monotonic() 计的截止时间，at 为 None 表示不限。"""
+    def __init__(self, at: float | None = None) -> None:
+        self.at = at
+
+    @classmethod
+    def after(cls, seconds: float | None, parent: "Deadline | None" = None) -> "Deadline":
+        """seconds 秒后截止（0 或 None 表示不限），且不晚于 parent。"""
+        at = time.monotonic() + seconds if seconds else None
+        if parent is not None and parent.at is not None:
+            at = parent.at if at is None else min(at, parent.at)
+        return cls(at)
+
+    def remaining(self) -> float | None:
+        return None if self.at is None else max(0.0, self.at - time.monotonic())
+
+    def expired(self) -> bool:
+        return self.at is not None and time.monotonic() >= self.at
+
+    async def run(self, awaitable, grace: float = 0.0):
+        """等待 awaitable，超过截止时间 grace 秒后取消它并抛出 asyncio.TimeoutError。"""
+        remaining = self.remaining()
+        return await asyncio.wait_for(awaitable, None if remaining is None else remaining + grace)
+
+class CircuitBreaker:
+    """
+    按站点的熔断器：连续失败（出错或超时，每次尝试都计数）threshold 次后打开，
+    cooldown 秒内跳过该站点；冷却结束后只放行一个试探请求，试探结束（record）前其他请求仍被跳过，
+    成功则恢复，失败立即重新打开。试探超过 cooldown 秒仍未结束（调用方被取消等）时放行新的试探。
+    threshold 为 0 时不熔断。
+    """
+    def __init__(self, threshold: int = breaker_threshold, cooldown: float = breaker_cooldown) -> None:
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self._failures: dict[str, int] = {}
+        self._opened: dict[str, float] = {}
+        self._probing: dict[str, float] = {}
+
+    def allow(self, site: str) -> bool:
+        now = time.monotonic()
+        probe = self._probing.get(site)
+        if probe is not None:
+            if now - probe < self.cooldown:
+                return False
+            self._probing[site] = now
+            return True
+        opened = self._opened.get(site)
+        if opened is None:
+            return True
+        if now - opened < self.cooldown:
+            return False
+        del self._opened[site]
+        self._failures[site] = self.threshold - 1
+        self._probing[site] = now
+        return True
+
+    def record(self, site: str, ok: bool):
+        self._probing.pop(site, None)
+        if ok:
+            self._failures.pop(site, None)
+            return
+        self._failures[site] = self._failures.get(site, 0) + 1
+        if self.threshold and self._failures[site] >= self.threshold:
+            self._opened[site] = time.monotonic()
+
+    def state(self, site: str) -> str:
+        """closed / open / half_open（冷却已结束、等待试探或试探中）。"""
+        if site in self._probing:
+            return 'half_open'
+        opened = self._opened.get(site)
+        if opened is None:
+            return 'closed'
+        return 'open' if time.monotonic() - opened < self.cooldown else 'half_open'
+
+    def snapshot(self) -> Dict[str, Dict]:
+        return {site: {'state': self.state(site), 'failures': self._failures.get(site, 0)}
+                for site in sorted(set(self._failures) | set(self._opened) | set(self._probing))}
+
+    def reset(self, site: str | None = None):
+        if site is None:
+            self._failures.clear()
+            self._opened.clear()
+            self._probing.clear()
+        else:
+            self._failures.pop(site, None)
+            self._opened.pop(site, None)
+            self._probing.pop(site, None)
+
+circuit_breaker = CircuitBreaker()
@@ -1,48 +1,64 @@
 import asyncio
 # from llm_conversation import LLMConversation
 from webpage_analyzer import *
-from configuration import cookie_file, code_llm_config
+from browser_pool import get_browser_pool
+from timing import TimingProfile, get_profile, wait_ready, settle
+from screenshots import ScreenshotPolicy, get_screenshot_writer
+from tracing import tracer
 # from filter_code import filter_code
 
-async def execute_js(js_code_list: list[str], url: str, playwright_instance=None, browser=None, context=None, page=None):
+async def execute_js(js_code_list: list[str], url: str, playwright_instance=None, browser=None, context=None, page=None,
+                     timing: str | TimingProfile | None = None, ready_selector: str = '',
+                     screenshot: str | ScreenshotPolicy | None = None):
+    with tracer.span('execute_js', site=url, scripts=len(js_code_list)):
+        return await _execute_js(js_code_list, url, page, timing, ready_selector, screenshot)
+
+async def _execute_js(js_code_list: list[str], url: str, page, timing: str | TimingProfile | None, ready_selector: str,
+                      screenshot: str | ScreenshotPolicy | None):
+    profile = get_profile(timing)
+    screenshot_writer = get_screenshot_writer(screenshot)
     console_logs = []
-    create_browser = False
-    if playwright_instance is None or browser is None or context is None or page is None:
-        create_browser = True
-        playwright_instance, browser, context, page = await create_browser_context(headless=False)
+    def handle_console(msg):
+        console_logs.append(f"{msg.type}: {msg.text}")
+    leased = False
+    if page is None:
+        leased = True
+        page = await get_browser_pool().acquire()
+    page.on('console', handle_console)
     try:
-        def handle_console(msg):
-            console_logs.append(f"{msg.type}: {msg.text}")
-        page.on('console', handle_console)
         if page.url != url:
-            await page.goto(url, wait_until='domcontentloaded') 
-        await simulate_human_behavior(page)
-        await asyncio.sleep(random.uniform(1, 3))
+            with tracer.span('goto'):
+                await page.goto(url, wait_until='domcontentloaded')
+        await wait_ready(page, profile, ready_selector)
         result_list = []
+        failed = False
         for js_code in js_code_list:
             try:
                 # print(f"执行JS代码: {js_code}")
-                result_list.append(await page.evaluate(js_code))
-                await page.wait_for_load_state('domcontentloaded')
-                await asyncio.sleep(random.uniform(3, 5))
+                with tracer.span('evaluate'):
+                    result_list.append(await page.evaluate(js_code))
+                await settle(page, profile)
             except Exception as e:
                 result_list.append(f"执行JS代码{js_code}时出错: {e}")
+                # 错误以字符串返回给调用方，span 中仍记为出错
+                tracer.fail(e)
+                failed = True
                 break
-        screenshot_dir = 'screenshots'
-        os.makedirs(screenshot_dir, exist_ok=True)
-        timestamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
-        screenshot_path = os.path.join(screenshot_dir, f'screenshot_{timestamp}.png')
-        await page.screenshot(path=screenshot_path)
+        screenshot_path = await screenshot_writer.capture(page, error=failed)
         search_url = page.url
         # print(f"当前页面 URL: {search_url}")
     except Exception as e:
-        return [f"出错: {e}"], [], "", page.url
+        tracer.fail(e)
+        try:
+            screenshot_path = await screenshot_writer.capture(page, error=True)
+        except Exception:
+            screenshot_path = ""
+        return [f"出错: {e}"], [], screenshot_path, page.url
     finally:
-        if create_browser:
-            await page.close()
-            await context.close()
-            await browser.close()
-            await playwright_instance.stop()
+        # 调用方传入的页面会继续使用，监听器在本次执行结束后移除
+        page.remove_listener('console', handle_console)
+        if leased:
+            await get_browser_pool().release(page)
     return result_list, console_logs, screenshot_path, search_url
 
 # async def execute_js_codes_in_pages(js_code_list: list[str], url_list: list[str], playwright_instance, browser, context, page_list):
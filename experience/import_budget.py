@@ -0,0 +1,74 @@
+import argparse
+import os
+import subprocess
+import sys
+from typing import Dict, List
+from configuration import import_budget_ms
+
+ENTRY_MODULES = ['main', 'daemon', 'batch']
+
+# 只应在第一次使用时加载的重依赖，出现在入口模块的导入链中即视为回归
+LAZY_DEPENDENCIES = ('patchright', 'playwright', 'fake_useragent', 'PIL', 'opentelemetry', 'psutil', 'multiprocessing')
+
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def measure_imports(module: str) -> Dict[str, tuple[int, int]]:
+    """
+    在新的解释器中用 python -X importtime 导入 module。
+
+    Returns:
+        dict: {模块名: (自身耗时 us, 累计耗时 us)}，只包含 module 及其导入链
+    """
+    env = {**os.environ, 'PYTHONPATH': os.pathsep.join(filter(None, [PACKAGE_DIR, os.environ.get('PYTHONPATH')]))}
+    # 与 CLI 一样从仓库根目录启动，.env 等相对路径保持一致
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'], cwd=os.path.dirname(PACKAGE_DIR),
+                          env=env, capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(f"导入 {module} 失败:\n{proc.stderr.strip().splitlines()[-1]}")
+    timings, chain = {}, {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|', 2)
+        chain[name.strip()] = (int(self_us), int(cumulative_us))
+        # 顶层模块的记录输出在它的依赖之后，缩进为一个空格；解释器启动时的导入属于其他顶层模块
+        if not name[1:2].isspace():
+            if name.strip() == module:
+                timings = chain
+            chain = {}
+    return timings
+
+def check(modules: List[str], budget_ms: float = import_budget_ms, runs: int = 3) -> List[str]:
+    """
+    检查每个入口模块的导入耗时（取 runs 次中的最小值）和是否提前加载了重依赖。
+
+    Returns:
+        list: 违反预算的说明，为空表示通过
+    """
+    failures = []
+    for module in modules:
+        measure_imports(module)  # 预热字节码缓存
+        samples = [measure_imports(module) for _ in range(max(1, runs))]
+        total_ms = min(timings[module][1] for timings in samples) / 1000
+        timings = samples[0]
+        heaviest = sorted(timings.items(), key=lambda item: item[1][0], reverse=True)[:5]
+        print(f"{module}: {total_ms:.1f} ms（预算 {budget_ms:.0f} ms）")
+        for name, (self_us, _) in heaviest:
+            print(f"    {name:<32} {self_us / 1000:>7.1f} ms")
+        if total_ms > budget_ms:
+            failures.append(f"{module} 导入耗时 {total_ms:.1f} ms，超出预算 {budget_ms:.0f} ms")
+        loaded = sorted({name for name in timings if name.split('.')[0] in LAZY_DEPENDENCIES})
+        if loaded:
+            failures.append(f"{module} 导入时加载了应延迟加载的依赖: {', '.join(loaded)}")
+    return failures
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="检查入口模块的导入耗时预算，超出时以非零状态退出")
+    parser.add_argument('modules', nargs='*', default=ENTRY_MODULES, help='要检查的入口模块')
+    parser.add_argument('--budget', type=float, default=import_budget_ms, help='每个模块的导入耗时上限（毫秒）')
+    parser.add_argument('--runs', type=int, default=3, help='测量次数，取最小值')
+    args = parser.parse_args()
+    failures = check(args.modules, args.budget, args.runs)
+    for failure in failures:
+        print(failure, file=sys.stderr)
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,104 @@
+import json
+import os
+from configuration import input_strategy_file
+from script_registry import registry
+
+def _normalize(text: str) -> str:
+    return ''.join((text or '').split())
+
+class InputInjector:
+    """
+    输入注入引擎：textarea / input 直接设置 value，contenteditable 编辑器
+    （ProseMirror、Lexical、Quill 等）依次尝试整段 insertText、模拟粘贴、
+    Playwright keyboard.insert_text 和分块插入，选用第一个被编辑器接受的策略并按站点缓存。
+    缓存写在 cache_file（INPUT_STRATEGY_FILE），为空时只缓存在内存中。
+    """
+    EDITABLE_STRATEGIES = ['insert_text', 'paste', 'keyboard', 'chunked']
+
+    def __init__(self, cache_file: str = input_strategy_file, chunk_size: int = 200) -> None:
+        self.cache_file = cache_file
+        self.chunk_size = chunk_size
+        self._cache: dict[str, str] | None = None
+
+    def _load(self) -> dict[str, str]:
+        if self._cache is None:
+            self._cache = {}
+            if self.cache_file and os.path.exists(self.cache_file):
+                try:
+                    with open(self.cache_file, 'r', encoding='utf-8') as f:
+                        self._cache = json.load(f)
+                except (OSError, json.JSONDecodeError):
+                    pass
+        return self._cache
+
+    def _remember(self, site: str, strategy: str | None):
+        cache = self._load()
+        if cache.get(site) == strategy:
+            return
+        if strategy is None:
+            cache.pop(site, None)
+        else:
+            cache[site] = strategy
+        if self.cache_file:
+            os.makedirs(os.path.dirname(self.cache_file) or '.', exist_ok=True)
+            with open(self.cache_file, 'w', encoding='utf-8') as f:
+                json.dump(cache, f, ensure_ascii=False, indent=4)
+
+    def cached_strategy(self, site: str) -> str | None:
+        return self._load().get(site)
+
+    async def _call(self, page, action: str, selector: str, **kwargs):
+        return await registry.call(page, 'input', {'action': action, 'selector': selector, 'message': kwargs.get('message', ''),
+                                                   'strategy': kwargs.get('strategy', ''), 'sendSelector': kwargs.get('send_selector', ''),
+                                                   'chunkSize': self.chunk_size})
+
+    async def _try(self, page, selector: str, message: str, strategy: str) -> bool:
+        if strategy == 'keyboard':
+            await self._call(page, 'focus', selector)
+            await page.keyboard.insert_text(message)
+            text = await self._call(page, 'read', selector)
+        else:
+            text = await self._call(page, 'fill', selector, message=message, strategy=strategy)
+        return _normalize(text) == _normalize(message)
+
+    async def fill(self, page, site: str, selector: str, message: str, strategy: str | None = None) -> str:
+        """
+        把 message 填入输入框，返回实际使用的策略。
+
+        Args:
+            page: 页面
+            site: 站点 URL，用作策略缓存的键
+            selector: 输入框选择器
+            message: 要输入的文本
+            strategy: 指定策略（站点配置中的 input_strategy），为空时自动探测
+        """
+        kind = await self._call(page, 'kind', selector)
+        if kind == 'value':
+            await self._call(page, 'fill', selector, message=message, strategy='native_value')
+            return 'native_value'
+        if kind != 'editable':
+            raise ValueError(f"未知输入类型，请检查 selector: {selector}")
+        if strategy:
+            if await self._try(page, selector, message, strategy):
+                return strategy
+            # 指定的策略未通过校验时与自动探测一样用真实键盘输入兜底
+            if strategy != 'keyboard' and await self._try(page, selector, message, 'keyboard'):
+                return 'keyboard'
+            raise RuntimeError(f"输入框中的文本与问题不一致，指定的输入策略 {strategy} 未通过校验: {selector}")
+        cached = self.cached_strategy(site)
+        candidates = ([cached] if cached else []) + [s for s in self.EDITABLE_STRATEGIES if s != cached]
+        for candidate in candidates:
+            if await self._try(page, selector, message, candidate):
+                self._remember(site, candidate)
+                return candidate
+        # 没有策略通过校验（编辑器可能改写了文本），用真实键盘输入兜底且不缓存，兜底同样要通过校验
+        self._remember(site, None)
+        if not await self._try(page, selector, message, 'keyboard'):
+            raise RuntimeError(f"输入框中的文本与问题不一致，所有输入策略均未通过校验: {selector}")
+        return 'keyboard'
+
+    async def send(self, page, selector: str, send_selector: str = ''):
+        """点击发送按钮，未配置按钮时在输入框上回车发送。"""
+        await self._call(page, 'send', selector, send_selector=send_selector)
+
+injector = InputInjector()
@@ -0,0 +1,110 @@
+import json
+import os
+import time
+from urllib.parse import urlsplit
+from configuration import conversation_file, login_cache_ttl
+from storage_state import StorageStateManager, storage_states
+
+LOGIN_KEYWORDS = ['login', 'sign in', '请登录', '登录', 'signin', 'log in', 'sign up']
+
+# 只检查密码框和较短的按钮/链接文字，不再扫描整页 inner_text
+DETECT_LOGIN_JS = """(keywords) => {
+  if (document.querySelector('input[type="password"]')) return true;
+  for (const el of document.querySelectorAll('a, button, [role="button"]')) {
+    const text = (el.innerText || '').trim().toLowerCase();
+    if (text && text.length <= 30 && keywords.some(k => text.includes(k))) return true;
+  }
+  return false;
+}"""
+
+def origin_of(url: str) -> str:
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}"
+
+class LoginStateCache:
+    """
+    按 origin 缓存 DETECT_LOGIN_JS 的检测结果（“是否需要登录”），带 TTL。
+
+    统计、同意弹窗等 cookies 不代表已登录，只有站点配置了会话 cookie 名
+    （crawl_conversation.json 中的 session_cookies，或通过 configure 注册）时，
+    存储状态中这些 cookies 全部存在且未过期才直接视为已登录，有效期取其中最早的过期时间。
+    """
+    def __init__(self, ttl: float = login_cache_ttl, states: StorageStateManager = storage_states,
+                 sites_file: str = conversation_file) -> None:
+        self.ttl = ttl
+        self.states = states
+        self.sites_file = sites_file
+        self._entries: dict[str, tuple[bool, float]] = {}
+        self._session_cookies: dict[str, frozenset] | None = None
+
+    def _load(self) -> dict[str, frozenset]:
+        if self._session_cookies is None:
+            self._session_cookies = {}
+            if self.sites_file and os.path.exists(self.sites_file):
+                try:
+                    with open(self.sites_file, 'r', encoding='utf-8') as f:
+                        self.configure_sites(json.load(f))
+                except (OSError, json.JSONDecodeError):
+                    pass
+        return self._session_cookies
+
+    def configure(self, url: str, session_cookies: list[str] | None):
+        """注册站点表示已登录的会话 cookie 名，为空时取消。"""
+        origin = origin_of(url)
+        if session_cookies:
+            self._load()[origin] = frozenset(session_cookies)
+        else:
+            self._load().pop(origin, None)
+        self._entries.pop(origin, None)
+
+    def configure_sites(self, sites: list[dict]):
+        """按站点配置列表（crawl_conversation.json 的结构）注册会话 cookie 名。"""
+        for data in sites:
+            if data.get('session_cookies'):
+                self.configure(data['url'], data['session_cookies'])
+
+    def _from_storage_state(self, origin: str) -> float | None:
+        """站点配置的会话 cookies 都存在且未过期时返回登录状态的过期时间，否则返回 None。"""
+        names = self._load().get(origin)
+        if not names:
+            return None
+        now = time.time()
+        expiries = []
+        found = set()
+        for cookie in self.states.cookies_for(origin):
+            if cookie.get('name') not in names:
+                continue
+            expires = cookie.get('expires', -1)
+            if expires is None or expires < 0:
+                # 会话 cookie 没有过期时间，按 TTL 处理
+                expiries.append(now + self.ttl)
+            elif expires > now:
+                expiries.append(expires)
+            else:
+                continue
+            found.add(cookie['name'])
+        return min(expiries) if found == names else None
+
+    def get(self, url: str) -> bool | None:
+        """返回缓存的“是否需要登录”，未知或已过期时返回 None。"""
+        origin = origin_of(url)
+        entry = self._entries.get(origin)
+        if entry is not None and entry[1] > time.time():
+            return entry[0]
+        expires = self._from_storage_state(origin)
+        if expires is not None:
+            self._entries[origin] = (False, min(expires, time.time() + self.ttl))
+            return False
+        return None
+
+    def set(self, url: str, login_required: bool, ttl: float | None = None):
+        self._entries[origin_of(url)] = (login_required, time.time() + (self.ttl if ttl is None else ttl))
+
+    def invalidate(self, url: str):
+        self._entries.pop(origin_of(url), None)
+
+login_cache = LoginStateCache()
+
+async def detect_login_required(page) -> bool:
+    """在已加载的页面上检测是否出现登录入口。"""
+    return await page.evaluate(DETECT_LOGIN_JS, LOGIN_KEYWORDS)
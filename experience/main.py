@@ -1,135 +1,252 @@
-from execute_js import execute_js
-from webpage_analyzer import create_browser_context
-from configuration import conversation_file
-import asyncio, json, ast, time
-from typing import List, Dict
+from script_registry import registry
+from browser_pool import close_browser_pool
+from sessions import SessionManager, get_session_manager, close_sessions, same_origin
+from scheduler import SiteScheduler
+from sharding import ShardedExecutor
+from configuration import conversation_file, query_deadline, site_deadline, deadline_grace
+from completion import build_detector
+from input_injection import injector
+from timing import get_profile, wait_ready
+from streaming import ChatEvent, PartialTextWatcher
+from screenshots import get_screenshot_writer
+from request_routing import router
+from tracing import tracer
+from result_store import ResultStore, get_result_store
+from answer_cache import answer_cache
+from deadlines import Deadline, SiteResult, CircuitBreaker, circuit_breaker
+import asyncio, json, ast, time, argparse, sqlite3
+from typing import AsyncIterator, Callable, List, Dict
 
-async def chat(query_js: str, selector: str, code: str, url: str, playwright_instance=None, browser=None, context=None, page=None) -> List[List[Dict[str, str]]]:
-    query_js = query_js.replace('{SELECTOR}', selector)
-    result_list, console_logs, screenshot_path, search_url = await execute_js([query_js], url, playwright_instance, browser, context, page)
-    # 等待网络流量停止
-    last_response_time = [time.time()]
-    def update_last_response_time():
-        last_response_time[0] = time.time()
-    page.on('response', update_last_response_time)
-    threshold = 5.0  # 5秒无网络响应，认为响应完成
-    while time.time() - last_response_time[0] < threshold:
-        await asyncio.sleep(0.5)
-    page.remove_listener('response', update_last_response_time)
-    result_list, console_logs, screenshot_path, search_url = await execute_js([code], search_url, playwright_instance, browser, context, page)
-    if type(result_list[0]) == str:
-      result: List[Dict[str, str]] = json.loads(result_list[0])
-    else:
-      result: List[Dict[str, str]] = result_list[0]
+async def chat(query: str, selector: str, code: str, url: str, playwright_instance=None, browser=None, context=None, page=None, completion: Dict = None, on_partial: Callable[[str, str], None] = None, timing: str = None, input_strategy: str = None, send_selector: str = '', deadline: Deadline = None) -> List[List[Dict[str, str]]]:
+    with tracer.span('chat', site=url):
+        return (await _chat(query, selector, code, url, page, completion, on_partial, timing, input_strategy, send_selector, deadline or Deadline())).messages
+
+async def _chat(query: str, selector: str, code: str, url: str, page, completion: Dict, on_partial: Callable[[str, str], None], timing: str, input_strategy: str, send_selector: str, deadline: Deadline) -> SiteResult:
+    start = time.monotonic()
+    profile = get_profile(timing)
+    routing_before = router.snapshot(url)
+    # 拦截路由只装在聊天站点的页面上；常驻标签页已由 SessionManager 在导航前装好，这里不会重复安装
+    await router.install(page, url)
+    # 常驻标签页已在站点的对话中时不再导航，问题发送到已有对话
+    if not same_origin(page.url, url):
+        with tracer.span('goto'):
+            await page.goto(url, wait_until='domcontentloaded')
+    # 发送前布置完成检测，避免漏掉回复开头的信号
+    detector = build_detector(url, completion)
+    await detector.arm(page)
+    watcher = None
+    if on_partial is not None:
+        watcher = PartialTextWatcher(code, on_partial)
+        await watcher.start(page)
+    try:
+        with tracer.span('wait_ready'):
+            await wait_ready(page, profile, selector)
+        # 记录发送前的消息数，提取时只取之后的新消息
+        cursor = await registry.message_count(page, code)
+        with tracer.span('fill') as span:
+            strategy = await injector.fill(page, url, selector, query, input_strategy)
+            if span is not None:
+                span.set('strategy', strategy)
+        with tracer.span('send'):
+            await injector.send(page, selector, send_selector)
+        with tracer.span('completion_wait') as span:
+            # 截止时间到达时不再等待完成信号，提取此时已有的回答
+            await detector.wait(deadline.at)
+            timed_out = getattr(detector, 'timed_out', False)
+            if span is not None:
+                span.set('timed_out', timed_out)
+    except Exception:
+        await get_screenshot_writer().capture(page, error=True)
+        raise
+    finally:
+        await detector.disarm()
+        if watcher is not None:
+            await watcher.stop()
+    # 提取脚本按站点注册到页面中，只编译一次；只返回本次发送之后的消息
+    with tracer.span('extract'):
+        extracted = await registry.extract(page, code, since=cursor)
+    result: List[Dict[str, str]] = extracted['messages']
+    answered = False
     for message in result:
        if message['role'] == 'assistant':
           message['role'] = url
+          answered = True
+    router.record_query(url, routing_before)
+    status = 'complete' if not timed_out else 'partial' if answered else 'timed_out'
+    return SiteResult(url, status, result, elapsed=time.monotonic() - start)
+
+def load_sites() -> List[Dict]:
+    with open(conversation_file, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def save_results(store: ResultStore | None, query: str, json_data: List[Dict], results: List):
+    """把成功站点的结果追加到结果库，写入失败不影响本次查询。"""
+    if store is None:
+        return
+    try:
+        store.add_many(query, [(data['url'], result) for data, result in zip(json_data, results) if not isinstance(result, Exception)])
+    except sqlite3.Error as e:
+        print(f"保存结果出错: {e}")
+
+async def run_site(query: str, data: Dict, sessions: SessionManager, new_chat: bool = False, timing: str = None, deadline: Deadline = None, site_deadline: float = site_deadline, breaker: CircuitBreaker = circuit_breaker, on_partial: Callable[[str, str], None] = None) -> SiteResult:
+    """
+    在站点的常驻标签页上执行一次 chat。站点的截止时间为 site_deadline 秒后且不晚于 deadline，
+    到达时返回已有的部分回答（partial）或 timed_out，不再等待；站点熔断中时直接返回 skipped。
+    其他异常照常抛出，由调度器重试。
+    """
+    url = data['url']
+    site = Deadline.after(site_deadline, deadline)
+    if site.expired():
+        # 重试排队期间整体截止时间可能已经到达
+        return SiteResult(url, 'timed_out', error="截止时间已到，未发送问题")
+    # 半开状态下 allow 放行的是唯一的试探请求，之后必须 record
+    if not breaker.allow(url):
+        return SiteResult(url, 'skipped', error=f"站点连续失败，熔断中（{breaker.cooldown:.0f} 秒冷却）")
+    start = time.monotonic()
+    async def attempt():
+        async with sessions.session(url, new_chat, data.get('new_chat_selector', '')) as page:
+            with tracer.span('chat', site=url):
+                return await _chat(query, data['selector'], data['code'], url, page, data.get('completion'), on_partial, timing or data.get('timing'), data.get('input_strategy'), data.get('send_selector', ''), site)
+    try:
+        # 完成等待会在截止时间返回部分回答，打开页面、填写等步骤卡住时在宽限期后强制取消
+        result = await site.run(attempt(), deadline_grace)
+    except asyncio.TimeoutError:
+        result = SiteResult(url, 'timed_out', error="截止时间前未完成")
+    except Exception:
+        breaker.record(url, False)
+        raise
+    if not result.error:
+        result.error = {'partial': "截止时间到达时回答尚未完成", 'timed_out': "截止时间前没有回答"}.get(result.status, '')
+    result.elapsed = time.monotonic() - start
+    breaker.record(url, result.answered)
     return result
 
-async def chat_many(query: str):
+async def chat_many_detailed(query: str, timing: str = None, sessions: SessionManager = None, new_chat: bool = False, scheduler: SiteScheduler = None, sites: List[Dict] = None, store: ResultStore = None, cache: str = 'use', deadline: float = query_deadline, site_deadline: float = site_deadline, breaker: CircuitBreaker = None) -> List[SiteResult]:
+    """
+    与 chat_many 相同，但按站点顺序返回 SiteResult，包含状态、错误和耗时。
+
+    deadline 为整个调用的截止时间（秒，0 表示不限），site_deadline 为每个站点从开始处理起的截止时间，
+    到达后返回各站点此时已有的回答，状态为 complete / partial / timed_out；
+    出错的站点为 failed，熔断中的站点为 skipped。只有 complete 的结果写入结果库和回答缓存。
+    """
+    json_data = sites if sites is not None else load_sites()
+    router.configure_sites(json_data)
+    sessions = sessions or get_session_manager()
+    scheduler = scheduler or SiteScheduler()
+    breaker = breaker or circuit_breaker
+    cached = answer_cache.lookup_sites(query, json_data, cache)
+    pending = [data for index, data in enumerate(json_data) if index not in cached]
+    overall = Deadline.after(deadline)
+    async def run_chat(data):
+        return await run_site(query, data, sessions, new_chat, timing, overall, site_deadline, breaker)
+    fresh = iter(await scheduler.run(pending, run_chat))
+    results = []
+    for index, data in enumerate(json_data):
+        if index in cached:
+            results.append(SiteResult(data['url'], 'complete', cached[index], cached=True))
+            continue
+        result = next(fresh)
+        if isinstance(result, Exception):
+            print(f"站点 {data['url']} 出错: {result}")
+            result = SiteResult(data['url'], 'failed', error=str(result))
+        elif result.status != 'complete':
+            print(f"站点 {data['url']} {result.status}: {result.error}")
+        results.append(result)
+    complete = [(data, result) for data, result in zip(json_data, results) if result.status == 'complete' and not result.cached]
+    save_results(store or get_result_store(), query, [data for data, _ in complete], [result.messages for _, result in complete])
+    answer_cache.store_sites(query, [data for data, _ in complete], [result.messages for _, result in complete], cache)
+    return results
+
+async def chat_many(query: str, timing: str = None, sessions: SessionManager = None, new_chat: bool = False, scheduler: SiteScheduler = None, sites: List[Dict] = None, store: ResultStore = None, cache: str = 'use', deadline: float = query_deadline, site_deadline: float = site_deadline):
+    """
+    把问题发送到所有站点。每个站点使用会话管理器中的常驻标签页，
+    默认在已有对话中继续提问，new_chat 为 True 时先开启新对话。
+    并发由 SiteScheduler 按机器负载自适应调整，失败的站点会重试，
+    重试后仍失败、超时或熔断中的站点返回空列表，截止时间到达时仍在回答的站点返回已有的部分回答。
+    sites 为空时使用 crawl_conversation.json 中的全部站点。
+    完整的结果追加到 store（默认为 RESULT_STORE 指定的结果库）。
+    cache 为回答缓存模式：use 命中缓存的站点不再打开浏览器，refresh 重新查询并更新缓存，bypass 不使用缓存。
+    deadline / site_deadline 见 chat_many_detailed。
+    """
+    results = await chat_many_detailed(query, timing, sessions, new_chat, scheduler, sites, store, cache, deadline, site_deadline)
+    return [result.messages for result in results]
+
+async def stream_chat_many(query: str, timing: str = None, sessions: SessionManager = None, new_chat: bool = False, scheduler: SiteScheduler = None, sites: List[Dict] = None, store: ResultStore = None, cache: str = 'use', deadline: float = query_deadline, site_deadline: float = site_deadline, breaker: CircuitBreaker = None) -> AsyncIterator[ChatEvent]:
+    """
+    与 chat_many 相同的扇出，但以异步生成器形式逐步产出各站点的增量回答：
+    async for event in stream_chat_many(query): ...
+
+    每个站点产出若干 delta 事件，最后以一个 final（或 error）事件结束，事件的 status 为站点结果状态：
+    截止时间到达时仍在回答的站点以 status 为 partial 的 final 事件结束。
+    timing 为本次调用的节奏配置（stealth/balanced/fast），优先于站点配置中的 timing。
+    每个站点的回答完成后即追加到 store。命中回答缓存的站点直接产出 cached 为 True 的 final 事件。
+    """
+    json_data = sites if sites is not None else load_sites()
+    router.configure_sites(json_data)
+    sessions = sessions or get_session_manager()
+    scheduler = scheduler or SiteScheduler()
+    breaker = breaker or circuit_breaker
+    store = store or get_result_store()
+    cached = answer_cache.lookup_sites(query, json_data, cache)
+    pending = [data for index, data in enumerate(json_data) if index not in cached]
+    overall = Deadline.after(deadline)
+    queue: asyncio.Queue = asyncio.Queue()
+    for index, messages in cached.items():
+        queue.put_nowait(ChatEvent(json_data[index]['url'], 'final', messages=messages, cached=True, status='complete'))
+    async def run_chat(data):
+        url = data['url']
+        def on_partial(delta, snapshot):
+            queue.put_nowait(ChatEvent(url, 'delta', delta, snapshot))
+        result = await run_site(query, data, sessions, new_chat, timing, overall, site_deadline, breaker, on_partial)
+        if result.status == 'complete':
+            # 逐站点保存，调用方收到最后一个事件后可能不再等待整个扇出结束
+            save_results(store, query, [data], [result.messages])
+            answer_cache.store_sites(query, [data], [result.messages], cache)
+        if result.answered:
+            queue.put_nowait(ChatEvent(url, 'final', messages=result.messages, status=result.status))
+        else:
+            queue.put_nowait(ChatEvent(url, 'error', result.error, status=result.status))
+    async def run_all():
+        results = await scheduler.run(pending, run_chat)
+        for data, result in zip(pending, results):
+            if isinstance(result, Exception):
+                queue.put_nowait(ChatEvent(data['url'], 'error', str(result), status='failed'))
+    runner = asyncio.ensure_future(run_all())
+    try:
+        remaining = len(json_data)
+        while remaining:
+            event = await queue.get()
+            if event.kind != 'delta':
+                remaining -= 1
+            yield event
+    finally:
+        runner.cancel()
+        await asyncio.gather(runner, return_exceptions=True)
+
+async def main(query: str, workers: int = 1, timing: str = None, cache: str = 'use', deadline: float = query_deadline, site_deadline: float = site_deadline):
+    if workers > 1:
+        executor = ShardedExecutor(workers, timing, cache, deadline, site_deadline)
+        try:
+            return await executor.chat_many(query)
+        finally:
+            executor.close()
     try:
-      with open(conversation_file, 'r', encoding='utf-8') as f:
-          json_data = json.load(f)
-      playwright_instance, browser, context = await create_browser_context(headless=False)
-      num_pages = 5
-      pages = [await context.new_page() for _ in range(num_pages)]
-      semaphore = asyncio.Semaphore(5)
-      query_js = """(async function universalFill(message, sendSelector = '', startDelay = 0) {
-  const sleep = ms => new Promise(r => setTimeout(r, ms));
-  /* ---------- 工具函数 ---------- */
-  async function waitFor(sel, timeout = 10_000) {
-    const t0 = Date.now();
-    const find = () => {
-      let el = document.querySelector(sel);
-      if (el) return el;
-      for (const n of document.querySelectorAll('*')) {
-        if (n.shadowRoot) {
-          el = n.shadowRoot.querySelector(sel);
-          if (el) return el;
-        }
-      }
-      return null;
-    };
-    return new Promise((resolve, reject) => {
-      const loop = () => {
-        const node = find();
-        if (node) return resolve(node);
-        if (Date.now() - t0 > timeout) return reject('timeout');
-        requestAnimationFrame(loop);
-      };
-      loop();
-    });
-  }
-  function fire(el, type, opts = {}) {
-    const evt = new (type === 'click' ? MouseEvent : Event)(type, { bubbles: true, composed: true, ...opts });
-    if (type === 'input')  evt._reactName = 'onInput';
-    if (type === 'change') evt._reactName = 'onChange';
-    el.dispatchEvent(evt);
-  }
-  function nativeSetValue(el, val) {
-    const map = { INPUT: 'HTMLInputElement', TEXTAREA: 'HTMLTextAreaElement', SELECT: 'HTMLSelectElement' };
-    const protoName = map[el.tagName];
-    if (!protoName) throw new Error('Unsupported element: ' + el.tagName);
-    const setter = Object.getOwnPropertyDescriptor(window[protoName].prototype, 'value').set;
-    setter.call(el, val);
-    fire(el, 'input');
-    fire(el, 'change');
-  }
-  async function typeEditable(el, text) {
-    el.focus();
-    getSelection().selectAllChildren(el);
-    getSelection().deleteFromDocument();
-    for (const ch of text) {
-      el.dispatchEvent(new InputEvent('beforeinput', { inputType: 'insertText', data: ch }));
-      document.execCommand('insertText', false, ch);
-      el.dispatchEvent(new InputEvent('input', { inputType: 'insertText', data: ch }));
-      await sleep(20);
-    }
-  }
-  /* ---------- 主流程 ---------- */
-  if (startDelay > 0) await sleep(startDelay);
-  try {
-    const input = await waitFor('{SELECTOR}');
-    console.log('[UniversalFill] 节点已找到', input);
-    if ('value' in input && input.tagName !== 'DIV') {
-      nativeSetValue(input, message);
-    } else if (input.contentEditable === 'true') {
-      await typeEditable(input, message);
-    } else {
-      throw new Error('未知输入类型，请检查 selector');
-    }
-    await sleep(150);
-    if (sendSelector) {
-      const btn = await waitFor(sendSelector);
-      btn.click();
-      console.log('[UniversalFill] 已点击发送按钮');
-    } else {
-      ['keydown', 'keyup'].forEach(type =>
-        input.dispatchEvent(new KeyboardEvent(type, { key: 'Enter', code: 'Enter', keyCode: 13, bubbles: true, composed: true }))
-      );
-      console.log('[UniversalFill] 已回车发送');
-    }
-    console.log('[UniversalFill] 全部完成！');
-  } catch (e) {
-    console.error('[UniversalFill]', e);
-  }
-})"""+f"(\"{query}\");"
-      async def run_chat(data, page):
-          async with semaphore:
-              return await chat(query_js, data['selector'], data['code'], data['url'], playwright_instance, browser, context, page)
-      tasks = [run_chat(data, pages[i % num_pages]) for i, data in enumerate(json_data)]
-      results = await asyncio.gather(*tasks)
-      return results
+        return await chat_many(query, timing=timing, cache=cache, deadline=deadline, site_deadline=site_deadline)
     finally:
-      for page in pages:
-          await page.close()
-      await context.close()
-      await browser.close()
-      await playwright_instance.stop()
+        await close_sessions()
+        await close_browser_pool()
 
 if __name__ == "__main__":
-    query = '写一篇10000字的文章介绍web3.0'
-    results = asyncio.run(chat_many(query))
+    parser = argparse.ArgumentParser(description="把问题同时发送到多个 AI 站点")
+    parser.add_argument('query', nargs='?', default='写一篇10000字的文章介绍web3.0')
+    parser.add_argument('--workers', type=int, default=1, help='工作进程数，大于 1 时按站点分片到多个进程')
+    parser.add_argument('--timing', choices=['stealth', 'balanced', 'fast'], default=None, help='节奏配置')
+    parser.add_argument('--cache', choices=['use', 'refresh', 'bypass'], default='use', help='回答缓存模式（ANSWER_CACHE_TTL 大于 0 时生效）')
+    parser.add_argument('--deadline', type=float, default=query_deadline, help='整个查询的截止时间（秒），0 表示不限')
+    parser.add_argument('--site-deadline', type=float, default=site_deadline, help='每个站点的截止时间（秒），0 表示不限')
+    args = parser.parse_args()
+    query = args.query
+    results = asyncio.run(main(query, args.workers, args.timing, args.cache, args.deadline, args.site_deadline))
     # print(results)
     all_reply = []
     for result in results:
@@ -0,0 +1,180 @@
+import asyncio
+import os
+import random
+import time
+from collections import OrderedDict
+from typing import Dict, List, Sequence
+from configuration import analysis_cache_ttl, analysis_cache_size
+from webpage_analyzer import simulate_human_behavior, ensure_login
+from tracing import tracer
+from browser_pool import BrowserPool, get_browser_pool
+
+# 一次 evaluate 返回所有坐标处的元素列表，与传入的坐标一一对应
+ELEMENTS_AT_JS = """
+    ([points, maxHtml, maxText]) => points.map(([x, y]) => document.elementsFromPoint(x, y).map(element => {
+        const rect = element.getBoundingClientRect();
+        const html = element.outerHTML;
+        return {
+            tagName: element.tagName,
+            id: element.id,
+            className: typeof element.className === 'string' ? element.className : element.getAttribute('class') || '',
+            outerHTML: html.length > maxHtml ? html.substring(0, maxHtml) + '...' : html,
+            boundingRect: { left: rect.left, top: rect.top, width: rect.width, height: rect.height },
+            textContent: element.textContent ? element.textContent.trim().substring(0, maxText) : ''
+        };
+    }))
+"""
+
+class PageSnapshot:
+    """一个 URL 已分析过的内容：html、截图路径和各坐标处的元素。"""
+    def __init__(self, url: str) -> None:
+        self.url = url
+        self.created = time.time()
+        self.html: str | None = None
+        self.screenshot: str | None = None
+        self.elements: dict[tuple[int, int], list] = {}
+
+class SnapshotCache:
+    """
+    按 URL 缓存的页面快照（内存 LRU，带 TTL），重复分析同一 URL 时不再打开页面。
+    ttl 为 0 时关闭缓存。
+    """
+    def __init__(self, ttl: float = analysis_cache_ttl, size: int = analysis_cache_size) -> None:
+        self.ttl = ttl
+        self.size = size
+        self._snapshots: "OrderedDict[str, PageSnapshot]" = OrderedDict()
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0
+
+    def get(self, url: str) -> PageSnapshot | None:
+        snapshot = self._snapshots.get(url)
+        if snapshot is None:
+            return None
+        if snapshot.created + self.ttl <= time.time():
+            del self._snapshots[url]
+            return None
+        self._snapshots.move_to_end(url)
+        return snapshot
+
+    def put(self, snapshot: PageSnapshot):
+        if not self.enabled:
+            return
+        self._snapshots[snapshot.url] = snapshot
+        self._snapshots.move_to_end(snapshot.url)
+        while len(self._snapshots) > self.size:
+            self._snapshots.popitem(last=False)
+
+    def invalidate(self, url: str | None = None):
+        if url is None:
+            self._snapshots.clear()
+        else:
+            self._snapshots.pop(url, None)
+
+snapshot_cache = SnapshotCache()
+
+class PageAnalysisSession:
+    """
+    页面分析会话：页面只加载一次，之后的 html、截图和坐标查询都在同一个已加载的页面上完成。
+
+        async with PageAnalysisSession(url) as session:
+            html = await session.get_html()
+            elements = await session.elements_at([(100, 200), (300, 400)])
+
+    页面在第一次需要时才从浏览器池借出；启用快照缓存（ANALYSIS_CACHE_TTL 大于 0）时，
+    缓存中已有的结果直接返回，全部命中时不会打开页面。refresh 为 True 时忽略缓存重新加载。
+    """
+    def __init__(self, url: str, pool: BrowserPool | None = None, cache: SnapshotCache | None = snapshot_cache, refresh: bool = False,
+                 simulate: bool = True, settle: tuple[float, float] = (2, 5)) -> None:
+        self.url = url
+        self.pool = pool
+        self.cache = cache if cache is not None and cache.enabled else None
+        self.simulate = simulate
+        self.settle = settle
+        cached = self.cache.get(url) if self.cache is not None and not refresh else None
+        self.snapshot = cached or PageSnapshot(url)
+        self.page = None
+        self._pool = None
+        self._lock = asyncio.Lock()
+
+    async def __aenter__(self) -> "PageAnalysisSession":
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def _ensure_page(self):
+        async with self._lock:
+            if self.page is not None:
+                return self.page
+            if self._pool is None:
+                self._pool = self.pool or get_browser_pool()
+            page = await self._pool.acquire()
+            try:
+                with tracer.span('goto', site=self.url):
+                    await page.goto(self.url, wait_until='networkidle')
+                # 在同一页面上检查是否需要登录，刚登录时重新加载，之前（含缓存中）的结果不再可信
+                if await ensure_login(self.url, page):
+                    await page.reload(wait_until='networkidle')
+                    self.snapshot = PageSnapshot(self.url)
+                if self.simulate:
+                    await simulate_human_behavior(page)
+                low, high = self.settle
+                if high > 0:
+                    # 额外等待，让页面完全加载
+                    await asyncio.sleep(random.uniform(low, high))
+            except BaseException:
+                await self._pool.release(page)
+                raise
+            self.page = page
+            return page
+
+    def _store(self):
+        if self.cache is not None:
+            self.cache.put(self.snapshot)
+
+    async def get_html(self) -> str:
+        if self.snapshot.html is None:
+            page = await self._ensure_page()
+            self.snapshot.html = await page.content()
+            self._store()
+        return self.snapshot.html
+
+    async def screenshot(self, full_page: bool = True, fmt: str = 'png') -> str:
+        """整页截图（默认 png），返回截图路径；缓存中的截图文件已被删除时重新截图。"""
+        if self.snapshot.screenshot is None or not os.path.exists(self.snapshot.screenshot):
+            page = await self._ensure_page()
+            from screenshots import get_screenshot_writer
+            self.snapshot.screenshot = await get_screenshot_writer().capture(page, full_page=full_page, force=True, wait=True, fmt=fmt)
+            self._store()
+        return self.snapshot.screenshot
+
+    async def elements_at(self, points: Sequence[tuple[int, int]], max_html: int = 200, max_text: int = 100) -> List[List[Dict]]:
+        """
+        批量获取多个坐标处的所有元素，未缓存的坐标在一次 evaluate 中完成。
+
+        Args:
+            points: (x, y) 视口坐标列表
+
+        Returns:
+            list: 与 points 对齐，每项为该位置的元素列表，元素包含 tagName、id、className、outerHTML、
+                boundingRect、textContent
+        """
+        points = [(int(x), int(y)) for x, y in points]
+        missing = list(dict.fromkeys(point for point in points if point not in self.snapshot.elements))
+        if missing:
+            page = await self._ensure_page()
+            # 登录后重新加载时快照已重置，所有坐标都要重新查询
+            missing = list(dict.fromkeys(point for point in points if point not in self.snapshot.elements))
+            with tracer.span('elements_at', site=self.url, points=len(missing)):
+                found = await page.evaluate(ELEMENTS_AT_JS, [[list(point) for point in missing], max_html, max_text])
+            self.snapshot.elements.update(zip(missing, found))
+            self._store()
+        return [self.snapshot.elements[point] for point in points]
+
+    async def close(self):
+        """把页面还给浏览器池。"""
+        if self.page is not None:
+            page, self.page = self.page, None
+            await self._pool.release(page)
@@ -0,0 +1,208 @@
+import json
+import os
+import re
+import weakref
+from dataclasses import dataclass
+from configuration import conversation_file, routing_profile
+from login_state import origin_of
+
+# Playwright 的 resource_type 取值
+RESOURCE_TYPES = {'document', 'stylesheet', 'image', 'media', 'font', 'script', 'texttrack', 'xhr', 'fetch',
+                  'eventsource', 'websocket', 'manifest', 'other', 'ping'}
+
+ANALYTICS_PATTERNS = [
+    'google-analytics.com', 'googletagmanager.com', 'doubleclick.net', 'googlesyndication.com',
+    'hm.baidu.com', 'cnzz.com', 'umeng.com', 'growingio.com', 'sensorsdata', 'mixpanel.com',
+    'segment.io', 'segment.com', 'hotjar.com', 'clarity.ms', 'facebook.net', 'amplitude.com',
+    'sentry.io', 'bytegoofy.com/goofy/slardar', 'mcs.zijieapi.com', 'arms-retcode.aliyuncs.com',
+]
+
+# 路由只交给浏览器按 URL 匹配，资源类型规则按扩展名换算成 URL 正则；不在这里的类型无法只凭 URL 判断
+RESOURCE_EXTENSIONS = {
+    'image': ('png', 'jpe?g', 'gif', 'webp', 'avif', 'svg', 'ico', 'bmp'),
+    'media': ('mp4', 'webm', 'mp3', 'm4a', 'ogg', 'wav', 'm3u8', 'm4s'),
+    'font': ('woff2?', 'ttf', 'otf', 'eot'),
+    'stylesheet': ('css',),
+    'script': ('m?js',),
+}
+
+# 被拦截的请求不会下载，节省的字节数只是按资源类型的典型大小估算，并非实测
+TYPICAL_BYTES = {'image': 30_000, 'media': 500_000, 'font': 40_000, 'stylesheet': 20_000, 'script': 60_000,
+                 'xhr': 1_000, 'fetch': 1_000, 'ping': 500, 'other': 5_000}
+
+@dataclass(frozen=True)
+class RoutingRule:
+    """一条拦截规则：匹配任一资源类型或 URL 片段的请求被拦截。"""
+    name: str
+    resource_types: frozenset = frozenset()
+    url_patterns: tuple = ()
+
+    def matches(self, resource_type: str, url: str) -> bool:
+        return resource_type in self.resource_types or any(p in url for p in self.url_patterns)
+
+    def url_regex(self) -> str | None:
+        """可能命中本规则的 URL 的正则；含无法按 URL 判断的资源类型时返回 None。"""
+        if any(t not in RESOURCE_EXTENSIONS for t in self.resource_types):
+            return None
+        parts = [re.escape(p) for p in self.url_patterns]
+        extensions = [e for t in sorted(self.resource_types) for e in RESOURCE_EXTENSIONS[t]]
+        if extensions:
+            parts.append(r'\.(?:' + '|'.join(extensions) + r')(?:[?#]|$)')
+        return '|'.join(parts)
+
+MEDIA_RULE = RoutingRule('media', frozenset({'image', 'media'}))
+FONTS_RULE = RoutingRule('fonts', frozenset({'font'}))
+ANALYTICS_RULE = RoutingRule('analytics', url_patterns=tuple(ANALYTICS_PATTERNS))
+
+PROFILES = {
+    'none': (),
+    'analytics': (ANALYTICS_RULE,),
+    'media': (MEDIA_RULE, FONTS_RULE),
+    # 拦截图片、音视频、字体和统计上报
+    'default': (MEDIA_RULE, FONTS_RULE, ANALYTICS_RULE),
+}
+
+def _split_entries(entries) -> tuple[frozenset, tuple]:
+    """把 allow / deny 列表拆成资源类型和 URL 片段。"""
+    types = frozenset(e for e in entries or [] if e in RESOURCE_TYPES)
+    patterns = tuple(e for e in entries or [] if e not in RESOURCE_TYPES)
+    return types, patterns
+
+class SiteRouting:
+    """
+    站点的拦截配置，对应 crawl_conversation.json 中的 routing 字段：
+    {"profile": "default", "allow": [...], "deny": [...]}，allow / deny 的每一项
+    是资源类型（image、font 等）或 URL 片段。allow 优先于 profile 和 deny。
+    """
+    def __init__(self, config: dict | None = None) -> None:
+        config = config or {}
+        profile = config.get('profile', routing_profile)
+        if profile not in PROFILES:
+            raise ValueError(f"未知的拦截配置: {profile}")
+        self.rules = list(PROFILES[profile])
+        deny_types, deny_patterns = _split_entries(config.get('deny'))
+        if deny_types or deny_patterns:
+            self.rules.append(RoutingRule('deny', deny_types, deny_patterns))
+        self.allow = RoutingRule('allow', *_split_entries(config.get('allow')))
+
+    def url_pattern(self) -> re.Pattern | None:
+        """
+        交给浏览器的路由 URL 正则，只有匹配的请求才经过驱动，其余请求照常走浏览器的 HTTP 缓存。
+        没有拦截规则时返回 None；deny 中含无法按 URL 判断的资源类型（如 xhr）时匹配全部请求。
+        """
+        parts = []
+        for rule in self.rules:
+            regex = rule.url_regex()
+            if regex is None:
+                return re.compile('.*')
+            if regex:
+                parts.append(regex)
+        return re.compile('|'.join(parts)) if parts else None
+
+    def match(self, resource_type: str, url: str) -> RoutingRule | None:
+        """返回拦截该请求的规则，放行时返回 None。"""
+        if resource_type == 'document' or self.allow.matches(resource_type, url):
+            return None
+        for rule in self.rules:
+            if rule.matches(resource_type, url):
+                return rule
+        return None
+
+class RequestRouter:
+    """
+    通过 page.route 拦截 AI 站点页面上的重资源请求。只在打开已配置站点的页面上安装，
+    且只路由可能被拦截的 URL（见 SiteRouting.url_pattern），其他页面（如网页分析）和其他请求
+    不经过驱动。crawl_conversation.json 中的站点（以及通过 configure 注册的站点）使用各自的
+    routing 配置，未配置 routing 的站点使用 ROUTING_PROFILE。
+    按站点和规则统计拦截的请求数和估算节省的字节数（estimated_bytes，按 TYPICAL_BYTES 估算）。
+    """
+    def __init__(self, sites_file: str = conversation_file) -> None:
+        self.sites_file = sites_file
+        self._sites: dict[str, SiteRouting] | None = None
+        self.stats: dict[str, dict[str, dict[str, int]]] = {}
+        self.last_query: dict[str, dict] = {}
+        # 页面 -> (站点, 路由正则)，同一页面切换站点时替换路由
+        self._installed: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+
+    def _load(self) -> dict[str, SiteRouting]:
+        if self._sites is None:
+            self._sites = {}
+            if self.sites_file and os.path.exists(self.sites_file):
+                try:
+                    with open(self.sites_file, 'r', encoding='utf-8') as f:
+                        self.configure_sites(json.load(f))
+                except (OSError, json.JSONDecodeError):
+                    pass
+        return self._sites
+
+    def configure(self, url: str, config: dict | None = None):
+        """注册或更新站点的拦截配置。"""
+        self._load()[origin_of(url)] = SiteRouting(config)
+
+    def configure_sites(self, sites: list[dict]):
+        """按站点配置列表（crawl_conversation.json 的结构）注册拦截配置。"""
+        for data in sites:
+            self.configure(data['url'], data.get('routing'))
+
+    async def install(self, page, url: str):
+        """在即将打开 url 的页面上安装该站点的拦截路由，已安装时不重复安装；站点没有拦截规则时不安装。"""
+        origin = origin_of(url)
+        installed = self._installed.get(page)
+        if installed is not None:
+            if installed[0] == origin:
+                return
+            await page.unroute(installed[1], self.handle)
+            del self._installed[page]
+        site = self._load().get(origin)
+        pattern = site.url_pattern() if site is not None else None
+        if pattern is None:
+            return
+        await page.route(pattern, self.handle)
+        self._installed[page] = (origin, pattern)
+
+    @staticmethod
+    def _page_url(request) -> str:
+        try:
+            url = request.frame.page.url
+        except Exception:
+            # Service Worker 发起的请求没有所属页面
+            return request.url
+        return request.url if not url or url == 'about:blank' else url
+
+    async def handle(self, route, request):
+        try:
+            origin = origin_of(self._page_url(request))
+            site = self._load().get(origin)
+            rule = site.match(request.resource_type, request.url) if site is not None else None
+        except Exception:
+            rule = None
+        if rule is None:
+            await route.continue_()
+            return
+        counter = self.stats.setdefault(origin, {}).setdefault(rule.name, {'requests': 0, 'estimated_bytes': 0})
+        counter['requests'] += 1
+        counter['estimated_bytes'] += TYPICAL_BYTES.get(request.resource_type, TYPICAL_BYTES['other'])
+        await route.abort('blockedbyclient')
+
+    def snapshot(self, url: str | None = None) -> dict:
+        """当前累计的拦截统计，url 为空时返回全部站点。"""
+        if url is None:
+            return {origin: {name: dict(c) for name, c in rules.items()} for origin, rules in self.stats.items()}
+        return {name: dict(c) for name, c in self.stats.get(origin_of(url), {}).items()}
+
+    def saved_since(self, url: str, snapshot: dict) -> dict:
+        """自 snapshot 以来站点各规则拦截的请求数和估算字节数，用于统计单次查询的节省。"""
+        saved = {}
+        for name, counter in self.snapshot(url).items():
+            before = snapshot.get(name, {'requests': 0, 'estimated_bytes': 0})
+            requests = counter['requests'] - before['requests']
+            if requests:
+                saved[name] = {'requests': requests, 'estimated_bytes': counter['estimated_bytes'] - before['estimated_bytes']}
+        return saved
+
+    def record_query(self, url: str, snapshot: dict) -> dict:
+        """记录站点最近一次查询的节省（见 last_query），并返回它。"""
+        saved = self.last_query[origin_of(url)] = self.saved_since(url, snapshot)
+        return saved
+
+router = RequestRouter()
@@ -0,0 +1,172 @@
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from typing import Dict, Iterator, List
+from configuration import result_store_file
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS queries (
+    id INTEGER PRIMARY KEY,
+    hash TEXT NOT NULL UNIQUE,
+    text TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS results (
+    id INTEGER PRIMARY KEY,
+    query_id INTEGER NOT NULL REFERENCES queries(id),
+    site TEXT NOT NULL,
+    ts REAL NOT NULL,
+    answer TEXT NOT NULL,
+    messages TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS results_query ON results(query_id, site, ts);
+CREATE INDEX IF NOT EXISTS results_site ON results(site, ts);
+CREATE INDEX IF NOT EXISTS results_ts ON results(ts);
+"""
+
+SELECT_RESULTS = """
+SELECT q.text, q.hash, r.site, r.ts, r.answer, r.messages
+FROM results r JOIN queries q ON q.id = r.query_id
+"""
+
+def query_hash(query: str) -> str:
+    return hashlib.sha1(query.encode('utf-8')).hexdigest()
+
+def answer_text(messages: List[Dict[str, str]]) -> str:
+    """chat 返回的消息中站点的回答（role 为站点 URL 的消息）。"""
+    return '\n'.join(m.get('content', '') for m in messages if m.get('role') != 'user')
+
+class ResultStore:
+    """
+    (问题, 站点, 回答) 历史的 SQLite 存储，只追加不修改。问题文本按哈希去重只存一份，
+    结果按问题、站点和时间建索引；查询和导出都以迭代器逐行返回，不把整个历史读入内存。
+    """
+    def __init__(self, path: str = result_store_file) -> None:
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        # WAL 下读不阻塞写，分片进程可以同时写入同一个库
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript(SCHEMA)
+        self._lock = threading.Lock()
+        self._query_ids: dict[str, int] = {}
+
+    def _query_id(self, query: str) -> int:
+        digest = query_hash(query)
+        query_id = self._query_ids.get(digest)
+        if query_id is None:
+            self._conn.execute('INSERT OR IGNORE INTO queries (hash, text) VALUES (?, ?)', (digest, query))
+            query_id = self._conn.execute('SELECT id FROM queries WHERE hash = ?', (digest,)).fetchone()[0]
+            self._query_ids[digest] = query_id
+        return query_id
+
+    def add(self, query: str, site: str, messages: List[Dict[str, str]], ts: float | None = None):
+        """追加一条结果。"""
+        self.add_many(query, [(site, messages)], ts)
+
+    def add_many(self, query: str, results, ts: float | None = None):
+        """
+        在一个事务中追加同一问题在多个站点上的结果。
+
+        Args:
+            query: 问题
+            results: (站点 URL, chat 返回的消息列表) 序列
+            ts: 时间戳，默认为当前时间
+        """
+        ts = time.time() if ts is None else ts
+        with self._lock, self._conn:
+            query_id = self._query_id(query)
+            self._conn.executemany(
+                'INSERT INTO results (query_id, site, ts, answer, messages) VALUES (?, ?, ?, ?, ?)',
+                [(query_id, site, ts, answer_text(messages), json.dumps(messages, ensure_ascii=False, separators=(',', ':')))
+                 for site, messages in results])
+
+    def lookup(self, query: str | None = None, site: str | None = None, since: float | None = None,
+               until: float | None = None, limit: int | None = None, newest_first: bool = True) -> Iterator[Dict]:
+        """
+        按问题、站点、时间范围查询结果，逐条产出
+        {'query', 'query_hash', 'site', 'ts', 'answer', 'messages'}。
+        """
+        clauses, params = [], []
+        if query is not None:
+            clauses.append('q.hash = ?')
+            params.append(query_hash(query))
+        if site is not None:
+            clauses.append('r.site = ?')
+            params.append(site)
+        if since is not None:
+            clauses.append('r.ts >= ?')
+            params.append(since)
+        if until is not None:
+            clauses.append('r.ts < ?')
+            params.append(until)
+        sql = SELECT_RESULTS
+        if clauses:
+            sql += ' WHERE ' + ' AND '.join(clauses)
+        sql += ' ORDER BY r.ts DESC' if newest_first else ' ORDER BY r.ts'
+        if limit is not None:
+            sql += ' LIMIT ?'
+            params.append(limit)
+        # 查询用独立游标逐行读取，不持有写锁
+        for text, digest, result_site, ts, answer, messages in self._conn.execute(sql, params):
+            yield {'query': text, 'query_hash': digest, 'site': result_site, 'ts': ts, 'answer': answer,
+                   'messages': json.loads(messages)}
+
+    def latest(self, query: str, site: str) -> Dict | None:
+        """问题在站点上最近的一条结果。"""
+        return next(self.lookup(query, site, limit=1), None)
+
+    def sites(self) -> List[str]:
+        return [row[0] for row in self._conn.execute('SELECT DISTINCT site FROM results ORDER BY site')]
+
+    def export(self, out, **filters) -> int:
+        """把结果以 JSONL 流式写入文件对象 out，filters 同 lookup，返回写出的条数。"""
+        count = 0
+        for record in self.lookup(newest_first=False, **filters):
+            out.write(json.dumps(record, ensure_ascii=False) + '\n')
+            count += 1
+        return count
+
+    def close(self):
+        self._conn.close()
+
+_store: ResultStore | None = None
+
+def get_result_store() -> ResultStore | None:
+    """返回共享的结果存储，RESULT_STORE 为空时不保存结果。"""
+    global _store
+    if _store is None and result_store_file:
+        _store = ResultStore(result_store_file)
+    return _store
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="查询和导出问题/回答历史")
+    parser.add_argument('command', choices=['lookup', 'export', 'sites'])
+    parser.add_argument('--db', default=result_store_file, help='结果库路径')
+    parser.add_argument('--query', default=None, help='问题文本')
+    parser.add_argument('--site', default=None, help='站点 URL')
+    parser.add_argument('--since', type=float, default=None, help='起始时间戳')
+    parser.add_argument('--until', type=float, default=None, help='结束时间戳')
+    parser.add_argument('--limit', type=int, default=None, help='最多返回的条数')
+    parser.add_argument('--output', default='', help='导出文件，默认输出到标准输出')
+    args = parser.parse_args()
+    store = ResultStore(args.db)
+    filters = {'query': args.query, 'site': args.site, 'since': args.since, 'until': args.until, 'limit': args.limit}
+    if args.command == 'sites':
+        print('\n'.join(store.sites()))
+    elif args.command == 'lookup':
+        for record in store.lookup(**filters):
+            print(f"[{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(record['ts']))}] {record['site']}\n{record['answer']}\n")
+    elif args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            print(f"导出 {store.export(f, **filters)} 条")
+    else:
+        store.export(sys.stdout, **filters)
+    store.close()
@@ -0,0 +1,170 @@
+import asyncio
+import functools
+import os
+from typing import Any, Awaitable, Callable, Sequence
+from configuration import scheduler_max_concurrency, scheduler_cpu_target, scheduler_memory_limit_mb
+
+@functools.lru_cache(maxsize=None)
+def load_psutil():
+    """psutil 在第一次采样时才导入，未安装时返回 None。"""
+    try:
+        import psutil
+    except ImportError:
+        return None
+    return psutil
+
+BROWSER_PROCESS_NAMES = ('chrome', 'chromium', 'headless_shell', 'msedge')
+
+class ResourceMonitor:
+    """
+    采样浏览器进程（当前进程子进程树中的 Chromium）的 CPU 与 RSS，需要 psutil。
+    """
+    def __init__(self) -> None:
+        self._processes: dict[int, Any] = {}
+
+    @property
+    def available(self) -> bool:
+        return load_psutil() is not None
+
+    def browser_processes(self) -> list:
+        psutil = load_psutil()
+        if psutil is None:
+            return []
+        alive = {}
+        for child in psutil.Process().children(recursive=True):
+            try:
+                if any(name in child.name().lower() for name in BROWSER_PROCESS_NAMES):
+                    # 复用 Process 对象，cpu_percent 才能给出两次采样之间的占用
+                    alive[child.pid] = self._processes.get(child.pid, child)
+            except psutil.Error:
+                continue
+        self._processes = alive
+        return list(alive.values())
+
+    def sample(self) -> tuple[float, float]:
+        """
+        Returns:
+            tuple: (CPU 占用百分比（按核数归一化）, RSS 总量 MB)
+        """
+        psutil = load_psutil()
+        cpu, rss = 0.0, 0
+        for process in self.browser_processes():
+            try:
+                cpu += process.cpu_percent(None)
+                rss += process.memory_info().rss
+            except psutil.Error:
+                continue
+        return cpu / (os.cpu_count() or 1), rss / (1024 * 1024)
+
+class AdaptiveLimiter:
+    """可在运行中调整上限的并发限制器。"""
+    def __init__(self, limit: int) -> None:
+        self.limit = max(1, limit)
+        self.active = 0
+        self._condition = asyncio.Condition()
+
+    async def __aenter__(self):
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.active < self.limit)
+            self.active += 1
+
+    async def __aexit__(self, exc_type, exc, tb):
+        async with self._condition:
+            self.active -= 1
+            self._condition.notify_all()
+
+    async def set_limit(self, limit: int):
+        async with self._condition:
+            self.limit = max(1, limit)
+            self._condition.notify_all()
+
+class SiteScheduler:
+    """
+    站点任务调度：每个任务独占一个页面租约，并发上限随站点数扩展，
+    并根据浏览器进程的 CPU / RSS 自适应调整；失败的任务回到重试队列末尾。
+    """
+    def __init__(self, max_concurrency: int = scheduler_max_concurrency, max_retries: int = 1,
+                 retry_delay: float = 2.0, cpu_target: float = scheduler_cpu_target,
+                 memory_limit_mb: float = scheduler_memory_limit_mb, interval: float = 2.0) -> None:
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.cpu_target = cpu_target
+        self.memory_limit_mb = memory_limit_mb
+        self.interval = interval
+        self.monitor = ResourceMonitor()
+        self.limiter: AdaptiveLimiter | None = None
+
+    def _memory_limit(self) -> float:
+        if self.memory_limit_mb:
+            return self.memory_limit_mb
+        psutil = load_psutil()
+        if psutil is not None:
+            return psutil.virtual_memory().total * 0.8 / (1024 * 1024)
+        return float('inf')
+
+    async def _adjust(self, upper: int):
+        memory_limit = self._memory_limit()
+        self.monitor.sample()
+        while True:
+            await asyncio.sleep(self.interval)
+            cpu, rss = self.monitor.sample()
+            limit = self.limiter.limit
+            if cpu > self.cpu_target or rss > memory_limit:
+                limit -= 1
+            elif cpu < self.cpu_target * 0.6 and rss < memory_limit * 0.8:
+                limit += 1
+            await self.limiter.set_limit(min(upper, limit))
+
+    async def run(self, items: Sequence, worker: Callable[[Any], Awaitable]) -> list:
+        """
+        对每个 item 执行 worker，按输入顺序返回结果；重试耗尽的任务对应位置为异常对象。
+        """
+        if not items:
+            return []
+        upper = min(self.max_concurrency, len(items))
+        self.limiter = AdaptiveLimiter(upper)
+        queue: asyncio.Queue = asyncio.Queue()
+        for index, item in enumerate(items):
+            queue.put_nowait((index, item, 0))
+        results: list = [None] * len(items)
+        remaining = [len(items)]
+        finished = asyncio.Event()
+
+        def complete(index, value):
+            results[index] = value
+            remaining[0] -= 1
+            if remaining[0] == 0:
+                finished.set()
+
+        async def requeue(entry, delay):
+            await asyncio.sleep(delay)
+            queue.put_nowait(entry)
+
+        retry_tasks = set()
+
+        async def consume():
+            while True:
+                index, item, attempt = await queue.get()
+                try:
+                    async with self.limiter:
+                        value = await worker(item)
+                except Exception as e:
+                    if attempt < self.max_retries:
+                        task = asyncio.ensure_future(requeue((index, item, attempt + 1), self.retry_delay * 2 ** attempt))
+                        retry_tasks.add(task)
+                        task.add_done_callback(retry_tasks.discard)
+                    else:
+                        complete(index, e)
+                else:
+                    complete(index, value)
+
+        consumers = [asyncio.ensure_future(consume()) for _ in range(upper)]
+        controller = asyncio.ensure_future(self._adjust(upper)) if self.monitor.available else None
+        try:
+            await finished.wait()
+        finally:
+            for task in consumers + list(retry_tasks) + ([controller] if controller else []):
+                task.cancel()
+            await asyncio.gather(*consumers, *retry_tasks, *([controller] if controller else []), return_exceptions=True)
+        return results
@@ -0,0 +1,147 @@
+import asyncio
+import datetime
+import functools
+import io
+import itertools
+import os
+import threading
+from dataclasses import dataclass
+from configuration import (screenshot_mode, screenshot_sample_every, screenshot_format, screenshot_quality,
+                           screenshot_dir, screenshot_max_files, screenshot_max_mb)
+from tracing import tracer
+
+# 按策略截取的截图文件名前缀，清理只针对这些文件
+POLICY_PREFIX = 'capture_'
+
+@functools.lru_cache(maxsize=None)
+def _load_image():
+    """Pillow 只在 webp 转码时需要，第一次用到时才导入，未安装时返回 None。"""
+    try:
+        from PIL import Image
+    except ImportError:
+        return None
+    return Image
+
+@dataclass(frozen=True)
+class ScreenshotPolicy:
+    """
+    截图策略。
+
+    mode: off 不截图，always 每次截图，error 仅出错时截图，sample 每 sample_every 次截一张
+    format: png / jpeg / webp（webp 需要 Pillow，缺失时退回 jpeg）
+    quality: jpeg / webp 的压缩质量
+    max_files / max_mb: 按策略截取的截图的保留上限，超出后删除最旧的；强制截图（force）交给调用方，不参与清理
+    """
+    mode: str = screenshot_mode
+    sample_every: int = screenshot_sample_every
+    format: str = screenshot_format
+    quality: int = screenshot_quality
+    directory: str = screenshot_dir
+    max_files: int = screenshot_max_files
+    max_mb: int = screenshot_max_mb
+
+class ScreenshotWriter:
+    """
+    按策略截图，编码与写盘放到线程池中，不阻塞请求路径。
+    """
+    def __init__(self, policy: ScreenshotPolicy = ScreenshotPolicy()) -> None:
+        self.policy = policy
+        self._calls = 0
+        self._sequence = itertools.count()
+        self._pending: set = set()
+        self._prune_lock = threading.Lock()
+
+    def should_capture(self, error: bool = False) -> bool:
+        self._calls += 1
+        mode = self.policy.mode
+        if mode == 'always':
+            return True
+        if mode == 'error':
+            return error
+        if mode == 'sample':
+            return error or self._calls % max(1, self.policy.sample_every) == 0
+        return False
+
+    def _new_path(self, extension: str, prefix: str) -> str:
+        # 微秒时间戳加进程内序号，同一秒内的多次截图不会重名
+        timestamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S_%f')
+        return os.path.join(self.policy.directory, f'{prefix}{timestamp}_{os.getpid()}_{next(self._sequence)}.{extension}')
+
+    async def capture(self, page, full_page: bool = False, error: bool = False, force: bool = False, wait: bool = False,
+                      fmt: str | None = None) -> str:
+        """
+        截图并在后台写盘，返回截图路径；按策略跳过时返回空字符串。
+
+        Args:
+            page: 页面
+            full_page: 是否截取整页
+            error: 本次调用是否出错（用于 error / sample 策略）
+            force: 忽略策略强制截图，截图文件以 screenshot_ 开头且不会被自动清理
+            wait: 是否等待写盘完成再返回
+            fmt: 覆盖策略中的图片格式
+        """
+        if not force and not self.should_capture(error):
+            return ''
+        fmt = fmt or self.policy.format
+        if fmt == 'webp' and _load_image() is None:
+            fmt = 'jpeg'
+        # 浏览器只能输出 png / jpeg，webp 先取 png 再在线程中转码
+        options = {'full_page': full_page, 'type': 'jpeg' if fmt == 'jpeg' else 'png'}
+        if fmt == 'jpeg':
+            options['quality'] = self.policy.quality
+        with tracer.span('screenshot', site=tracer.current_site() or page.url, full_page=full_page, error=error):
+            data = await page.screenshot(**options)
+        path = self._new_path('jpg' if fmt == 'jpeg' else fmt, 'screenshot_' if force else POLICY_PREFIX)
+        future = asyncio.get_running_loop().run_in_executor(None, self._write, path, data, fmt, not force)
+        self._pending.add(future)
+        future.add_done_callback(self._pending.discard)
+        if wait:
+            await future
+        return path
+
+    def _write(self, path: str, data: bytes, fmt: str, prune: bool):
+        os.makedirs(self.policy.directory, exist_ok=True)
+        if fmt == 'webp':
+            _load_image().open(io.BytesIO(data)).save(path, 'WEBP', quality=self.policy.quality)
+        else:
+            with open(path, 'wb') as f:
+                f.write(data)
+        if prune:
+            self._prune()
+
+    def _prune(self):
+        """只清理按策略截取的截图，已返回给调用方的强制截图不受影响。"""
+        with self._prune_lock:
+            try:
+                entries = [entry for entry in os.scandir(self.policy.directory)
+                           if entry.is_file() and entry.name.startswith(POLICY_PREFIX)]
+            except FileNotFoundError:
+                return
+            entries.sort(key=lambda entry: entry.stat().st_mtime, reverse=True)
+            total = 0
+            for index, entry in enumerate(entries):
+                total += entry.stat().st_size
+                if index >= self.policy.max_files or total > self.policy.max_mb * 1024 * 1024:
+                    try:
+                        os.remove(entry.path)
+                    except OSError:
+                        pass
+
+    async def flush(self):
+        """等待所有后台写盘完成。"""
+        if self._pending:
+            await asyncio.gather(*list(self._pending), return_exceptions=True)
+
+_writers: dict[ScreenshotPolicy, ScreenshotWriter] = {}
+
+def get_screenshot_writer(policy: "ScreenshotPolicy | str | None" = None) -> ScreenshotWriter:
+    """
+    返回策略对应的共享截图器（抽样计数在多次调用间累积）；传入字符串时视为 mode。
+    """
+    if policy is None:
+        policy = ScreenshotPolicy()
+    elif isinstance(policy, str):
+        policy = ScreenshotPolicy(mode=policy)
+    if policy not in _writers:
+        _writers[policy] = ScreenshotWriter(policy)
+    return _writers[policy]
@@ -0,0 +1,119 @@
+import hashlib
+import json
+import os
+import weakref
+
+SCRIPT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'scripts')
+MISSING = '__pq_missing__'
+
+# 每次调用只传函数名和结构化参数，不再拼接脚本文本
+CALL_JS = """([name, args]) => window.__pq ? window.__pq[name](...args) : '__pq_missing__'"""
+
+REGISTER_EXTRACTOR_JS = """(() => {{
+  window.__pq.extractors[{key}] = async () => {{
+    return (
+{code}
+    );
+  }};
+}})()"""
+
+# 无法作为单个表达式编译的旧脚本退回到每次调用时 eval
+REGISTER_EVAL_EXTRACTOR_JS = """([key, code]) => {
+  window.__pq.extractors[key] = async () => (0, eval)(code);
+}"""
+
+class ScriptRegistry:
+    """
+    页面脚本注册表：scripts/ 下的模板只读取一次，拼成一个包，按页面通过
+    add_init_script 安装并立即执行一次，挂到 window.__pq 上。之后每次调用只需
+    window.__pq.<name>(...args)，参数以结构化数据传递，不再重复解析、编译脚本。
+    """
+    def __init__(self, directory: str = SCRIPT_DIR) -> None:
+        self.directory = directory
+        self._bundle: str | None = None
+        self._installed: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+
+    @property
+    def bundle(self) -> str:
+        if self._bundle is None:
+            parts = []
+            for name in sorted(os.listdir(self.directory)):
+                if name.endswith('.js'):
+                    with open(os.path.join(self.directory, name), 'r', encoding='utf-8') as f:
+                        parts.append(f.read())
+            self._bundle = (
+                "(() => {\n"
+                "if (window.__pq) return;\n"
+                f"const pq = {{ MISSING: '{MISSING}' }};\n"
+                # 不可枚举，不出现在 Object.keys(window) 中
+                "Object.defineProperty(window, '__pq', { value: pq, configurable: true });\n"
+                + "\n".join(parts)
+                + "\n})();"
+            )
+        return self._bundle
+
+    async def install(self, page):
+        """在页面上安装脚本包：之后的导航由 init script 自动安装，当前文档立即执行一次。"""
+        if page not in self._installed:
+            await page.add_init_script(self.bundle)
+            self._installed[page] = True
+        await page.evaluate(self.bundle)
+
+    async def call(self, page, name: str, *args):
+        """调用 window.__pq.<name>(*args)，当前文档尚未安装脚本包时先安装。"""
+        result = await page.evaluate(CALL_JS, [name, list(args)])
+        if result == MISSING:
+            await self.install(page)
+            result = await page.evaluate(CALL_JS, [name, list(args)])
+        return result
+
+    @staticmethod
+    def extractor_key(code: str) -> str:
+        return hashlib.sha1(code.encode('utf-8')).hexdigest()[:16]
+
+    async def register_extractor(self, page, code: str) -> str:
+        """把站点的提取脚本编译为 window.__pq.extractors[key]，返回 key。调用前脚本包须已安装。"""
+        key = self.extractor_key(code)
+        source = REGISTER_EXTRACTOR_JS.format(key=json.dumps(key), code=code.strip().rstrip(';'))
+        try:
+            await page.evaluate(source)
+        except Exception:
+            await page.evaluate(REGISTER_EVAL_EXTRACTOR_JS, [key, code])
+        return key
+
+    async def ensure_extractor(self, page, code: str) -> str:
+        """确保当前文档已注册提取脚本，返回 key。"""
+        key = self.extractor_key(code)
+        if not await self.call(page, 'hasExtractor', key):
+            await self.register_extractor(page, code)
+        return key
+
+    async def extract(self, page, code: str, since: int = 0, count_only: bool = False) -> dict:
+        """
+        执行站点的提取脚本。
+
+        Args:
+            page: 页面
+            code: 站点提取脚本
+            since: 游标，只返回该下标之后的消息
+            count_only: 只返回消息总数（游标），不传输消息内容
+
+        Returns:
+            dict: {'messages': 游标之后的消息, 'cursor': 新游标, 'total': 消息总数}
+        """
+        key = self.extractor_key(code)
+        opts = {'since': since, 'countOnly': count_only}
+        result = await self.call(page, 'extract', key, opts)
+        if result == MISSING:
+            await self.register_extractor(page, code)
+            result = await self.call(page, 'extract', key, opts)
+        return result
+
+    async def message_count(self, page, code: str) -> int:
+        """当前对话的消息数，发送问题前记录下来作为游标。"""
+        try:
+            return (await self.extract(page, code, count_only=True))['total']
+        except Exception:
+            return 0
+
+registry = ScriptRegistry()
@@ -0,0 +1,35 @@
+/*
+ * 站点对话提取脚本的调用入口，脚本由 script_registry 按站点注册到 pq.extractors。
+ *
+ * 提取脚本可以是：
+ *   1. 旧式表达式，返回消息数组或其 JSON 字符串；
+ *   2. 函数 (opts) => ...，opts 为 { since, countOnly }，返回消息数组，或
+ *      { messages, total }（messages 已是 since 之后的消息，total 为消息总数）。
+ * 返回给 Python 的只有游标之后的消息，不再跨 CDP 传输整个对话。
+ */
+pq.extractors = pq.extractors || {};
+
+pq.hasExtractor = (key) => !!pq.extractors[key];
+
+pq.runExtractor = async (key, opts = {}) => {
+  const since = opts.since || 0;
+  let result = await pq.extractors[key]();
+  if (typeof result === 'function') result = await result(opts);
+  if (typeof result === 'string') result = JSON.parse(result);
+  if (Array.isArray(result)) {
+    // 站点重新渲染导致消息数少于游标时，返回全部消息
+    const start = result.length >= since ? since : 0;
+    return { messages: result.slice(start), total: result.length };
+  }
+  if (result && Array.isArray(result.messages)) {
+    return { messages: result.messages, total: result.total ?? since + result.messages.length };
+  }
+  throw new Error('提取脚本返回了无法识别的结果');
+};
+
+pq.extract = async (key, opts = {}) => {
+  if (!pq.extractors[key]) return pq.MISSING;
+  const { messages, total } = await pq.runExtractor(key, opts);
+  if (opts.countOnly) return { messages: [], cursor: total, total };
+  return { messages, cursor: total, total };
+};
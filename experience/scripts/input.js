@@ -0,0 +1,70 @@
+/* 输入框查找、填写与发送，见 input_injection.InputInjector；pq.waitFor 见 waiter.js */
+pq.input = async ({ action, selector, message, strategy, sendSelector, chunkSize }) => {
+  const sleep = ms => new Promise(r => setTimeout(r, ms));
+  function fire(el, type) {
+    const evt = new Event(type, { bubbles: true, composed: true });
+    if (type === 'input')  evt._reactName = 'onInput';
+    if (type === 'change') evt._reactName = 'onChange';
+    el.dispatchEvent(evt);
+  }
+  function nativeSetValue(el, val) {
+    const map = { INPUT: 'HTMLInputElement', TEXTAREA: 'HTMLTextAreaElement', SELECT: 'HTMLSelectElement' };
+    const protoName = map[el.tagName];
+    if (!protoName) throw new Error('Unsupported element: ' + el.tagName);
+    const setter = Object.getOwnPropertyDescriptor(window[protoName].prototype, 'value').set;
+    setter.call(el, val);
+    fire(el, 'input');
+    fire(el, 'change');
+  }
+  const isValueInput = el => 'value' in el && el.tagName !== 'DIV';
+  function selectAll(el) {
+    el.focus();
+    getSelection().selectAllChildren(el);
+  }
+  function clear(el) {
+    if (isValueInput(el)) return nativeSetValue(el, '');
+    selectAll(el);
+    document.execCommand('delete', false);
+    if (el.innerText.trim()) getSelection().deleteFromDocument();
+  }
+  const read = el => isValueInput(el) ? el.value : el.innerText;
+
+  const el = await pq.waitFor(selector);
+  if (action === 'kind') return isValueInput(el) ? 'value' : (el.isContentEditable ? 'editable' : 'unknown');
+  if (action === 'focus') { clear(el); el.focus(); return true; }
+  if (action === 'read') return read(el);
+  if (action === 'send') {
+    await sleep(150);
+    if (sendSelector) {
+      (await pq.waitFor(sendSelector)).click();
+    } else {
+      ['keydown', 'keyup'].forEach(type =>
+        el.dispatchEvent(new KeyboardEvent(type, { key: 'Enter', code: 'Enter', keyCode: 13, bubbles: true, composed: true }))
+      );
+    }
+    return true;
+  }
+  // action === 'fill'
+  clear(el);
+  if (strategy === 'native_value') {
+    nativeSetValue(el, message);
+  } else if (strategy === 'insert_text') {
+    selectAll(el);
+    document.execCommand('insertText', false, message);
+  } else if (strategy === 'paste') {
+    selectAll(el);
+    const data = new DataTransfer();
+    data.setData('text/plain', message);
+    el.dispatchEvent(new ClipboardEvent('paste', { clipboardData: data, bubbles: true, cancelable: true, composed: true }));
+  } else if (strategy === 'chunked') {
+    selectAll(el);
+    for (let i = 0; i < message.length; i += chunkSize) {
+      document.execCommand('insertText', false, message.slice(i, i + chunkSize));
+      await sleep(0);
+    }
+  } else {
+    throw new Error('Unknown strategy: ' + strategy);
+  }
+  await sleep(0);
+  return read(el);
+};
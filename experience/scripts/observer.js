@@ -0,0 +1,19 @@
+/* 回复完成检测用的 DOM 变化监听，见 completion.DomQuiescenceDetector */
+pq.observeMutations = (binding, rootSelector, throttleMs) => {
+  if (pq.observer) pq.observer.disconnect();
+  const root = (rootSelector && document.querySelector(rootSelector)) || document.body;
+  let pending = false;
+  pq.observer = new MutationObserver(() => {
+    if (pending) return;
+    pending = true;
+    setTimeout(() => { pending = false; window[binding]('mutation'); }, throttleMs);
+  });
+  pq.observer.observe(root, { childList: true, subtree: true, characterData: true });
+};
+
+pq.disconnectMutations = () => {
+  if (pq.observer) {
+    pq.observer.disconnect();
+    pq.observer = null;
+  }
+};
@@ -0,0 +1,36 @@
+/* 流式增量回答监听，见 streaming.PartialTextWatcher */
+pq.watchPartial = async (binding, key, throttleMs) => {
+  if (pq.partialObserver) pq.partialObserver.disconnect();
+  // 只关注启动监听之后新出现的消息，避免把上一轮的回答当成增量
+  const baseline = await pq.runExtractor(key, { countOnly: true }).then(r => r.total, () => 0);
+  let last = null;
+  let pending = false;
+  const emit = async () => {
+    pending = false;
+    let text;
+    try {
+      const fresh = (await pq.runExtractor(key, { since: baseline })).messages;
+      const answers = fresh.filter(m => m.role !== 'user');
+      text = answers.length ? answers[answers.length - 1].content : '';
+    } catch (e) {
+      return;
+    }
+    if (text && text !== last) {
+      last = text;
+      window[binding]('partial', text);
+    }
+  };
+  pq.partialObserver = new MutationObserver(() => {
+    if (pending) return;
+    pending = true;
+    setTimeout(emit, throttleMs);
+  });
+  pq.partialObserver.observe(document.body, { childList: true, subtree: true, characterData: true });
+};
+
+pq.stopPartial = () => {
+  if (pq.partialObserver) {
+    pq.partialObserver.disconnect();
+    pq.partialObserver = null;
+  }
+};
@@ -0,0 +1,102 @@
+/* 元素等待：MutationObserver 驱动，增量跟踪 shadow root，替代逐帧全文档扫描 */
+pq.shadowRoots = new Set();
+pq.waiters = new Set();
+// 选择器可能因属性变化才匹配（如 contenteditable 被置为 true）
+pq.waitOptions = { childList: true, subtree: true, attributes: true };
+
+pq.trackShadowRoot = root => {
+  if (pq.shadowRoots.has(root)) return;
+  pq.shadowRoots.add(root);
+  if (pq.waitObserver) {
+    pq.waitObserver.observe(root, pq.waitOptions);
+    pq.checkWaiters();
+  }
+};
+
+// 被替换的原生方法在 Function.prototype.toString 中仍显示原生源码；toString 本身换成 Proxy，
+// 对页面而言仍是原生函数，替换的方法也不会多出自有属性
+const nativeSources = new WeakMap();
+const apply = Reflect.apply;
+const fnToString = Function.prototype.toString;
+const toStringProxy = new Proxy(fnToString, {
+  apply(target, self, args) {
+    return apply(target, nativeSources.has(self) ? nativeSources.get(self) : self, args);
+  }
+});
+nativeSources.set(toStringProxy, fnToString);
+Object.defineProperty(Function.prototype, 'toString',
+  { ...Object.getOwnPropertyDescriptor(Function.prototype, 'toString'), value: toStringProxy });
+
+// 用 replacement 替换 target[name]，保留原有的属性描述符
+pq.replaceNative = (target, name, replacement) => {
+  const descriptor = Object.getOwnPropertyDescriptor(target, name);
+  nativeSources.set(replacement, descriptor.value);
+  Object.defineProperty(target, name, { ...descriptor, value: replacement });
+};
+
+// 脚本包作为 init script 在页面脚本之前执行，之后创建的 shadow root（包括 closed）都经过这里。
+// 方法简写没有 prototype、不能 new，name 和 length 与原生 attachShadow 相同
+const attachShadow = Element.prototype.attachShadow;
+pq.replaceNative(Element.prototype, 'attachShadow', {
+  attachShadow(init) {
+    const root = apply(attachShadow, this, arguments);
+    pq.trackShadowRoot(root);
+    return root;
+  }
+}.attachShadow);
+
+// 脚本包晚于页面脚本安装时，已有的 open shadow root 只在这里扫描一次
+(function scan(root) {
+  for (const el of root.querySelectorAll('*')) {
+    if (el.shadowRoot) {
+      pq.trackShadowRoot(el.shadowRoot);
+      scan(el.shadowRoot);
+    }
+  }
+})(document);
+
+pq.query = sel => {
+  const el = document.querySelector(sel);
+  if (el) return el;
+  for (const root of pq.shadowRoots) {
+    if (!root.host.isConnected) {
+      pq.shadowRoots.delete(root);
+      continue;
+    }
+    const found = root.querySelector(sel);
+    if (found) return found;
+  }
+  return null;
+};
+
+pq.checkWaiters = () => {
+  for (const waiter of pq.waiters) {
+    const el = pq.query(waiter.sel);
+    if (el) waiter.done(el);
+  }
+};
+
+pq.waitFor = (sel, timeout = 10_000) => {
+  const found = pq.query(sel);
+  if (found) return Promise.resolve(found);
+  return new Promise((resolve, reject) => {
+    const waiter = { sel };
+    const finish = () => {
+      clearTimeout(waiter.timer);
+      pq.waiters.delete(waiter);
+      if (!pq.waiters.size && pq.waitObserver) {
+        pq.waitObserver.disconnect();
+        pq.waitObserver = null;
+      }
+    };
+    waiter.done = el => { finish(); resolve(el); };
+    waiter.timer = setTimeout(() => { finish(); reject(new Error('timeout: ' + sel)); }, timeout);
+    pq.waiters.add(waiter);
+    if (!pq.waitObserver) {
+      // 只在有等待者时监听，回调按微任务批量触发，每批只对文档和已知 shadow root 各查询一次
+      pq.waitObserver = new MutationObserver(pq.checkWaiters);
+      pq.waitObserver.observe(document, pq.waitOptions);
+      for (const root of pq.shadowRoots) pq.waitObserver.observe(root, pq.waitOptions);
+    }
+  });
+};
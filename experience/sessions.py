@@ -0,0 +1,162 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from urllib.parse import urlsplit
+from browser_pool import BrowserPool, get_browser_pool
+from tracing import tracer
+from request_routing import router
+from storage_state import storage_states
+from login_state import login_cache, detect_login_required
+
+def same_origin(a: str, b: str) -> bool:
+    """判断两个 URL 是否同源（忽略路径），用于决定是否需要重新导航。"""
+    a, b = urlsplit(a), urlsplit(b)
+    return a.scheme == b.scheme and a.netloc == b.netloc
+
+class SiteSession:
+    """某个站点常驻的标签页。"""
+    def __init__(self, url: str, page) -> None:
+        self.url = url
+        self.page = page
+        self.queries = 0
+        self.last_used = time.monotonic()
+        self.lock = asyncio.Lock()
+
+class SessionManager:
+    """
+    会话管理：每个站点 URL 保留一个已加载的标签页，多次查询之间复用，
+    后续问题发送到已有对话中；需要时可按站点开启新对话。
+    """
+    def __init__(self, pool: BrowserPool | None = None, health_timeout: float = 3.0) -> None:
+        self.pool = pool
+        self.health_timeout = health_timeout
+        self._sessions: dict[str, SiteSession] = {}
+        self._lock = asyncio.Lock()
+
+    def _pool(self) -> BrowserPool:
+        return self.pool or get_browser_pool()
+
+    async def _healthy(self, session: SiteSession) -> bool:
+        page = session.page
+        if page.is_closed():
+            return False
+        try:
+            ready_state = await asyncio.wait_for(page.evaluate("() => document.readyState"), self.health_timeout)
+        except Exception:
+            return False
+        return ready_state != 'loading' and same_origin(page.url, session.url)
+
+    async def _get(self, url: str) -> SiteSession:
+        async with self._lock:
+            session = self._sessions.get(url)
+            if session is None:
+                session = SiteSession(url, await self._pool().acquire())
+                self._sessions[url] = session
+            return session
+
+    async def _ensure_page(self, session: SiteSession):
+        pool = self._pool()
+        if pool.is_retiring(session.page):
+            # 所在浏览器达到使用次数或内存上限，换到其他浏览器上的新页面，旧浏览器空闲后由浏览器池关闭
+            await pool.release(session.page, count_use=False)
+            session.page = await pool.acquire()
+        elif await self._healthy(session):
+            return
+        elif session.page.is_closed() or session.queries > 0:
+            # 标签页已关闭、崩溃或被跳转到其他站点，换一个新页面重新加载
+            await pool.release(session.page, count_use=False)
+            session.page = await pool.acquire()
+        # 站点首次加载的图片、字体和统计请求最多，拦截路由须在导航前装好
+        await router.install(session.page, session.url)
+        with tracer.span('goto', site=session.url):
+            await session.page.goto(session.url, wait_until='domcontentloaded')
+
+    @asynccontextmanager
+    async def session(self, url: str, new_chat: bool = False, new_chat_selector: str = ''):
+        """
+        独占使用站点的常驻标签页：async with manager.session(url) as page: ...
+
+        Args:
+            url: 站点 URL
+            new_chat: 是否先开启新对话
+            new_chat_selector: 站点“新对话”按钮的选择器，为空时重新导航到站点首页
+        """
+        session = await self._get(url)
+        async with session.lock:
+            await self._ensure_page(session)
+            if new_chat and session.queries > 0:
+                await self._new_chat(session, new_chat_selector)
+            session.last_used = time.monotonic()
+            try:
+                yield session.page
+            finally:
+                session.queries += 1
+                # 常驻标签页不归还租约，每次查询都计入浏览器的使用次数，达到回收阈值后下次查询前换页
+                self._pool().record_use(session.page)
+                # 站点可能在对话过程中刷新 cookies，按间隔读回并延迟写盘；只保存确认已登录的状态
+                if not session.page.is_closed():
+                    page = session.page
+                    await storage_states.refresh(page.context, url, confirm=lambda: self._logged_in(page, url))
+
+    @staticmethod
+    async def _logged_in(page, url: str) -> bool:
+        """页面上没有登录入口时视为已登录，检测结果同时写入登录状态缓存。"""
+        try:
+            required = await detect_login_required(page)
+        except Exception:
+            return False
+        login_cache.set(url, required)
+        return not required
+
+    async def _new_chat(self, session: SiteSession, new_chat_selector: str = ''):
+        with tracer.span('new_chat', site=session.url):
+            await self._open_new_chat(session, new_chat_selector)
+
+    async def _open_new_chat(self, session: SiteSession, new_chat_selector: str = ''):
+        if new_chat_selector:
+            try:
+                await session.page.click(new_chat_selector, timeout=self.health_timeout * 1000)
+                return
+            except Exception:
+                pass
+        await session.page.goto(session.url, wait_until='domcontentloaded')
+
+    async def new_chat(self, url: str, new_chat_selector: str = ''):
+        """为站点开启新对话。"""
+        session = await self._get(url)
+        async with session.lock:
+            await self._ensure_page(session)
+            await self._new_chat(session, new_chat_selector)
+
+    async def close_site(self, url: str):
+        """关闭站点的常驻标签页。"""
+        async with self._lock:
+            session = self._sessions.pop(url, None)
+        if session is not None:
+            async with session.lock:
+                await self._pool().release(session.page, count_use=False)
+
+    async def close(self):
+        """关闭所有常驻标签页。"""
+        for url in list(self._sessions):
+            await self.close_site(url)
+
+_manager: SessionManager | None = None
+_manager_loop = None
+
+def get_session_manager() -> SessionManager:
+    """返回当前事件循环共享的会话管理器。"""
+    global _manager, _manager_loop
+    loop = asyncio.get_running_loop()
+    if _manager is None or _manager_loop is not loop:
+        _manager = SessionManager()
+        _manager_loop = loop
+    return _manager
+
+async def close_sessions():
+    """关闭共享会话管理器的所有标签页。"""
+    global _manager, _manager_loop
+    if _manager is not None and _manager_loop is asyncio.get_running_loop():
+        await _manager.close()
+    _manager = None
+    _manager_loop = None
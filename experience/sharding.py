@@ -0,0 +1,100 @@
+import asyncio
+import math
+import os
+from typing import Dict, List
+from configuration import query_deadline, site_deadline
+
+def _run_shard(queries: List[str], sites: List[Dict], timing: str | None, cache: str = 'use',
+               deadline: float = query_deadline, site_deadline: float = site_deadline) -> List[List[List[Dict]]]:
+    """工作进程入口：用本进程自己的浏览器依次处理分到的问题和站点。"""
+    # 工作进程中才导入，避免协调进程加载 Playwright
+    from main import chat_many
+    from sessions import close_sessions
+    from browser_pool import close_browser_pool
+    from tracing import tracer
+    async def run():
+        try:
+            return [await chat_many(query, timing=timing, sites=sites, cache=cache, deadline=deadline,
+                                      site_deadline=site_deadline) for query in queries]
+        finally:
+            await close_sessions()
+            await close_browser_pool()
+    try:
+        return asyncio.run(run())
+    finally:
+        # 进程池的工作进程退出时不执行 atexit，在这里写出缓冲的 span
+        tracer.flush()
+
+def plan_shards(num_sites: int, num_queries: int, workers: int) -> List[tuple[List[int], List[int]]]:
+    """
+    把 (站点, 问题) 网格切分给 workers 个进程：先按站点轮转分组，站点不够分时再按问题分组。
+
+    Returns:
+        list: 每个分片的 (站点下标列表, 问题下标列表)
+    """
+    site_groups = max(1, min(workers, num_sites))
+    query_groups = max(1, min(workers // site_groups, num_queries))
+    shards = []
+    for s in range(site_groups):
+        site_indexes = list(range(s, num_sites, site_groups))
+        chunk = math.ceil(num_queries / query_groups)
+        for q in range(query_groups):
+            query_indexes = list(range(q * chunk, min(num_queries, (q + 1) * chunk)))
+            if site_indexes and query_indexes:
+                shards.append((site_indexes, query_indexes))
+    return shards
+
+class ShardedExecutor:
+    """
+    多进程分片执行器：把站点和问题分给 K 个工作进程，每个进程有独立的
+    Playwright 驱动和浏览器，协调进程把结果合并回 chat_many 的 List[List[Dict]] 结构。
+    """
+    def __init__(self, workers: int = os.cpu_count() or 1, timing: str | None = None, cache: str = 'use',
+                 deadline: float = query_deadline, site_deadline: float = site_deadline) -> None:
+        self.workers = max(1, workers)
+        self.timing = timing
+        self.cache = cache
+        self.deadline = deadline
+        self.site_deadline = site_deadline
+        self._executor = None
+
+    def _get_executor(self):
+        if self._executor is None:
+            # 进程池模块只在真正分片执行时导入
+            import multiprocessing
+            from concurrent.futures import ProcessPoolExecutor
+            # spawn 避免把父进程的事件循环和浏览器连接 fork 到子进程
+            self._executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn'))
+        return self._executor
+
+    async def chat_many(self, query: str, sites: List[Dict] | None = None) -> List[List[Dict]]:
+        return (await self.chat_batch([query], sites))[0]
+
+    async def chat_batch(self, queries: List[str], sites: List[Dict] | None = None) -> List[List[List[Dict]]]:
+        """
+        Returns:
+            list: 与 queries 对齐，每项为按站点顺序排列的 chat_many 结果
+        """
+        if sites is None:
+            from main import load_sites
+            sites = load_sites()
+        loop = asyncio.get_running_loop()
+        executor = self._get_executor()
+        shards = plan_shards(len(sites), len(queries), self.workers)
+        futures = [
+            loop.run_in_executor(executor, _run_shard, [queries[q] for q in query_indexes],
+                                 [sites[s] for s in site_indexes], self.timing, self.cache, self.deadline, self.site_deadline)
+            for site_indexes, query_indexes in shards
+        ]
+        shard_results = await asyncio.gather(*futures)
+        merged: List[List[List[Dict]]] = [[[] for _ in sites] for _ in queries]
+        for (site_indexes, query_indexes), result in zip(shards, shard_results):
+            for q, per_site in zip(query_indexes, result):
+                for s, messages in zip(site_indexes, per_site):
+                    merged[q][s] = messages
+        return merged
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
@@ -0,0 +1,170 @@
+import asyncio
+import atexit
+import json
+import os
+import tempfile
+import threading
+import time
+from urllib.parse import urlsplit
+from configuration import cookie_file, storage_state_dir, storage_state_debounce, storage_state_refresh
+
+def _host(url: str) -> str:
+    return (urlsplit(url).hostname or url).lower()
+
+def domain_matches(host: str, domain: str) -> bool:
+    """cookie 的 domain 是否作用于 host（或 host 是 domain 的上级域名）。"""
+    domain = domain.lstrip('.').lower()
+    return bool(domain) and (host == domain or host.endswith('.' + domain) or domain.endswith('.' + host))
+
+def _cookie_key(cookie: dict) -> tuple:
+    return cookie.get('name'), cookie.get('domain'), cookie.get('path')
+
+class StorageStateManager:
+    """
+    按站点保存的存储状态（cookies 和 localStorage），每个站点一个 JSON 文件，
+    启动时读入内存一次，之后新建上下文和登录检测都直接使用内存中的状态。
+    状态变化时延迟 debounce 秒合并写回，写入先写临时文件再原子替换，不会留下写了一半的文件。
+
+    旧版的单个 cookies.json 仍会作为 legacy 状态读入，但不再写回。
+    """
+    def __init__(self, directory: str = storage_state_dir, legacy_file: str = cookie_file,
+                 debounce: float = storage_state_debounce, refresh_interval: float = storage_state_refresh) -> None:
+        self.directory = directory
+        self.legacy_file = legacy_file
+        self.debounce = debounce
+        self.refresh_interval = refresh_interval
+        self._states: dict[str, dict] | None = None
+        self._dirty: set[str] = set()
+        self._timer = None
+        self._timer_loop = None
+        self._refreshed: dict[str, float] = {}
+        self._lock = threading.Lock()
+        atexit.register(self.flush)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key.replace(':', '_') + '.json')
+
+    @staticmethod
+    def _read(path: str) -> dict | None:
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return None
+        return {'cookies': state.get('cookies', []), 'origins': state.get('origins', [])}
+
+    def _load(self) -> dict[str, dict]:
+        if self._states is None:
+            self._states = {}
+            # 旧版状态最先读入，merged 中同名 cookie 以站点状态为准
+            if self.legacy_file and os.path.exists(self.legacy_file):
+                state = self._read(self.legacy_file)
+                if state is not None:
+                    self._states['legacy'] = state
+            if os.path.isdir(self.directory):
+                for name in sorted(os.listdir(self.directory)):
+                    if name.endswith('.json') and not name.startswith('.tmp_'):
+                        state = self._read(os.path.join(self.directory, name))
+                        if state is not None:
+                            self._states[name[:-len('.json')]] = state
+        return self._states
+
+    def has_state(self, url: str) -> bool:
+        """是否保存过该站点的 cookies。"""
+        return bool(self.cookies_for(url))
+
+    def cookies_for(self, url: str) -> list:
+        host = _host(url)
+        return [cookie for state in self._load().values() for cookie in state['cookies']
+                if domain_matches(host, cookie.get('domain', ''))]
+
+    def merged(self) -> dict:
+        """所有站点合并后的存储状态，可直接作为 new_context 的 storage_state。"""
+        cookies, origins = {}, {}
+        for state in self._load().values():
+            for cookie in state['cookies']:
+                cookies[_cookie_key(cookie)] = cookie
+            for origin in state['origins']:
+                origins[origin.get('origin')] = origin
+        return {'cookies': list(cookies.values()), 'origins': list(origins.values())}
+
+    def update(self, url: str, state: dict) -> bool:
+        """
+        用上下文导出的存储状态更新站点的状态，只保留属于该站点的 cookies 和 localStorage。
+
+        Returns:
+            bool: 状态是否变化（变化时已安排写回）
+        """
+        host = _host(url)
+        site_state = {
+            'cookies': sorted((c for c in state.get('cookies', []) if domain_matches(host, c.get('domain', ''))),
+                              key=lambda c: tuple(str(v) for v in _cookie_key(c))),
+            'origins': [o for o in state.get('origins', []) if domain_matches(host, _host(o.get('origin', '')))],
+        }
+        states = self._load()
+        if not site_state['cookies'] and not site_state['origins'] or states.get(host) == site_state:
+            return False
+        states[host] = site_state
+        with self._lock:
+            self._dirty.add(host)
+        self._schedule()
+        return True
+
+    async def refresh(self, context, url: str, force: bool = False, confirm=None) -> bool:
+        """
+        从上下文读取当前状态并更新站点，两次读取之间至少间隔 refresh_interval 秒。
+        confirm 为异步函数时先调用它确认已登录，返回 False 时不保存，未登录的状态不会覆盖已保存的登录状态。
+        """
+        host = _host(url)
+        now = time.monotonic()
+        if not force and now - self._refreshed.get(host, float('-inf')) < self.refresh_interval:
+            return False
+        self._refreshed[host] = now
+        try:
+            if confirm is not None and not await confirm():
+                return False
+            state = await context.storage_state()
+        except Exception:
+            return False
+        return self.update(url, state)
+
+    def _schedule(self):
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.flush()
+            return
+        # 上一个事件循环结束时未触发的定时器不再有效，由 atexit 或新的定时器写回
+        if self._timer is None or self._timer_loop is not loop:
+            self._timer = loop.call_later(self.debounce, self._flush_later)
+            self._timer_loop = loop
+
+    def _flush_later(self):
+        self._timer = None
+        # 写盘放到线程池，不阻塞事件循环
+        asyncio.get_running_loop().run_in_executor(None, self.flush)
+
+    def flush(self):
+        """把有变化的站点状态写回磁盘。"""
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+            if not dirty:
+                return
+            os.makedirs(self.directory, exist_ok=True)
+            for key in dirty:
+                state = self._load().get(key)
+                if state is None:
+                    continue
+                fd, tmp = tempfile.mkstemp(dir=self.directory, prefix='.tmp_', suffix='.json')
+                try:
+                    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                        json.dump(state, f, ensure_ascii=False)
+                    os.replace(tmp, self._path(key))
+                except OSError:
+                    try:
+                        os.remove(tmp)
+                    except OSError:
+                        pass
+                    self._dirty.add(key)
+
+storage_states = StorageStateManager()
@@ -0,0 +1,54 @@
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List
+from completion import on_page_signal, SIGNAL_BINDING
+from script_registry import registry
+
+@dataclass
+class ChatEvent:
+    """
+    stream_chat_many 产生的事件。
+
+    kind 为 delta 时 text 是新增文本、snapshot 是当前完整回答（文本被站点改写时
+    delta 无法表达，以 snapshot 为准）；kind 为 final 时 messages 是完整对话；
+    kind 为 error 时 text 是错误信息。cached 表示 final 事件的回答来自缓存。
+    status 为 final / error 事件对应的站点结果状态（complete / partial / timed_out / failed / skipped）。
+    """
+    site: str
+    kind: str
+    text: str = ''
+    snapshot: str = ''
+    messages: List[Dict[str, str]] = field(default_factory=list)
+    cached: bool = False
+    status: str = ''
+
+class PartialTextWatcher:
+    """
+    用 MutationObserver 驱动站点的提取脚本，把回答的增量文本回调给 Python。
+    """
+    def __init__(self, code: str, callback: Callable[[str, str], None], throttle_ms: int = 200) -> None:
+        self.code = code
+        self.callback = callback
+        self.throttle_ms = throttle_ms
+        self.snapshot = ''
+        self._unsubscribe = None
+
+    async def start(self, page):
+        self.page = page
+        self._unsubscribe = await on_page_signal(page, self._on_signal)
+        key = await registry.ensure_extractor(page, self.code)
+        await registry.call(page, 'watchPartial', SIGNAL_BINDING, key, self.throttle_ms)
+
+    def _on_signal(self, kind, payload):
+        if kind != 'partial' or not isinstance(payload, str):
+            return
+        delta = payload[len(self.snapshot):] if payload.startswith(self.snapshot) else payload
+        self.snapshot = payload
+        self.callback(delta, payload)
+
+    async def stop(self):
+        if self._unsubscribe:
+            self._unsubscribe()
+        try:
+            await registry.call(self.page, 'stopPartial')
+        except Exception:
+            pass
@@ -0,0 +1,67 @@
+import asyncio
+import random
+from dataclasses import dataclass
+from configuration import timing_profile
+from webpage_analyzer import simulate_human_behavior
+
+@dataclass(frozen=True)
+class TimingProfile:
+    """
+    页面操作的节奏配置。
+
+    human_simulation: full 为完整的滚动/鼠标模拟，light 为一次鼠标移动，none 不模拟
+    pre_eval_delay / post_eval_delay: 执行脚本前后在就绪信号之外附加的随机等待（秒）
+    load_state: 执行脚本后等待的加载状态
+    ready_timeout: 等待就绪信号（选择器、加载状态）的上限（秒）
+    """
+    name: str
+    human_simulation: str
+    pre_eval_delay: tuple[float, float]
+    post_eval_delay: tuple[float, float]
+    load_state: str = 'domcontentloaded'
+    ready_timeout: float = 15.0
+
+PROFILES = {
+    # 原有行为：完整模拟真人操作并保留随机等待
+    'stealth': TimingProfile('stealth', 'full', (1, 3), (3, 5)),
+    'balanced': TimingProfile('balanced', 'light', (0.2, 0.6), (0.3, 0.8)),
+    'fast': TimingProfile('fast', 'none', (0, 0), (0, 0)),
+}
+
+def get_profile(profile: "str | TimingProfile | None" = None) -> TimingProfile:
+    """按名称取节奏配置，未指定时使用 TIMING_PROFILE 环境变量（默认 balanced）。"""
+    if isinstance(profile, TimingProfile):
+        return profile
+    name = profile or timing_profile
+    if name not in PROFILES:
+        raise ValueError(f"未知的节奏配置: {name}，可选: {', '.join(PROFILES)}")
+    return PROFILES[name]
+
+async def _jitter(delay: tuple[float, float]):
+    low, high = delay
+    if high > 0:
+        await asyncio.sleep(random.uniform(low, high))
+
+async def wait_ready(page, profile: TimingProfile, selector: str = ''):
+    """
+    执行脚本前的等待：按配置模拟真人操作，然后等待目标选择器出现，而不是固定休眠。
+    """
+    if profile.human_simulation == 'full':
+        await simulate_human_behavior(page)
+    elif profile.human_simulation == 'light':
+        await page.mouse.move(random.randint(100, 800), random.randint(100, 600), steps=random.randint(3, 8))
+    if selector:
+        try:
+            await page.wait_for_selector(selector, state='attached', timeout=profile.ready_timeout * 1000)
+        except Exception:
+            # 选择器可能位于 shadow DOM 或 iframe 中，交给页面内脚本继续查找
+            pass
+    await _jitter(profile.pre_eval_delay)
+
+async def settle(page, profile: TimingProfile):
+    """执行脚本后的等待：等待加载状态，再附加配置中的随机间隔。"""
+    try:
+        await page.wait_for_load_state(profile.load_state, timeout=profile.ready_timeout * 1000)
+    except Exception:
+        pass
+    await _jitter(profile.post_eval_delay)
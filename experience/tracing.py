@@ -0,0 +1,196 @@
+import argparse
+import atexit
+import contextvars
+import functools
+import json
+import os
+import secrets
+import statistics
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List
+from configuration import trace_export, trace_file
+
+@functools.lru_cache(maxsize=None)
+def _load_otel():
+    """opentelemetry 只在启用 otel 导出时导入，未安装时返回 None。"""
+    try:
+        from opentelemetry import trace as otel_trace
+    except ImportError:
+        return None
+    return otel_trace
+
+_current: contextvars.ContextVar = contextvars.ContextVar('pq_span', default=None)
+
+def percentile(values: List[float], p: float) -> float:
+    if not values:
+        return float('nan')
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(p / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+class Span:
+    """一个阶段的计时记录，site 为所属站点 URL。"""
+    __slots__ = ('name', 'site', 'attrs', 'trace_id', 'span_id', 'parent_id', 'start', 'duration_ms', 'status',
+                 'error', '_t0', '_otel')
+
+    def __init__(self, name: str, site: str, attrs: dict, parent: "Span | None") -> None:
+        self.name = name
+        self.site = site
+        self.attrs = attrs
+        self.trace_id = parent.trace_id if parent is not None else secrets.token_hex(16)
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent.span_id if parent is not None else None
+        self.start = time.time()
+        self.duration_ms = 0.0
+        self.status = 'ok'
+        self.error = None
+        self._t0 = time.perf_counter()
+        self._otel = None
+
+    def set(self, key: str, value):
+        self.attrs[key] = value
+
+    def fail(self, error: BaseException):
+        self.status = 'error'
+        self.error = f"{type(error).__name__}: {error}"
+
+    def to_dict(self) -> dict:
+        record = {'name': self.name, 'site': self.site, 'trace_id': self.trace_id, 'span_id': self.span_id,
+                  'parent_id': self.parent_id, 'start': self.start, 'duration_ms': round(self.duration_ms, 3),
+                  'status': self.status}
+        if self.error:
+            record['error'] = self.error
+        if self.attrs:
+            record['attrs'] = self.attrs
+        return record
+
+class Tracer:
+    """
+    流水线各阶段（启动浏览器、创建上下文、goto、填写、发送、等待完成、提取、截图）的计时。
+    span 按站点 URL 标记，结束后缓冲写入本地 JSONL 文件；安装了 opentelemetry 且
+    TRACE_EXPORT 包含 otel 时同时导出为 OpenTelemetry span。
+
+    export: off / jsonl / otel / jsonl,otel
+    """
+    def __init__(self, export: str = trace_export, path: str = trace_file, buffer_size: int = 64) -> None:
+        exports = {item.strip() for item in (export or '').split(',')}
+        self.path = path if 'jsonl' in exports and path else ''
+        otel_trace = _load_otel() if 'otel' in exports else None
+        self.otel = otel_trace.get_tracer('polyquery') if otel_trace is not None else None
+        self.enabled = bool(self.path or self.otel)
+        self.buffer_size = buffer_size
+        self._buffer: list[dict] = []
+        self._lock = threading.Lock()
+        atexit.register(self.flush)
+
+    @staticmethod
+    def current_site() -> str:
+        """当前 span 所属的站点，不在 span 中时返回空字符串。"""
+        span = _current.get()
+        return span.site if span is not None else ''
+
+    @staticmethod
+    def fail(error: BaseException):
+        """把当前 span 标记为出错，用于捕获异常后不再向外抛出的调用方。"""
+        span = _current.get()
+        if span is not None:
+            span.fail(error)
+
+    @contextmanager
+    def span(self, name: str, site: str = '', **attrs) -> Iterator[Span | None]:
+        """
+        记录一个阶段：with tracer.span('goto', site=url): await page.goto(url)
+
+        未指定 site 时继承外层 span 的站点。未启用导出时不做任何记录。
+        """
+        if not self.enabled:
+            yield None
+            return
+        parent = _current.get()
+        span = Span(name, site or (parent.site if parent is not None else ''), attrs, parent)
+        if self.otel is not None:
+            context = _load_otel().set_span_in_context(parent._otel) if parent is not None and parent._otel is not None else None
+            span._otel = self.otel.start_span(name, context=context, start_time=time.time_ns(),
+                                              attributes={'site': span.site, **{k: str(v) for k, v in attrs.items()}})
+        token = _current.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.fail(e)
+            raise
+        finally:
+            _current.reset(token)
+            span.duration_ms = (time.perf_counter() - span._t0) * 1000
+            self._finish(span)
+
+    def _finish(self, span: Span):
+        if span._otel is not None:
+            if span.status == 'error':
+                otel_trace = _load_otel()
+                span._otel.set_status(otel_trace.Status(otel_trace.StatusCode.ERROR, span.error))
+            span._otel.end()
+        if self.path:
+            with self._lock:
+                self._buffer.append(span.to_dict())
+                if len(self._buffer) < self.buffer_size:
+                    return
+                records, self._buffer = self._buffer, []
+            self._write(records)
+
+    def _write(self, records: list[dict]):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # 一次 write 追加整批记录，多个分片进程写同一文件时行不会交错
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(''.join(json.dumps(record, ensure_ascii=False) + '\n' for record in records))
+
+    def flush(self):
+        """把缓冲的 span 写入文件。"""
+        with self._lock:
+            records, self._buffer = self._buffer, []
+        if records:
+            self._write(records)
+
+tracer = Tracer()
+
+def read_spans(path: str = trace_file) -> Iterator[dict]:
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                continue
+
+def summarize(spans) -> Dict[str, Dict[str, Dict]]:
+    """按站点、阶段统计 span 耗时的 p50 / p95（毫秒）和出错次数。"""
+    durations: Dict[tuple, list] = {}
+    errors: Dict[tuple, int] = {}
+    for span in spans:
+        key = (span.get('site') or '-', span['name'])
+        durations.setdefault(key, []).append(span['duration_ms'])
+        if span.get('status') == 'error':
+            errors[key] = errors.get(key, 0) + 1
+    report: Dict[str, Dict[str, Dict]] = {}
+    for (site, name), values in sorted(durations.items()):
+        report.setdefault(site, {})[name] = {'count': len(values), 'errors': errors.get((site, name), 0),
+                                             'p50': percentile(values, 50), 'p95': percentile(values, 95),
+                                             'mean': statistics.fmean(values)}
+    return report
+
+def print_summary(report: Dict[str, Dict[str, Dict]]):
+    for site, stages in report.items():
+        print(site)
+        for name, stats in sorted(stages.items(), key=lambda item: -item[1]['p95']):
+            print(f"  {name:<16} n={stats['count']:<5} err={stats['errors']:<3} "
+                  f"p50={stats['p50']:.0f}ms  p95={stats['p95']:.0f}ms  mean={stats['mean']:.0f}ms")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="按站点和阶段汇总 span 耗时")
+    parser.add_argument('path', nargs='?', default=trace_file, help='span JSONL 文件')
+    parser.add_argument('--site', default='', help='只显示 URL 包含该字符串的站点')
+    args = parser.parse_args()
+    report = summarize(span for span in read_spans(args.path) if args.site in (span.get('site') or ''))
+    print_summary(report)
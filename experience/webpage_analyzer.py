@@ -1,95 +1,25 @@
-import json
 import asyncio
 import random
 import time
-import datetime
-from patchright.sync_api import sync_playwright
-from patchright.async_api import async_playwright
 # from llm_conversation import LLMConversation
-import tempfile
-import os
-from fake_useragent import UserAgent
-from configuration import cookie_file, browser_path
+from configuration import browser_path, login_timeout
+from login_state import login_cache, detect_login_required, origin_of
+from storage_state import storage_states
+from tracing import tracer
+from browser_pool import (HIDE_AUTOMATION_JS, BROWSER_ARGS, get_random_user_agent, get_random_locale, get_random_timezone,
+                          current_browser_pool, scoped_browser_pool)
 # print(browser_path)
 
-# Initialize fake user agent generator
-try:
-    ua = UserAgent()
-except:
-    ua = None
-
-# List of User-Agents for simulating real browsers (fallback)
-USER_AGENTS = [
-    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/131.0.0.0 Safari/537.36",
-    "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/131.0.0.0 Safari/537.36",
-    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/130.0.0.0 Safari/537.36",
-    "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:133.0) Gecko/20100101 Firefox/133.0",
-    "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/18.1.1 Safari/605.1.15",
-    "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/131.0.0.0 Safari/537.36",
-]
-
-# List of languages and timezones for randomization
-LANGUAGES = ['en-US', 'zh-CN', 'ja-JP', 'ko-KR', 'de-DE', 'fr-FR']
-TIMEZONES = ['America/New_York', 'Europe/London', 'Asia/Shanghai', 'Asia/Tokyo', 'Europe/Berlin', 'America/Los_Angeles']
-
-def get_random_user_agent():
-    """Return a random User-Agent using fake-useragent or fallback."""
-    # if ua:
-    #     try:
-    #         return ua.random
-    #     except Exception as e:
-    #         print(f"使用 fake-useragent 失败，回退到静态列表: {e}")
-    return random.choice(USER_AGENTS)
-
-def get_random_locale():
-    """Return a random locale."""
-    return random.choice(LANGUAGES)
-
-def get_random_timezone():
-    """Return a random timezone."""
-    return random.choice(TIMEZONES)
-
 async def hide_automation_features(page):
     """Hide automation features by modifying browser properties."""
-    await page.evaluate("""
-        // Hide webdriver property
-        Object.defineProperty(navigator, 'webdriver', {
-            get: () => undefined,
-        });
-
-        // Mock plugins
-        Object.defineProperty(navigator, 'plugins', {
-            get: () => [
-                {name: 'Chrome PDF Plugin', description: 'Portable Document Format', filename: 'internal-pdf-viewer'},
-                {name: 'Chrome PDF Viewer', description: '', filename: 'mhjfbmdgcfjbbpaeojofohoefgiehjai'},
-                {name: 'Native Client', description: '', filename: 'internal-nacl-plugin'},
-            ],
-        });
-
-        // Mock languages
-        Object.defineProperty(navigator, 'languages', {
-            get: () => ['zh-CN', 'zh', 'en'],
-        });
-
-        // Mock permissions
-        const originalQuery = window.navigator.permissions.query;
-        window.navigator.permissions.query = (parameters) => (
-            parameters.name === 'notifications' ?
-                Promise.resolve({ state: Notification.permission }) :
-                originalQuery(parameters)
-        );
-
-        // Remove automation indicators
-        delete window.cdc_adoQpoasnfa76pfcZLmcfl_Array;
-        delete window.cdc_adoQpoasnfa76pfcZLmcfl_Promise;
-        delete window.cdc_adoQpoasnfa76pfcZLmcfl_Symbol;
-        delete window.cdc_adoQpoasnfa76pfcZLmcfl_JSON;
-        delete window.cdc_adoQpoasnfa76pfcZLmcfl_Object;
-        delete window.cdc_adoQpoasnfa76pfcZLmcfl_Proxy;
-    """)
+    await page.evaluate(HIDE_AUTOMATION_JS)
 
 async def simulate_human_behavior(page):
     """Simulate human-like browsing behavior."""
+    with tracer.span('simulate'):
+        await _simulate_human_behavior(page)
+
+async def _simulate_human_behavior(page):
     # Random scrolling
     for _ in range(random.randint(1, 5)):
         scroll_distance = random.randint(100, 500)
@@ -109,186 +39,147 @@ async def simulate_human_behavior(page):
     await page.evaluate("window.scrollTo(0, 0)")
     await asyncio.sleep(random.uniform(0.5, 2))
 
-async def check_login_required(url: str) -> bool:
+async def check_login_required(url: str, page=None) -> bool:
     """
-    使用 playwright 检查 URL 是否需要登录。
+    检查 URL 是否需要登录。结果按 origin 缓存，站点配置的会话 cookies 未过期时直接视为已登录；
+    传入 page 时在该页面上检测，不再单独打开页面。
     """
-    playwright_instance, browser, context, page = await create_browser_context(headless=False)
-    try:
-        await page.goto(url, wait_until='domcontentloaded')
-        # 模拟轻微用户行为
-        await asyncio.sleep(random.uniform(0.5, 2))
-        await page.mouse.move(random.randint(100, 500), random.randint(100, 500))
-        await asyncio.sleep(random.uniform(0.5, 1))
-        content = await page.inner_text('body')
-        content = content.lower()
-        # 检查是否有登录相关关键词
-        login_keywords = ['login', 'sign in', '请登录', '登录', 'signin', 'log in','sign up']
-        return any(keyword in content for keyword in login_keywords)
-    finally:
-        await browser.close()
-        await playwright_instance.stop()
+    cached = login_cache.get(url)
+    if cached is not None:
+        return cached
+    if page is None:
+        async with scoped_browser_pool() as pool, pool.lease() as page:
+            await page.goto(url, wait_until='domcontentloaded')
+            required = await detect_login_required(page)
+    else:
+        if page.url == 'about:blank':
+            await page.goto(url, wait_until='domcontentloaded')
+        required = await detect_login_required(page)
+    login_cache.set(url, required)
+    return required
+
+_login_locks: dict[str, asyncio.Lock] = {}
+
+async def wait_for_login(page, url: str, logged_in_selector: str = '', timeout: float = login_timeout,
+                         interval: float = 1.0) -> bool:
+    """
+    异步等待用户在页面上完成登录，不阻塞事件循环中的其他任务。
 
-async def handle_login(url: str, storage_state_file: str = cookie_file):
+    配置了 logged_in_selector 时以该选择器出现为准；否则在页面离开登录页（URL 变化），
+    或之前出现过的登录入口消失时视为完成。用户关闭窗口或超时返回 False。
     """
-    使用有头 playwright 让用户手动登录，并保存存储状态。
+    start_url = page.url
+    seen_login = False
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if page.is_closed():
+            return False
+        try:
+            if logged_in_selector:
+                if await page.query_selector(logged_in_selector) is not None:
+                    return True
+            elif await detect_login_required(page):
+                seen_login = True
+            elif seen_login or page.url != start_url:
+                return True
+        except Exception:
+            # 登录过程中页面可能正在跳转，下一轮再检测
+            pass
+        await asyncio.sleep(interval)
+    return False
+
+async def handle_login(url: str, logged_in_selector: str = '', timeout: float = login_timeout) -> bool:
     """
-    playwright_instance = await async_playwright().start()
-    browser = await playwright_instance.chromium.launch(
-        headless=False,
-        executable_path=browser_path,
-        args=[
-            '--disable-blink-features=AutomationControlled',
-            '--disable-extensions',
-            '--no-first-run',
-            '--disable-default-apps',
-            '--disable-infobars',
-            '--disable-web-security',
-            '--disable-features=VizDisplayCompositor',
-            '--disable-ipc-flooding-protection',
-            '--disable-background-timer-throttling',
-            '--disable-renderer-backgrounding',
-            '--disable-backgrounding-occluded-windows',
-            '--disable-dev-shm-usage',
-            '--no-sandbox',
-            '--disable-gpu',
-            '--disable-software-rasterizer',
-            '--disable-background-networking',
-            '--disable-component-extensions-with-background-pages',
-            '--disable-features=TranslateUI,BlinkGenPropertyTrees'
-            # 注意：不设置 --window-position，让窗口可见以便用户登录
-        ]
-    )
-    context = await browser.new_context(
-        user_agent=get_random_user_agent(),
-        viewport={'width': random.randint(1000, 1200), 'height': random.randint(500, 780)},
-        locale=get_random_locale(),
-        timezone_id=get_random_timezone(),
-        ignore_https_errors=True,
-        permissions=['geolocation'],
-        geolocation={'latitude': random.uniform(-90, 90), 'longitude': random.uniform(-180, 180)},
-        storage_state=storage_state_file
-    )
-    page = await context.new_page()
-    try:
-        await page.goto(url, wait_until='domcontentloaded')
-        # 模拟用户行为以绕过反爬虫
-        await asyncio.sleep(random.uniform(1, 3))
-        await page.mouse.move(random.randint(100, 500), random.randint(100, 500))
-        await asyncio.sleep(random.uniform(0.5, 2))
-        await page.evaluate("window.scrollTo(0, document.body.scrollHeight / 4)")
-        await asyncio.sleep(random.uniform(1, 3))
-        await page.mouse.move(random.randint(600, 1000), random.randint(200, 600))
-        await asyncio.sleep(random.uniform(0.5, 2))
-        # 等待用户登录
-        input("请在浏览器中完成登录后，按 Enter 键继续...")
-        await context.storage_state(path=storage_state_file)
-    finally:
-        await browser.close()
-        await playwright_instance.stop()
+    使用有头 playwright 让用户手动登录，登录完成后把站点的存储状态交给 storage_states 保存。
+    同一站点同时只打开一个登录窗口，等待期间其他站点的查询照常进行。
 
-async def create_browser_context(headless: bool = False, storage_state_file: str = cookie_file):
+    Returns:
+        bool: 是否在超时前完成登录
     """
-    创建浏览器上下文，统一管理浏览器启动和配置。
-
-    Args:
-        headless: 是否无头模式
-        load_storage_state: 是否加载存储状态
-        storage_state_file: 存储状态文件路径
+    lock = _login_locks.setdefault(origin_of(url), asyncio.Lock())
+    async with lock:
+        if storage_states.has_state(url) and login_cache.get(url) is False:
+            # 等锁期间另一个任务已完成该站点的登录
+            return True
+        from patchright.async_api import async_playwright
+        playwright_instance = await async_playwright().start()
+        # 不设置 --window-position，让窗口可见以便用户登录
+        browser = await playwright_instance.chromium.launch(
+            headless=False,
+            executable_path=browser_path,
+            args=BROWSER_ARGS
+        )
+        try:
+            context = await browser.new_context(
+                user_agent=get_random_user_agent(),
+                viewport={'width': random.randint(1000, 1200), 'height': random.randint(500, 780)},
+                locale=get_random_locale(),
+                timezone_id=get_random_timezone(),
+                ignore_https_errors=True,
+                permissions=['geolocation'],
+                geolocation={'latitude': random.uniform(-90, 90), 'longitude': random.uniform(-180, 180)},
+                storage_state=storage_states.merged()
+            )
+            await context.add_init_script(HIDE_AUTOMATION_JS)
+            page = await context.new_page()
+            await page.goto(url, wait_until='domcontentloaded')
+            print(f"请在浏览器中完成 {url} 的登录，登录完成后会自动继续...")
+            logged_in = await wait_for_login(page, url, logged_in_selector, timeout)
+            if logged_in:
+                storage_states.update(url, await context.storage_state())
+                login_cache.set(url, False)
+            else:
+                # 登录未完成时不保留“需要登录”的缓存，下次重新检测
+                login_cache.invalidate(url)
+                print(f"{url} 登录未完成")
+            return logged_in
+        finally:
+            await browser.close()
+            await playwright_instance.stop()
+
+async def ensure_login(url: str, page=None) -> bool:
+    """
+    与原有行为一致，只在没有保存过该站点的存储状态且页面上有登录入口时引导用户登录，
+    并把新的登录状态同步到共享浏览器池和传入页面所在的上下文。
 
     Returns:
-        tuple: (playwright_instance, browser, context, page)
+        bool: 是否刚完成登录（传入的页面需要重新加载）
     """
-    playwright_instance = await async_playwright().start()
-    browser = await playwright_instance.chromium.launch(
-        headless=headless,
-        executable_path=browser_path,
-        args=[
-            '--disable-blink-features=AutomationControlled',
-            '--disable-extensions',
-            '--no-first-run',
-            '--disable-default-apps',
-            '--disable-infobars',
-            '--disable-web-security',
-            '--disable-features=VizDisplayCompositor',
-            '--disable-ipc-flooding-protection',
-            '--disable-background-timer-throttling',
-            '--disable-renderer-backgrounding',
-            '--disable-backgrounding-occluded-windows',
-            '--disable-dev-shm-usage',
-            '--no-sandbox',
-            '--disable-gpu',
-            '--disable-software-rasterizer',
-            '--disable-background-networking',
-            '--disable-component-extensions-with-background-pages',
-            '--disable-features=TranslateUI,BlinkGenPropertyTrees',
-            '--window-position=-32000,-32000'
-        ]
-    )
-    context = await browser.new_context(
-        user_agent=get_random_user_agent(),
-        viewport={'width': random.randint(1200, 1920), 'height': random.randint(800, 1080)},
-        locale=get_random_locale(),
-        timezone_id=get_random_timezone(),
-        ignore_https_errors=True,
-        permissions=['geolocation'],
-        geolocation={'latitude': random.uniform(-90, 90), 'longitude': random.uniform(-180, 180)},
-        storage_state=storage_state_file
-    )
-    return playwright_instance, browser, context
+    if storage_states.has_state(url):
+        return False
+    if await check_login_required(url, page):
+        try:
+            logged_in = await handle_login(url)
+        except Exception as e:
+            # 没有图形界面等原因无法打开登录窗口时，按未登录继续分析页面
+            login_cache.invalidate(url)
+            print(f"无法打开 {url} 的登录窗口: {e}")
+            return False
+        if logged_in:
+            pool = current_browser_pool()
+            if pool is not None:
+                await pool.reload_storage_state()
+            if page is not None:
+                await page.context.add_cookies(storage_states.merged()['cookies'])
+            return True
+    return False
 
 
 async def get_picture(url: str) -> str:
     """
     使用playwright获取指定url的图片内容。
     """
-    # 检查是否需要登录
-    if await check_login_required(url):
-        if not os.path.exists(cookie_file):
-            await handle_login(url)
-    playwright_instance, browser, context, page = await create_browser_context(headless=False)
-    try:
-        # 访问网页
-        await page.goto(url, wait_until='networkidle')
-        # 模拟真实用户行为
-        await simulate_human_behavior(page)
-        # 额外等待，让页面完全加载
-        await asyncio.sleep(random.uniform(2, 5))
-        # 截取屏幕截图
-        screenshot_dir = 'screenshots'
-        os.makedirs(screenshot_dir, exist_ok=True)
-        timestamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
-        screenshot_path = os.path.join(screenshot_dir, f'screenshot_{timestamp}.png')
-        await page.screenshot(path=screenshot_path, full_page=True)
-    finally:
-        # 清理资源
-        await browser.close()
-        await playwright_instance.stop()
-    return screenshot_path
+    from page_analysis import PageAnalysisSession
+    async with scoped_browser_pool() as pool, PageAnalysisSession(url, pool) as session:
+        return await session.screenshot()
 
 async def get_html(url: str) -> str:
     """
     获取指定url对应的html内容
     """
-    # 检查是否需要登录
-    if await check_login_required(url):
-        if not os.path.exists(cookie_file):
-            await handle_login(url)
-
-    playwright_instance, browser, context, page = await create_browser_context(headless=False)
-    try:
-        # 访问网页
-        await page.goto(url, wait_until='networkidle')
-        # 模拟真实用户行为
-        await simulate_human_behavior(page)
-        # 额外等待，让页面完全加载
-        await asyncio.sleep(random.uniform(2, 5))
-        html = await page.content()
-    finally:
-        # 清理资源
-        await browser.close()
-        await playwright_instance.stop()
-    return html
+    from page_analysis import PageAnalysisSession
+    async with scoped_browser_pool() as pool, PageAnalysisSession(url, pool) as session:
+        return await session.get_html()
 
 async def get_elements_at_position(url: str, x: int, y: int) -> list:
     """
@@ -302,44 +193,19 @@ async def get_elements_at_position(url: str, x: int, y: int) -> list:
     Returns:
         list: 包含该位置所有元素的列表，每个元素包含tagName, id, className, outerHTML等信息
     """
-    # 检查是否需要登录
-    if await check_login_required(url):
-        if not os.path.exists(cookie_file):
-            await handle_login(url)
+    return (await get_elements_at_positions(url, [(x, y)]))[0]
 
-    playwright_instance, browser, context, page = await create_browser_context(headless=False)
-    try:
-        # 访问网页
-        await page.goto(url, wait_until='networkidle')
-        # 模拟真实用户行为
-        await simulate_human_behavior(page)
-        # 额外等待，让页面完全加载
-        await asyncio.sleep(random.uniform(2, 5))
+async def get_elements_at_positions(url: str, points: list) -> list:
+    """
+    加载一次页面，获取多个坐标处的所有HTML元素。
 
-        # 使用page.evaluate获取指定坐标处的元素
-        elements = await page.evaluate(f"""
-            () => {{
-                const elements = document.elementsFromPoint({x}, {y});
-                return elements.map(element => {{
-                    return {{
-                        tagName: element.tagName,
-                        id: element.id,
-                        className: element.className,
-                        outerHTML: element.outerHTML.length > 200 ? element.outerHTML.substring(0, 200) + '...' : element.outerHTML,
-                        boundingRect: {{
-                            left: element.getBoundingClientRect().left,
-                            top: element.getBoundingClientRect().top,
-                            width: element.getBoundingClientRect().width,
-                            height: element.getBoundingClientRect().height
-                        }},
-                        textContent: element.textContent ? element.textContent.trim().substring(0, 100) : ''
-                    }};
-                }});
-            }}
-        """)
+    Args:
+        url (str): 网页URL
+        points (list): (x, y) 坐标列表
 
-        return elements
-    finally:
-        # 清理资源
-        await browser.close()
-        await playwright_instance.stop()
+    Returns:
+        list: 与 points 对齐，每项为该位置的元素列表，格式同 get_elements_at_position
+    """
+    from page_analysis import PageAnalysisSession
+    async with scoped_browser_pool() as pool, PageAnalysisSession(url, pool) as session:
+        return await session.elements_at(points)